@@ -0,0 +1,19 @@
+from django.urls import path
+
+from .async_views import (
+    AsyncMovieDetail,
+    AsyncMovieList,
+    AsyncMovieSearch,
+    AsyncReviewList,
+    AsyncUserList,
+)
+
+# Async versions of the read endpoints in api/urls.py, at the same paths
+urlpatterns = [
+    path("movies", AsyncMovieList.as_view()),
+    path("movies/search", AsyncMovieSearch.as_view()),
+    path("movies/<uuid:pk>", AsyncMovieDetail.as_view()),
+    path("movies/<uuid:pk>/reviews", AsyncReviewList.as_view()),
+    path("users/<int:pk>/favorites", AsyncUserList.as_view(list_name="favorites")),
+    path("users/<int:pk>/watchlist", AsyncUserList.as_view(list_name="watchlist")),
+]
@@ -0,0 +1,171 @@
+"""
+Async versions of the hot read endpoints, mounted under /api/v1/async/.
+
+Each one answers GET with the same body as its counterpart in
+api/views.py, but as a coroutine reading through the async ORM (``aget``,
+``ain_bulk``, ``async for`` with prefetches), so under movie/asgi.py a
+request waiting on the database holds no worker thread. They take the
+same query parameters, ``?stream=`` aside, and the same conditional GET
+headers. Writes stay on the sync views.
+
+Search ranks movies with search.search_movies(), whose queries run in one
+hop to a thread; the movies ranked are then read like the others. Cursor
+pages are DRF's own, also made in one hop (api/pagination.py).
+
+``manage.py benchmark_async`` compares both under load.
+"""
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import HttpResponse
+from django.views import View
+from rest_framework.exceptions import APIException
+from rest_framework.filters import OrderingFilter
+from rest_framework.request import Request
+
+from api import fieldsets, search, versions, viewcounts
+from api.models import MovieInfo, Review
+from api.pagination import (
+    AsyncMovieCursorPagination,
+    AsyncReviewCursorPagination,
+    SearchPagination,
+)
+from api.renderers import ORJSONRenderer
+from api.serializers import MovieInfoSerializer, ReviewSerializer
+
+
+User = get_user_model()
+
+
+def render(data, status=200):
+    return HttpResponse(
+        ORJSONRenderer().render(data), status=status, content_type="application/json"
+    )
+
+
+class AsyncReadView(View):
+    """
+    A read-only view answering errors the way DRF would.
+    """
+
+    http_method_names = ["get", "head", "options"]
+
+    async def dispatch(self, request, *args, **kwargs):
+        # DRF's request, for the query parameter helpers and paginators
+        request = Request(request)
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            # Bodies as DRF's exception handler makes them, e.g. the 404 for
+            # a bad ?cursor=
+            if isinstance(exc.detail, (list, dict)):
+                return render(exc.detail, status=exc.status_code)
+            return render({"detail": exc.detail}, status=exc.status_code)
+        except ObjectDoesNotExist as exc:
+            # Worded as get_object_or_404() words it
+            model = type(exc).__qualname__.rsplit(".", 1)[0]
+            return render({"detail": f"No {model} matches the given query."}, status=404)
+
+
+async def movie_list_response(request, queryset, view=None):
+    """api.views.movie_list_response(), without streaming."""
+    fields = fieldsets.requested(request, MovieInfoSerializer)
+    queryset = queryset.with_related(fields)
+
+    paginator = AsyncMovieCursorPagination()
+    page = await paginator.apaginate_queryset(queryset, request, view=view)
+
+    if page is None:
+        movies = [movie async for movie in queryset]
+        return render(MovieInfoSerializer(movies, many=True, fields=fields).data)
+
+    serializer = MovieInfoSerializer(page, many=True, fields=fields)
+    return render(paginator.get_paginated_response(serializer.data).data)
+
+
+class AsyncMovieList(AsyncReadView):
+    filter_backends = [OrderingFilter]
+    ordering_fields = ["average_rating", "media_title", "media_release_date"]
+    ordering = ["id"]
+
+    @versions.aconditional(lambda view, request, **kwargs: [versions.CATALOG])
+    async def get(self, request):
+        queryset = OrderingFilter().filter_queryset(
+            request, MovieInfo.objects.all(), self
+        )
+        return await movie_list_response(request, queryset, view=self)
+
+
+class AsyncMovieDetail(AsyncReadView):
+    @versions.aconditional(lambda view, request, pk: [versions.movie_key(pk)])
+    async def get(self, request, pk):
+        fields = fieldsets.requested(request, MovieInfoSerializer)
+        movie = await MovieInfo.objects.with_related(fields).aget(pk=pk)
+        return render(MovieInfoSerializer(movie, fields=fields).data)
+
+    async def dispatch(self, request, *args, **kwargs):
+        response = await super().dispatch(request, *args, **kwargs)
+        # Buffered, see api/viewcounts.py
+        if request.method == "GET" and response.status_code in (200, 304):
+            viewcounts.counter.record(kwargs["pk"])
+        return response
+
+
+class AsyncReviewList(AsyncReadView):
+    filter_backends = [OrderingFilter]
+    ordering_fields = ["created"]
+    ordering = ["-created"]
+
+    @versions.aconditional(lambda view, request, pk: [versions.movie_key(pk)])
+    async def get(self, request, pk):
+        queryset = OrderingFilter().filter_queryset(
+            request, Review.objects.filter(movie=pk).select_related("user"), self
+        )
+        paginator = AsyncReviewCursorPagination()
+        page = await paginator.apaginate_queryset(queryset, request, view=self)
+
+        if page is None:
+            reviews = [review async for review in paginator.limit_unpaginated(queryset)]
+            return render(ReviewSerializer(reviews, many=True).data)
+        serializer = ReviewSerializer(page, many=True)
+        return render(paginator.get_paginated_response(serializer.data).data)
+
+
+class AsyncMovieSearch(AsyncReadView):
+    async def get(self, request):
+        query = request.query_params.get("q", "")
+        if not query:
+            return render({"error": "No search query provided."}, status=400)
+
+        hits = await sync_to_async(search.search_movies)(query)
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(hits, request, view=self)
+
+        fields = fieldsets.requested(request, MovieInfoSerializer)
+        movie_ids = [movie_id for movie_id, _ in page]
+        movies = await MovieInfo.objects.with_related(fields).ain_bulk(movie_ids)
+        serializer = MovieInfoSerializer(
+            [movies[movie_id] for movie_id in movie_ids if movie_id in movies],
+            many=True,
+            fields=fields,
+        )
+
+        if paginator.is_requested(request):
+            return render(paginator.get_paginated_response(serializer.data).data)
+        return render(serializer.data)
+
+
+class AsyncUserList(AsyncReadView):
+    """A user's favorites or watchlist, named by ``list_name``."""
+
+    list_name = None
+
+    @versions.aconditional(
+        lambda view, request, pk: [versions.list_key(view.list_name, pk), versions.CATALOG]
+    )
+    async def get(self, request, pk):
+        user = await User.objects.aget(id=pk)
+        return await movie_list_response(
+            request, getattr(user, self.list_name).all(), view=self
+        )
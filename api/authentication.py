@@ -0,0 +1,82 @@
+"""
+Token authentication backed by an in-process LRU cache.
+
+``TokenAuthentication`` costs a token + user query on every request. This
+keeps recently seen tokens in memory for ``TOKEN_CACHE_TTL`` seconds.
+Entries are dropped as soon as a token is deleted (djoser's logout and
+token destroy endpoints) or its user is saved or deleted, see
+api/signals.py. Other worker processes (WEB_CONCURRENCY in the Dockerfile)
+only notice after the TTL, so it is a few seconds: enough to serve a
+client's bursts of requests from memory.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+
+
+class TokenCache:
+    def __init__(self, max_size=10_000, ttl=5):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            for key in [
+                key
+                for key, (_, (user, _)) in self._entries.items()
+                if user.pk == user_id
+            ]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(
+    max_size=getattr(settings, "TOKEN_CACHE_SIZE", 10_000),
+    ttl=getattr(settings, "TOKEN_CACHE_TTL", 5),
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            cached = super().authenticate_credentials(key)
+            token_cache.set(key, cached)
+
+        user, token = cached
+        # Each request gets its own instance, so nothing a view caches on the
+        # user leaks into other requests
+        return copy.copy(user), token
@@ -0,0 +1,61 @@
+"""
+Helpers for loading large numbers of rows.
+"""
+
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.constants import OnConflict
+
+
+# Keeps IN (...) clauses under SQLite's bound parameter limit
+CHUNK_SIZE = 500
+
+
+def chunked(items, size=CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def insert_rows(model, fields, rows, ignore_conflicts=False, using=DEFAULT_DB_ALIAS):
+    """
+    INSERT plain tuples of Python values into ``model``'s table.
+
+    Unlike ``bulk_create`` this never builds model instances, which
+    dominates the cost once rows run into the millions. No signals are sent
+    and no defaults are applied, so every column without a database default
+    must be listed in ``fields``.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in fields]
+    on_conflict = OnConflict.IGNORE if ignore_conflicts else None
+
+    sql = "{} {} ({}) VALUES ({}) {}".format(
+        connection.ops.insert_statement(on_conflict=on_conflict),
+        quote(model._meta.db_table),
+        ", ".join(quote(field.column) for field in fields),
+        ", ".join(["%s"] * len(fields)),
+        connection.ops.on_conflict_suffix_sql(fields, on_conflict, None, None),
+    )
+    prepare = [field.get_db_prep_value for field in fields]
+
+    with connection.cursor() as cursor:
+        for chunk in chunked(rows, CHUNK_SIZE * 10):
+            cursor.executemany(
+                sql,
+                [
+                    [prep(value, connection) for prep, value in zip(prepare, row)]
+                    for row in chunk
+                ],
+            )
+
+
+def reset_sequences(models, using=DEFAULT_DB_ALIAS):
+    """
+    Move auto-increment sequences past rows inserted with explicit ids.
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
@@ -0,0 +1,213 @@
+"""
+Movie credits, and the move to them from the old role tables.
+
+Who worked on a movie used to be spread over three role tables, one row
+per person (api_actor, api_writer, api_director), each linked to movies by
+its own many-to-many table. A movie's credits took six queries and a
+person's filmography three walks back through them, with nowhere to keep
+billing order. Credit holds all of it in one table, indexed both ways:
+
+* ``movie_credits()``: a movie's credits, by role then billing order,
+* ``filmography()``: a person's credits with their movies, newest first,
+
+each one query over one index.
+
+The app has no migrations, so ``migrate --run-syncdb`` creates the Credit
+table next to the old ones and ``manage.py migrate_credits`` copies them
+over (``copy_legacy()``), in the order the links were made, then
+optionally drops them. The old tables are described by models in a
+registry of their own, so the ORM can read, create and drop them without
+them being part of the app.
+"""
+
+import itertools
+
+from django.apps.registry import Apps
+from django.db import connection, models, transaction
+
+from api.bulk import insert_rows
+from api.models import Credit
+
+
+LEGACY_APPS = Apps()
+
+
+class _LegacyPerson(models.Model):
+    # The api_person table the role tables point at, which isn't legacy
+    id = models.UUIDField(primary_key=True)
+    name = models.CharField(max_length=80)
+
+    class Meta:
+        apps = LEGACY_APPS
+        app_label = "api"
+        db_table = "api_person"
+
+
+class LegacyActor(models.Model):
+    id = models.UUIDField(primary_key=True)
+    person = models.OneToOneField(_LegacyPerson, on_delete=models.CASCADE)
+
+    class Meta:
+        apps = LEGACY_APPS
+        app_label = "api"
+        db_table = "api_actor"
+
+
+class LegacyWriter(models.Model):
+    id = models.UUIDField(primary_key=True)
+    writer_credit = models.OneToOneField(_LegacyPerson, on_delete=models.CASCADE)
+
+    class Meta:
+        apps = LEGACY_APPS
+        app_label = "api"
+        db_table = "api_writer"
+
+
+class LegacyDirector(models.Model):
+    id = models.UUIDField(primary_key=True)
+    director_credit = models.OneToOneField(_LegacyPerson, on_delete=models.CASCADE)
+
+    class Meta:
+        apps = LEGACY_APPS
+        app_label = "api"
+        db_table = "api_director"
+
+
+# The many-to-many tables behind MovieInfo.actors_list, writers_list and
+# directors_list. Their foreign keys to api_movieinfo are left out, so
+# these models only need the legacy registry.
+class LegacyActorLink(models.Model):
+    movieinfo_id = models.UUIDField()
+    actor = models.ForeignKey(LegacyActor, on_delete=models.CASCADE)
+
+    class Meta:
+        apps = LEGACY_APPS
+        app_label = "api"
+        db_table = "api_movieinfo_actors_list"
+        unique_together = [("movieinfo_id", "actor")]
+
+
+class LegacyWriterLink(models.Model):
+    movieinfo_id = models.UUIDField()
+    writer = models.ForeignKey(LegacyWriter, on_delete=models.CASCADE)
+
+    class Meta:
+        apps = LEGACY_APPS
+        app_label = "api"
+        db_table = "api_movieinfo_writers_list"
+        unique_together = [("movieinfo_id", "writer")]
+
+
+class LegacyDirectorLink(models.Model):
+    movieinfo_id = models.UUIDField()
+    director = models.ForeignKey(LegacyDirector, on_delete=models.CASCADE)
+
+    class Meta:
+        apps = LEGACY_APPS
+        app_label = "api"
+        db_table = "api_movieinfo_directors_list"
+        unique_together = [("movieinfo_id", "director")]
+
+
+# (role, role table, its person column, link table, its role column)
+LEGACY = (
+    (Credit.ACTOR, LegacyActor, "person", LegacyActorLink, "actor"),
+    (Credit.WRITER, LegacyWriter, "writer_credit", LegacyWriterLink, "writer"),
+    (Credit.DIRECTOR, LegacyDirector, "director_credit", LegacyDirectorLink, "director"),
+)
+
+
+def movie_credits(movie_id):
+    return (
+        Credit.objects.filter(movie_id=movie_id)
+        .select_related("person")
+        .only("role", "order", "character", "person__id", "person__name", "person__image_url")
+        .order_by("role", "order")
+    )
+
+
+def filmography(person_id):
+    return (
+        Credit.objects.filter(person_id=person_id)
+        .select_related("movie")
+        .only(
+            "role",
+            "order",
+            "character",
+            "movie__id",
+            "movie__media_title",
+            "movie__media_release_date",
+            "movie__image_url",
+        )
+        .order_by("-movie__media_release_date", "movie_id", "role")
+    )
+
+
+def legacy_tables():
+    """Which of the old tables are still in the database."""
+    existing = set(connection.introspection.table_names())
+    return [
+        model._meta.db_table
+        for _, role_model, _, link_model, _ in LEGACY
+        for model in (role_model, link_model)
+        if model._meta.db_table in existing
+    ]
+
+
+def create_legacy_tables():
+    """
+    Create the old tables, empty. Only benchmarks and tests need them back.
+    """
+    with connection.schema_editor() as editor:
+        for _, role_model, _, link_model, _ in LEGACY:
+            editor.create_model(role_model)
+            editor.create_model(link_model)
+
+
+def drop_legacy_tables():
+    existing = set(legacy_tables())
+    with connection.schema_editor() as editor:
+        for _, role_model, _, link_model, _ in LEGACY:
+            for model in (link_model, role_model):
+                if model._meta.db_table in existing:
+                    editor.delete_model(model)
+
+
+def copy_legacy(batch_size=5000):
+    """
+    Copy the old tables into Credit, numbering each movie's credits per
+    role in the order they were linked. Credits already there are kept, so
+    running it again is harmless. Returns {role: links read}.
+    """
+    existing = set(legacy_tables())
+    copied = {}
+    with transaction.atomic():
+        for role, role_model, person_field, link_model, role_field in LEGACY:
+            if link_model._meta.db_table not in existing:
+                continue
+            links = (
+                link_model.objects.order_by("movieinfo_id", "id")
+                .values_list("movieinfo_id", f"{role_field}__{person_field}")
+                .iterator(chunk_size=batch_size)
+            )
+            count = 0
+            rows = []
+            for movie_id, movie_links in itertools.groupby(links, key=lambda link: link[0]):
+                for order, (_, person_id) in enumerate(movie_links):
+                    rows.append((movie_id, person_id, role, order, ""))
+                if len(rows) >= batch_size:
+                    count += _insert(rows)
+                    rows = []
+            count += _insert(rows)
+            copied[role] = count
+    return copied
+
+
+def _insert(rows):
+    insert_rows(
+        Credit,
+        ["movie", "person", "role", "order", "character"],
+        rows,
+        ignore_conflicts=True,
+    )
+    return len(rows)
@@ -0,0 +1,428 @@
+"""
+Faceted browsing of the catalog (movies/browse).
+
+Filtering by genre, release date and running time and counting how many
+movies each genre, year and runtime bucket would leave takes a GROUP BY
+over the genre table per request on the database. Here every process
+keeps bitmaps instead, one Python int per facet value with bit ``p`` set
+for the movie at position ``p``:
+
+* one per genre,
+* one per release year,
+* one per RUNTIME_BUCKET minutes of running time (the last one open ended).
+
+Filters combine by AND-ing bitmaps. A date or length range ORs together
+the years or buckets wholly inside it, and takes the movies of the two at
+its ends from their values kept sorted per year or bucket. Counting a
+facet value is one AND and a popcount.
+Year and runtime counts leave out the facet's own range, so a client
+narrowing the range still sees what lies outside it.
+
+Results are ordered by release date, title or average rating through
+sorted lists of ``(key, id, position)`` kept alongside: large results
+walk the list in order, small ones are sorted by key directly.
+
+The bitmaps are built from the database on first use and caught up from
+the version counters of api/versions.py, at most every
+FACETS_SYNC_SECONDS: movies whose keys were bumped since the last sync,
+which any change to a movie, its genres or its ratings does, are read
+again. Browse ETags are built from the catalog version the index was last
+synced at, not the database's, so they change when the results do.
+"""
+
+import bisect
+import datetime
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils import timezone
+
+from api import versions
+from api.bulk import chunked
+from api.models import MovieInfo
+from api.search import normalize
+
+
+RUNTIME_BUCKET = 30
+RUNTIME_BUCKETS = 7
+
+ORDERINGS = ("media_release_date", "media_title", "average_rating")
+DEFAULT_ORDERING = "-media_release_date"
+
+# Results at most this many times smaller than the catalog are sorted
+# directly instead of found by walking a sorted list
+SORT_RATIO = 16
+
+
+def year(ordinal):
+    return datetime.date.fromordinal(ordinal).year
+
+
+def runtime_bucket(length):
+    return min(max(length, 0) // RUNTIME_BUCKET, RUNTIME_BUCKETS - 1)
+
+
+def runtime_range(bucket):
+    """(shortest, longest) running time in ``bucket``, longest None if open."""
+    longest = None if bucket == RUNTIME_BUCKETS - 1 else (bucket + 1) * RUNTIME_BUCKET - 1
+    return bucket * RUNTIME_BUCKET, longest
+
+
+def positions(bitmap):
+    """The positions of the set bits of ``bitmap``, lowest first."""
+    # str.find skips runs of zeros in C, which beats shifting a large int
+    bits = bin(bitmap)[:1:-1]
+    found = []
+    position = bits.find("1")
+    while position >= 0:
+        found.append(position)
+        position = bits.find("1", position + 1)
+    return found
+
+
+def from_positions(found):
+    """The bitmap with the bits at positions ``found`` set."""
+    if not found:
+        return 0
+    bits = bytearray(b"0" * (max(found) + 1))
+    for position in found:
+        bits[-1 - position] = ord("1")
+    return int(bits, 2)
+
+
+class RangeFacet:
+    """
+    Bitmaps of one integer value per movie, grouped into buckets, and each
+    bucket's ``(value, position)`` pairs in order for the ends of ranges.
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.bitmaps = defaultdict(int)
+        self.values = defaultdict(list)
+
+    def add(self, position, value, keep_sorted=True):
+        key = self.bucket(value)
+        self.bitmaps[key] |= 1 << position
+        if keep_sorted:
+            bisect.insort(self.values[key], (value, position))
+        else:
+            self.values[key].append((value, position))
+
+    def sort(self):
+        for values in self.values.values():
+            values.sort()
+
+    def remove(self, position, value):
+        key = self.bucket(value)
+        self.bitmaps[key] &= ~(1 << position)
+        values = self.values[key]
+        del values[bisect.bisect_left(values, (value, position))]
+        if not values:
+            del self.bitmaps[key], self.values[key]
+
+    def select(self, low, high):
+        """
+        The movies whose value is within ``[low, high]``, either end None
+        for open.
+        """
+        low_key = None if low is None else self.bucket(low)
+        high_key = None if high is None else self.bucket(high)
+        selected = 0
+        partial = []
+        for key, bitmap in self.bitmaps.items():
+            if (low_key is not None and key < low_key) or (
+                high_key is not None and key > high_key
+            ):
+                continue
+            if key not in (low_key, high_key):
+                selected |= bitmap
+                continue
+            values = self.values[key]
+            start = 0 if low is None else bisect.bisect_left(values, (low,))
+            stop = len(values) if high is None else bisect.bisect_left(values, (high + 1,))
+            if stop - start == len(values):
+                selected |= bitmap
+            else:
+                partial.extend(position for _, position in values[start:stop])
+        return selected | from_positions(partial)
+
+    def counts(self, within):
+        found = {}
+        for key, bitmap in self.bitmaps.items():
+            count = (bitmap & within).bit_count()
+            if count:
+                found[key] = count
+        return dict(sorted(found.items()))
+
+
+class FacetIndex:
+    """
+    Facet bitmaps and sort orders over the catalog.
+    """
+
+    def __init__(self, rows=(), synced_at=None, catalog=(0, None)):
+        self.synced_at = synced_at
+        # versions.catalog_version() the rows are at least as new as
+        self.catalog = catalog
+        # position -> (id, title, release date ordinal, length, rating,
+        # genre names), None once removed
+        self.rows = []
+        # position -> {ordering: sort key}
+        self.keys = []
+        self.positions = {}
+        self.free = []
+        self.alive = 0
+        self.genres = defaultdict(int)
+        self.years = RangeFacet(year)
+        self.runtimes = RangeFacet(runtime_bucket)
+        self.sorted = {field: [] for field in ORDERINGS}
+        self.lock = threading.Lock()
+
+        for row in rows:
+            self._add(row, keep_sorted=False)
+        self.years.sort()
+        self.runtimes.sort()
+        for entries in self.sorted.values():
+            entries.sort()
+
+    def __len__(self):
+        return len(self.positions)
+
+    @staticmethod
+    def sort_keys(row):
+        movie_id, title, released, _, rating, _ = row
+        return {
+            "media_release_date": (released, movie_id),
+            "media_title": (normalize(title), movie_id),
+            "average_rating": (rating, movie_id),
+        }
+
+    def _add(self, row, keep_sorted=True):
+        movie_id, _, released, length, _, genres = row
+        keys = self.sort_keys(row)
+        position = self.free.pop() if self.free else len(self.rows)
+        if position == len(self.rows):
+            self.rows.append(row)
+            self.keys.append(keys)
+        else:
+            self.rows[position] = row
+            self.keys[position] = keys
+        self.positions[movie_id] = position
+
+        bit = 1 << position
+        self.alive |= bit
+        for genre in genres:
+            self.genres[genre] |= bit
+        self.years.add(position, released, keep_sorted)
+        self.runtimes.add(position, length, keep_sorted)
+        for field, key in keys.items():
+            if keep_sorted:
+                bisect.insort(self.sorted[field], (*key, position))
+            else:
+                self.sorted[field].append((*key, position))
+
+    def _remove(self, movie_id):
+        position = self.positions.pop(movie_id, None)
+        if position is None:
+            return
+        row = self.rows[position]
+        _, _, released, length, _, genres = row
+
+        mask = ~(1 << position)
+        self.alive &= mask
+        for genre in genres:
+            self.genres[genre] &= mask
+            if not self.genres[genre]:
+                del self.genres[genre]
+        self.years.remove(position, released)
+        self.runtimes.remove(position, length)
+        for field, key in self.keys[position].items():
+            entries = self.sorted[field]
+            del entries[bisect.bisect_left(entries, (*key, position))]
+        self.rows[position] = self.keys[position] = None
+        self.free.append(position)
+
+    def update(self, rows, removed=()):
+        """Add or replace ``rows`` and drop the movie ids in ``removed``."""
+        with self.lock:
+            for movie_id in removed:
+                self._remove(movie_id)
+            for row in rows:
+                self._remove(row[0])
+                self._add(row)
+
+    def sync(self):
+        """Read again every movie whose version was bumped since the last sync."""
+        started = timezone.now()
+        catalog = versions.catalog_version()
+        prefix = versions.movie_key("")
+        changed = versions.bumped_since(self.synced_at, [prefix])[prefix]
+        found = movie_rows(changed) if changed else []
+        self.update(found, changed - {row[0] for row in found})
+        self.synced_at = started
+        self.catalog = catalog
+        return len(changed)
+
+    def browse(
+        self,
+        genres=(),
+        released=(None, None),
+        length=(None, None),
+        ordering=DEFAULT_ORDERING,
+    ):
+        """
+        Filter the catalog. Movies must have every one of ``genres``
+        (names, in any case), and a release date ordinal and length within
+        the ``(low, high)`` ranges given.
+
+        Returns the matching movies as a sequence of ids in ``ordering``,
+        read a page at a time, and facet counts.
+        """
+        with self.lock:
+            by_name = {name.casefold(): bitmap for name, bitmap in self.genres.items()}
+            with_genres = self.alive
+            for genre in genres:
+                with_genres &= by_name.get(genre.casefold(), 0)
+
+            with_dates = with_lengths = with_genres
+            if released != (None, None):
+                with_dates &= self.years.select(*released)
+            if length != (None, None):
+                with_lengths &= self.runtimes.select(*length)
+            matched = with_dates & with_lengths
+
+            facets = {
+                "genres": sorted(
+                    (
+                        {"value": name, "count": count}
+                        for name, bitmap in self.genres.items()
+                        if (count := (bitmap & matched).bit_count())
+                    ),
+                    key=lambda facet: (-facet["count"], facet["value"]),
+                ),
+                "years": [
+                    {"value": key, "count": count}
+                    for key, count in self.years.counts(with_lengths).items()
+                ],
+                "runtimes": [
+                    {"min": shortest, "max": longest, "count": count}
+                    for key, count in self.runtimes.counts(with_dates).items()
+                    for shortest, longest in [runtime_range(key)]
+                ],
+            }
+            return Results(self, matched, ordering), facets
+
+    def page(self, matched, count, ordering, start, stop):
+        field = ordering.lstrip("-")
+        descending = ordering.startswith("-")
+        with self.lock:
+            if count * SORT_RATIO <= len(self.positions):
+                keys = [self.keys[position][field] for position in positions(matched)]
+                keys.sort(reverse=descending)
+                return [movie_id for _, movie_id in keys[start:stop]]
+
+            bits = bin(matched)[:1:-1]
+            entries = self.sorted[field]
+            found = []
+            skipped = 0
+            for *_, movie_id, position in reversed(entries) if descending else entries:
+                if position < len(bits) and bits[position] == "1":
+                    if skipped < start:
+                        skipped += 1
+                        continue
+                    found.append(movie_id)
+                    if len(found) >= stop - start:
+                        break
+            return found
+
+
+class Results:
+    """
+    The ids of the movies a browse matched, in order, as a sequence the
+    paginators in api/pagination.py can slice.
+    """
+
+    def __init__(self, index, matched, ordering):
+        self.index = index
+        self.matched = matched
+        self.total = matched.bit_count()
+        self.ordering = ordering
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item : item + 1][0]
+        start, stop, _ = item.indices(self.total)
+        if start >= stop:
+            return []
+        return self.index.page(self.matched, self.total, self.ordering, start, stop)
+
+
+def movie_rows(movie_ids=None):
+    """FacetIndex rows for the given movies, or all of them."""
+    movies = MovieInfo.objects.order_by().with_average_rating()
+    genres = MovieInfo.genres.through.objects.order_by()
+    if movie_ids is not None:
+        movie_ids = list(movie_ids)
+
+    found = defaultdict(list)
+    for chunk in chunked(movie_ids) if movie_ids is not None else [None]:
+        rows = genres if chunk is None else genres.filter(movieinfo_id__in=chunk)
+        for movie_id, name in rows.values_list("movieinfo_id", "genre__name").iterator(
+            chunk_size=5000
+        ):
+            found[movie_id].append(name)
+
+    rows = []
+    for chunk in chunked(movie_ids) if movie_ids is not None else [None]:
+        selected = movies if chunk is None else movies.filter(id__in=chunk)
+        rows.extend(
+            (str(movie_id), title, released.toordinal(), length, rating, tuple(found[movie_id]))
+            for movie_id, title, released, length, rating in selected.values_list(
+                "id", "media_title", "media_release_date", "media_length", "average_rating"
+            ).iterator(chunk_size=5000)
+        )
+    return rows
+
+
+def build():
+    """A FacetIndex over the whole catalog."""
+    # Anything bumped while the catalog is read is read again on first sync
+    synced_at = timezone.now()
+    catalog = versions.catalog_version()
+    return FacetIndex(movie_rows(), synced_at=synced_at, catalog=catalog)
+
+
+_state = {"index": None, "checked": 0.0}
+_state_lock = threading.Lock()
+
+
+def reset():
+    """Forget this process's index."""
+    with _state_lock:
+        _state.update(index=None, checked=0.0)
+
+
+def current():
+    """This process's index, built on first use and kept in sync."""
+    interval = settings.FACETS_SYNC_SECONDS
+    if _state["index"] is not None and time.monotonic() - _state["checked"] < interval:
+        return _state["index"]
+
+    with _state_lock:
+        if _state["index"] is not None and time.monotonic() - _state["checked"] < interval:
+            return _state["index"]
+        if _state["index"] is None:
+            _state["index"] = build()
+        _state["index"].sync()
+        _state["checked"] = time.monotonic()
+    return _state["index"]
+
+
+def browse(**filters):
+    return current().browse(**filters)
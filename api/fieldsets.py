@@ -0,0 +1,68 @@
+"""
+Sparse fieldsets for movie responses.
+
+Movie endpoints take two optional query parameters:
+
+* ``?fields=id,media_title,image_url`` -- only these fields,
+* ``?expand=genres`` -- nested relations (``genres``, ``actors_list``) to
+  include. Once either parameter is given, relations are left out unless
+  they are named in one of them.
+
+So a grid view asks for ``?fields=id,media_title,image_url,media_release_date``
+and a card with genres adds ``&expand=genres``. Without either parameter
+responses are unchanged.
+
+Relations a response leaves out aren't prefetched at all, and unused long
+text columns aren't selected (see ``MovieInfoQuerySet.with_related()``).
+"""
+
+from functools import cache
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import BaseSerializer
+
+
+FIELDS_PARAM = "fields"
+EXPAND_PARAM = "expand"
+
+
+@cache
+def _shape(serializer_class):
+    # (every field, the nested relations among them)
+    fields = serializer_class().fields
+    relations = {name for name, field in fields.items() if isinstance(field, BaseSerializer)}
+    return tuple(fields), frozenset(relations)
+
+
+def _names(request, param):
+    value = request.query_params.get(param)
+    if value is None:
+        return None
+    return [name for name in (part.strip() for part in value.split(",")) if name]
+
+
+def requested(request, serializer_class):
+    """
+    Names of the fields of ``serializer_class`` the request asks for, or
+    None for all of them. Unknown names are a ValidationError.
+    """
+    fields = _names(request, FIELDS_PARAM)
+    expand = _names(request, EXPAND_PARAM)
+    if fields is None and expand is None:
+        return None
+
+    every, relations = _shape(serializer_class)
+    errors = {}
+    if fields is not None and (unknown := [name for name in fields if name not in every]):
+        errors[FIELDS_PARAM] = [f"Unknown field: {name}" for name in unknown]
+    if expand is not None and (unknown := [name for name in expand if name not in relations]):
+        errors[EXPAND_PARAM] = [
+            f"Not an expandable relation: {name}. Choose from {', '.join(sorted(relations))}"
+            for name in unknown
+        ]
+    if errors:
+        raise ValidationError(errors)
+
+    if fields is None:
+        fields = [name for name in every if name not in relations]
+    return frozenset(fields) | frozenset(expand or ())
@@ -0,0 +1,502 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from rest_framework.authtoken.models import Token
+
+from api import facets, recommendations, suggest, synthetic, viewcounts
+from api.management.timings import percentiles
+from api.models import Genre, MovieInfo, Review, ReviewSummary, SearchTerm
+from api.synthetic import popular
+from api.urls import urlpatterns
+
+
+BASELINE_DIR = os.path.join(settings.BASE_DIR, "api", "benchmarks")
+
+
+def compare(results, baseline, latency_threshold=2.0, memory_threshold=1.5):
+    """
+    List how ``results`` regressed against ``baseline``.
+
+    Query counts must not grow at all. Latency (p95) and peak memory may
+    grow by the given factors, since they vary between runs and machines.
+    An endpoint missing from the baseline fails too, until it is re-saved.
+    """
+    failures = [
+        f"{label}: not in the baseline, re-save it with --save-baseline"
+        for label in results["endpoints"]
+        if label not in baseline.get("endpoints", {})
+    ]
+    for label, base in baseline.get("endpoints", {}).items():
+        current = results["endpoints"].get(label)
+        if current is None:
+            continue
+        if current["queries"] > base["queries"]:
+            failures.append(f"{label}: {current['queries']} queries, baseline {base['queries']}")
+        if current["p95_ms"] > base["p95_ms"] * latency_threshold:
+            failures.append(
+                f"{label}: p95 {current['p95_ms']:.1f}ms, baseline {base['p95_ms']:.1f}ms"
+            )
+        if current["peak_kb"] > base["peak_kb"] * memory_threshold:
+            failures.append(
+                f"{label}: peak {current['peak_kb']:.0f}KB, baseline {base['peak_kb']:.0f}KB"
+            )
+
+    base_load = baseline.get("concurrent")
+    load = results.get("concurrent")
+    if base_load and load and base_load["workers"] == load["workers"]:
+        if load["requests_per_s"] < base_load["requests_per_s"] / latency_threshold:
+            failures.append(
+                f"concurrent: {load['requests_per_s']:.0f} req/s, "
+                f"baseline {base_load['requests_per_s']:.0f} req/s"
+            )
+    return failures
+
+
+class Sample:
+    """
+    Picks the ids each benchmark request uses, popular ones most often.
+    """
+
+    def __init__(self, catalog, seed):
+        self.catalog = catalog
+        self.rng = random.Random(seed)
+        self.reviews = list(
+            Review.objects.order_by("id").values_list("movie_id", "id")[:500]
+        )
+        self.terms = list(SearchTerm.objects.order_by("id").values_list("term", flat=True)[:500])
+        self.summarized = [catalog.movie_id(i) for i in range(min(50, catalog.movies))]
+        self.genres = list(Genre.objects.order_by("name").values_list("name", flat=True))
+        self.titles = dict(
+            MovieInfo.objects.filter(
+                id__in=[catalog.movie_id(i) for i in range(min(500, catalog.movies))]
+            ).values_list("id", "media_title")
+        )
+
+    def movie(self):
+        return self.catalog.movie_id(popular(self.rng, self.catalog.movies))
+
+    def user(self):
+        return self.catalog.user_id(popular(self.rng, self.catalog.users))
+
+    def actor(self):
+        return self.catalog.actor_id(popular(self.rng, self.catalog.actors))
+
+    def review(self):
+        return self.rng.choice(self.reviews)
+
+    def genre(self):
+        return self.rng.choice(self.genres)
+
+    def prefix(self):
+        # What a user has typed so far of a title's first 1 to 6 letters
+        title = self.titles[self.catalog.movie_id(popular(self.rng, len(self.titles)))]
+        return title[: self.rng.randint(1, 6)]
+
+    def term(self):
+        return self.rng.choice(self.terms)
+
+    def movie_ids(self, count):
+        return sorted(
+            {str(self.catalog.movie_id(self.rng.randrange(self.catalog.movies))) for _ in range(count)}
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every route in api/urls.py against a seeded synthetic "
+        "catalog, in a throwaway test database. Reports latency "
+        "percentiles, SQL queries and peak memory per endpoint and fails on "
+        "regressions against a stored baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            default="1k",
+            help=f"One of {', '.join(synthetic.SIZES)}, or a number of movies",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--requests", type=int, default=50, help="Timed requests per endpoint"
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=0,
+            help="Also replay the GET endpoints from this many threads",
+        )
+        parser.add_argument(
+            "--baseline",
+            help="Baseline JSON file, by default api/benchmarks/baseline-<size>.json",
+        )
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Write the results as the new baseline instead of comparing",
+        )
+        parser.add_argument("--latency-threshold", type=float, default=2.0)
+        parser.add_argument("--memory-threshold", type=float, default=1.5)
+
+    def scenarios(self, sample, me):
+        """
+        {route: [(label, method, make)]}, ``make()`` returning (path, data).
+        """
+
+        def bulk(list_name):
+            def make():
+                return f"/api/v1/users/{me}/{list_name}/bulk", {"movie_ids": sample.movie_ids(20)}
+
+            return [
+                (f"POST users/<pk>/{list_name}/bulk", "post", make),
+                (f"DELETE users/<pk>/{list_name}/bulk", "delete", make),
+            ]
+
+        def review():
+            movie_id, review_id = sample.review()
+            return f"/api/v1/movies/{movie_id}/reviews/{review_id}", None
+
+        return {
+            "movies": [
+                ("GET movies?page_size=20", "get", lambda: ("/api/v1/movies?page_size=20", None)),
+                (
+                    "GET movies?ordering=-average_rating",
+                    "get",
+                    lambda: ("/api/v1/movies?page_size=20&ordering=-average_rating", None),
+                ),
+                (
+                    "GET movies?fields=<grid>",
+                    "get",
+                    lambda: (
+                        "/api/v1/movies?page_size=20"
+                        "&fields=id,media_title,image_url,media_release_date",
+                        None,
+                    ),
+                ),
+            ],
+            "movies/trending": [
+                ("GET movies/trending", "get", lambda: ("/api/v1/movies/trending", None)),
+            ],
+            "movies/browse": [
+                (
+                    "GET movies/browse?genres=&released_from=",
+                    "get",
+                    lambda: (
+                        f"/api/v1/movies/browse?{urlencode({'genres': sample.genre()})}"
+                        "&released_from=1990-01-01&ordering=-average_rating",
+                        None,
+                    ),
+                ),
+            ],
+            "movies/<uuid:pk>": [
+                ("GET movies/<pk>", "get", lambda: (f"/api/v1/movies/{sample.movie()}", None)),
+            ],
+            "movies/<uuid:pk>/mistral": [
+                (
+                    "GET movies/<pk>/mistral",
+                    "get",
+                    lambda: (f"/api/v1/movies/{sample.rng.choice(sample.summarized)}/mistral", None),
+                ),
+            ],
+            "movies/<uuid:pk>/statistics": [
+                (
+                    "GET movies/<pk>/statistics",
+                    "get",
+                    lambda: (f"/api/v1/movies/{sample.movie()}/statistics", None),
+                ),
+            ],
+            "movies/<uuid:pk>/similar": [
+                (
+                    "GET movies/<pk>/similar",
+                    "get",
+                    lambda: (f"/api/v1/movies/{sample.movie()}/similar", None),
+                ),
+            ],
+            "movies/<uuid:pk>/credits": [
+                (
+                    "GET movies/<pk>/credits",
+                    "get",
+                    lambda: (f"/api/v1/movies/{sample.movie()}/credits", None),
+                ),
+            ],
+            "people/<uuid:pk>/credits": [
+                (
+                    "GET people/<pk>/credits",
+                    "get",
+                    lambda: (f"/api/v1/people/{sample.actor()}/credits", None),
+                ),
+            ],
+            "movies/<uuid:pk>/reviews": [
+                (
+                    "GET movies/<pk>/reviews",
+                    "get",
+                    lambda: (f"/api/v1/movies/{sample.movie()}/reviews", None),
+                ),
+                (
+                    "GET movies/<pk>/reviews?page_size=20",
+                    "get",
+                    lambda: (f"/api/v1/movies/{sample.movie()}/reviews?page_size=20", None),
+                ),
+            ],
+            "movies/<uuid:movie_id>/reviews/<uuid:pk>": [
+                ("GET movies/<movie_id>/reviews/<pk>", "get", review),
+            ],
+            "users/<int:pk>": [
+                ("GET users/<pk>", "get", lambda: (f"/api/v1/users/{sample.user()}", None)),
+            ],
+            "users/<int:pk>/favorites": [
+                (
+                    "GET users/<pk>/favorites",
+                    "get",
+                    lambda: (f"/api/v1/users/{sample.user()}/favorites", None),
+                ),
+            ],
+            "users/<int:pk>/watchlist": [
+                (
+                    "GET users/<pk>/watchlist",
+                    "get",
+                    lambda: (f"/api/v1/users/{sample.user()}/watchlist", None),
+                ),
+            ],
+            "users/<int:pk>/recommendations": [
+                (
+                    "GET users/<pk>/recommendations",
+                    "get",
+                    lambda: (f"/api/v1/users/{sample.user()}/recommendations", None),
+                ),
+            ],
+            "users/<int:pk>/favorites/bulk": bulk("favorites"),
+            "users/<int:pk>/watchlist/bulk": bulk("watchlist"),
+            "movies/search": [
+                (
+                    "GET movies/search",
+                    "get",
+                    lambda: (f"/api/v1/movies/search?q={sample.term()}", None),
+                ),
+            ],
+            "search/suggest": [
+                (
+                    "GET search/suggest",
+                    "get",
+                    lambda: (f"/api/v1/search/suggest?{urlencode({'q': sample.prefix()})}", None),
+                ),
+            ],
+        }
+
+    def handle(self, *args, **options):
+        size = options["size"]
+        size = int(size) if size.isdigit() else size.lower()
+        if not isinstance(size, int) and size not in synthetic.SIZES:
+            raise CommandError(f"Unknown size: {size}")
+        baseline_path = options["baseline"] or os.path.join(
+            BASELINE_DIR, f"baseline-{size}.json"
+        )
+
+        setup_test_environment(debug=False)
+        old_config = setup_databases(
+            verbosity=0, interactive=False, aliases=set(connections), serialized_aliases=set()
+        )
+        try:
+            with tempfile.TemporaryDirectory() as directory, override_settings(
+                RECOMMENDATIONS_PATH=os.path.join(directory, "recommendations.npz"),
+                SUGGEST_SNAPSHOT_PATH=os.path.join(directory, "suggest.pickle"),
+            ):
+                results = self.run(size, options)
+        finally:
+            facets.reset()
+            suggest.reset()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        if options["save_baseline"]:
+            os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+            with open(baseline_path, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+                f.write("\n")
+            self.stdout.write(self.style.SUCCESS(f"Saved baseline to {baseline_path}"))
+            return
+
+        if not os.path.exists(baseline_path):
+            self.stdout.write(f"No baseline at {baseline_path}, nothing to compare")
+            return
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        failures = compare(
+            results,
+            baseline,
+            latency_threshold=options["latency_threshold"],
+            memory_threshold=options["memory_threshold"],
+        )
+        if failures:
+            raise CommandError("Regressions against the baseline:\n" + "\n".join(failures))
+        self.stdout.write(self.style.SUCCESS(f"Within the thresholds of {baseline_path}"))
+
+    def run(self, size, options):
+        catalog = synthetic.generate(size, seed=options["seed"], stdout=self.stdout)
+
+        me = catalog.user_id(0)
+        token = Token.objects.create(user_id=me)
+        ReviewSummary.objects.bulk_create(
+            [
+                ReviewSummary(movie_id=movie_id, fingerprint="", content="Benchmark summary")
+                for movie_id in Sample(catalog, 0).summarized
+            ]
+        )
+
+        if recommendations.available():
+            recommendations.build()
+
+        # A week of views for movies/trending
+        rng = random.Random(options["seed"])
+        now = time.time()
+        for _ in range(10 * catalog.movies):
+            viewcounts.counter.record(
+                catalog.movie_id(popular(rng, catalog.movies)),
+                now=now - rng.random() * viewcounts.TRENDING_WINDOW_HOURS * 3600,
+            )
+        viewcounts.counter.flush()
+
+        facets.reset()
+        suggest.reset()
+        suggest.save(suggest.build())
+
+        sample = Sample(catalog, options["seed"])
+        scenarios = self.scenarios(sample, me)
+        missing = {str(pattern.pattern) for pattern in urlpatterns} - set(scenarios)
+        if missing:
+            raise CommandError(f"No benchmark for: {', '.join(sorted(missing))}")
+
+        client = Client(HTTP_AUTHORIZATION=f"Token {token.key}")
+        results = {"size": size, "seed": options["seed"], "endpoints": {}}
+
+        self.stdout.write(
+            f"{'endpoint':45} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'peak':>9}"
+        )
+        for route_scenarios in scenarios.values():
+            for label, method, make in route_scenarios:
+                entry = self.measure(client, method, make, options["requests"])
+                results["endpoints"][label] = entry
+                self.stdout.write(
+                    f"{label:45} {entry['p50_ms']:7.1f}ms {entry['p95_ms']:7.1f}ms "
+                    f"{entry['p99_ms']:7.1f}ms {entry['queries']:8} {entry['peak_kb']:7.0f}KB"
+                )
+
+        if options["concurrency"]:
+            results["concurrent"] = self.load(
+                scenarios, options["concurrency"], options["requests"], token
+            )
+        return results
+
+    def request(self, client, method, make):
+        path, data = make()
+        if data is None:
+            response = getattr(client, method)(path)
+        else:
+            response = getattr(client, method)(path, data, content_type="application/json")
+        if response.status_code >= 400:
+            raise CommandError(f"{method.upper()} {path}: {response.status_code}")
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+    def measure(self, client, method, make, count):
+        for _ in range(2):
+            self.request(client, method, make)
+
+        timings = []
+        for _ in range(count):
+            start = time.perf_counter()
+            self.request(client, method, make)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        # Reads may go to any replica alias
+        with ExitStack() as stack:
+            contexts = [
+                stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in connections
+            ]
+            self.request(client, method, make)
+        queries = sum(len(context) for context in contexts)
+
+        tracemalloc.start()
+        try:
+            self.request(client, method, make)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {**percentiles(timings), "queries": queries, "peak_kb": peak / 1024}
+
+    def load(self, scenarios, workers, count, token):
+        """
+        Replay the GET endpoints from a thread pool, each thread with its own
+        client and database connection. Writes are left out; SQLite would
+        only serialize them.
+        """
+        jobs = [
+            (label, make)
+            for route_scenarios in scenarios.values()
+            for label, method, make in route_scenarios
+            if method == "get"
+            for _ in range(count)
+        ]
+        random.Random(0).shuffle(jobs)
+        local = threading.local()
+        # Samples aren't thread-safe, so paths are made up front
+        jobs = [(label, make()[0]) for label, make in jobs]
+
+        def run(job):
+            label, path = job
+            if not hasattr(local, "client"):
+                local.client = Client(HTTP_AUTHORIZATION=f"Token {token.key}")
+            start = time.perf_counter()
+            response = local.client.get(path)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            return label, response.status_code, (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            done = list(pool.map(run, jobs))
+        elapsed = time.perf_counter() - start
+
+        errors = [status for _, status, _ in done if status >= 400]
+        if errors:
+            raise CommandError(f"{len(errors)} failed requests under load")
+
+        timings = {}
+        for label, _, ms in done:
+            timings.setdefault(label, []).append(ms)
+        result = {
+            "workers": workers,
+            "requests_per_s": len(done) / elapsed,
+            "endpoints": {label: percentiles(ms) for label, ms in timings.items()},
+        }
+        self.stdout.write(
+            f"{workers} threads: {len(done)} requests, {result['requests_per_s']:.0f} req/s"
+        )
+        for label, entry in result["endpoints"].items():
+            self.stdout.write(
+                f"  {label:43} p50 {entry['p50_ms']:6.1f}ms p95 {entry['p95_ms']:6.1f}ms"
+            )
+        return result
@@ -0,0 +1,220 @@
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import override_settings
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from api import synthetic
+from api.management.timings import format_percentiles
+from api.models import Review, SearchTerm
+from api.synthetic import popular
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the sync read endpoints against their async versions "
+        "(api/async_views.py) at high concurrency, on a synthetic catalog in "
+        "a throwaway database: in this process through the ASGI handler, or "
+        "with --workers through uvicorn worker processes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--movies", type=int, default=5000)
+        parser.add_argument("--requests", type=int, default=1000, help="Per endpoint and mode")
+        parser.add_argument("--concurrency", type=int, default=64)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=0,
+            help="Serve from this many uvicorn worker processes instead of in process",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        directory = tempfile.TemporaryDirectory()
+        default = connections["default"]
+        if options["workers"] and default.vendor == "sqlite":
+            # The server processes need the test database on disk
+            default.settings_dict["TEST"]["NAME"] = os.path.join(directory.name, "db.sqlite3")
+
+        setup_test_environment(debug=False)
+        old_config = setup_databases(
+            verbosity=0, interactive=False, aliases=set(connections), serialized_aliases=set()
+        )
+        try:
+            # Every request is slow under this load; don't log each one
+            with override_settings(SLOW_REQUEST_MS=float("inf")):
+                self.run(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            directory.cleanup()
+
+    def run(self, options):
+        catalog = synthetic.generate(options["movies"], seed=options["seed"])
+        rng = random.Random(options["seed"])
+        reviewed = list(Review.objects.values_list("movie_id", flat=True).distinct()[:500])
+        terms = list(SearchTerm.objects.order_by("id").values_list("term", flat=True)[:500])
+
+        endpoints = {
+            "movies?page_size=20": lambda: "movies?page_size=20",
+            "movies/<pk>": lambda: f"movies/{catalog.movie_id(popular(rng, catalog.movies))}",
+            "movies/<pk>/reviews?page_size=20": lambda: (
+                f"movies/{rng.choice(reviewed)}/reviews?page_size=20"
+            ),
+            "movies/search": lambda: f"movies/search?q={rng.choice(terms)}",
+            "users/<pk>/favorites?page_size=20": lambda: (
+                f"users/{catalog.user_id(popular(rng, catalog.users))}/favorites?page_size=20"
+            ),
+        }
+
+        if options["workers"]:
+            with self.server(options["workers"]) as base_url:
+                results = asyncio.run(self.compare(endpoints, base_url, None, options))
+            where = f"{options['workers']} uvicorn workers"
+        else:
+            application = get_asgi_application()
+            results = asyncio.run(
+                self.compare(endpoints, "http://testserver", application, options)
+            )
+            where = "in process"
+
+        self.stdout.write(
+            f"{options['requests']} requests per endpoint from {options['concurrency']} "
+            f"concurrent clients, {where}"
+        )
+        for label, modes in results.items():
+            self.stdout.write(label)
+            for mode, (throughput, timings, errors) in modes.items():
+                self.stdout.write(
+                    f"  {mode:6} {throughput:7.0f} req/s  {format_percentiles(timings)}  "
+                    f"{errors} errors"
+                )
+
+    async def compare(self, endpoints, base_url, application, options):
+        transport = httpx.ASGITransport(app=application) if application else None
+        limits = httpx.Limits(max_connections=options["concurrency"])
+        results = {}
+        async with httpx.AsyncClient(
+            base_url=base_url, transport=transport, limits=limits, timeout=60
+        ) as client:
+            for label, make in endpoints.items():
+                results[label] = {}
+                for mode, prefix in (("sync", "/api/v1/"), ("async", "/api/v1/async/")):
+                    paths = [prefix + make() for _ in range(options["requests"])]
+                    # Warm up, e.g. the first search loads the term index
+                    for path in paths[:5]:
+                        await client.get(path)
+                    results[label][mode] = await self.load(
+                        client, paths, options["concurrency"]
+                    )
+        return results
+
+    async def load(self, client, paths, concurrency):
+        """
+        GET every path from ``concurrency`` concurrent clients. Returns the
+        requests per second, the latency of each and the failures.
+        """
+        pending = iter(paths)
+        timings = []
+        errors = 0
+
+        async def worker():
+            nonlocal errors
+            for path in pending:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                except httpx.TransportError:
+                    response = None
+                timings.append((time.perf_counter() - start) * 1000)
+                if response is None or response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return len(paths) / (time.perf_counter() - start), timings, errors
+
+    def server(self, workers):
+        command = self
+
+        class Server:
+            def __enter__(self):
+                port = free_port()
+                env = {
+                    **os.environ,
+                    "DJANGO_SETTINGS_MODULE": os.environ.get(
+                        "DJANGO_SETTINGS_MODULE", "movie.settings"
+                    ),
+                    "SLOW_REQUEST_MS": str(10**9),
+                }
+                database = connections["default"].settings_dict
+                if database["ENGINE"].endswith("sqlite3"):
+                    env["SQLITE_PATH"] = str(database["NAME"])
+                else:
+                    env["POSTGRES_DB"] = database["NAME"]
+                self.process = subprocess.Popen(
+                    [
+                        sys.executable,
+                        "-m",
+                        "uvicorn",
+                        "movie.asgi:application",
+                        "--port",
+                        str(port),
+                        "--workers",
+                        str(workers),
+                        "--log-level",
+                        "warning",
+                        "--no-access-log",
+                        # Connections idle between endpoints are reused
+                        "--timeout-keep-alive",
+                        "60",
+                    ],
+                    cwd=settings.BASE_DIR,
+                    env=env,
+                )
+                url = f"http://127.0.0.1:{port}"
+                deadline = time.monotonic() + 30
+                while time.monotonic() < deadline:
+                    try:
+                        if httpx.get(f"{url}/api/v1/movies?page_size=1").status_code == 200:
+                            return url
+                    except httpx.TransportError:
+                        pass
+                    if self.process.poll() is not None:
+                        break
+                    time.sleep(0.2)
+                self.__exit__()
+                raise CommandError("uvicorn didn't start; is it installed?")
+
+            def __exit__(self, *exc_info):
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                command.stdout.write("Stopped uvicorn")
+
+        return Server()
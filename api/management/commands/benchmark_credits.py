@@ -0,0 +1,141 @@
+import random
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from api import credits, synthetic
+from api.bulk import insert_rows
+from api.management.timings import format_percentiles
+from api.models import Credit, MovieInfo
+from api.synthetic import popular
+
+
+def fill_legacy_tables():
+    """
+    Copy Credit back into the old role and link tables.
+    """
+    for role, role_model, person_field, link_model, role_field in credits.LEGACY:
+        people = Credit.objects.filter(role=role).values_list("person_id", flat=True).distinct()
+        role_ids = {person_id: uuid.uuid4() for person_id in people}
+        insert_rows(
+            role_model,
+            ["id", person_field],
+            [(role_id, person_id) for person_id, role_id in role_ids.items()],
+        )
+        links = (
+            Credit.objects.filter(role=role)
+            .order_by("movie_id", "order")
+            .values_list("movie_id", "person_id")
+        )
+        insert_rows(
+            link_model,
+            ["movieinfo_id", role_field],
+            [(movie_id, role_ids[person_id]) for movie_id, person_id in links.iterator()],
+        )
+
+
+def legacy_movie_credits(movie_id):
+    # One joined query per role; the old prefetches took two
+    rows = []
+    for role, _, person_field, link_model, role_field in credits.LEGACY:
+        links = (
+            link_model.objects.filter(movieinfo_id=movie_id)
+            .select_related(f"{role_field}__{person_field}")
+            .order_by("id")
+        )
+        rows.extend(
+            (role, getattr(getattr(link, role_field), person_field).name) for link in links
+        )
+    return rows
+
+
+def legacy_filmography(person_id):
+    movie_ids = set()
+    for _, _, person_field, link_model, role_field in credits.LEGACY:
+        movie_ids.update(
+            link_model.objects.filter(
+                **{f"{role_field}__{person_field}_id": person_id}
+            ).values_list("movieinfo_id", flat=True)
+        )
+    return list(
+        MovieInfo.objects.filter(id__in=movie_ids)
+        .only("id", "media_title", "media_release_date", "image_url")
+        .order_by("-media_release_date", "id")
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare a movie's credits and a person's filmography read from "
+        "Credit with the old role and link tables, on a synthetic catalog "
+        "in a throwaway database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--movies", type=int, default=20_000)
+        parser.add_argument("--queries", type=int, default=500)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(
+            verbosity=0, interactive=False, aliases=set(connections), serialized_aliases=set()
+        )
+        try:
+            self.run(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, options):
+        catalog = synthetic.generate(options["movies"], seed=options["seed"], reindex=False)
+        start = time.perf_counter()
+        credits.create_legacy_tables()
+        fill_legacy_tables()
+        self.stdout.write(
+            f"{Credit.objects.count()} credits, old tables filled in "
+            f"{time.perf_counter() - start:.1f}s"
+        )
+
+        rng = random.Random(options["seed"])
+        movies = [
+            catalog.movie_id(popular(rng, catalog.movies)) for _ in range(options["queries"])
+        ]
+        people = [
+            catalog.actor_id(popular(rng, catalog.actors)) for _ in range(options["queries"])
+        ]
+        for label, old, new, ids in (
+            (
+                "movie credits",
+                legacy_movie_credits,
+                lambda movie_id: list(credits.movie_credits(movie_id)),
+                movies,
+            ),
+            (
+                "filmography",
+                legacy_filmography,
+                lambda person_id: list(credits.filmography(person_id)),
+                people,
+            ),
+        ):
+            self.stdout.write(label)
+            for layout, read in (("old", old), ("credit", new)):
+                timings = []
+                for id_ in ids:
+                    start = time.perf_counter()
+                    read(id_)
+                    timings.append((time.perf_counter() - start) * 1000)
+                with CaptureQueriesContext(connection) as queries:
+                    read(ids[0])
+                self.stdout.write(
+                    f"  {layout:7} {format_percentiles(timings, 6, 2)}  {len(queries)} queries"
+                )
@@ -0,0 +1,134 @@
+import datetime
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from api import facets, synthetic
+from api.management.timings import format_percentiles
+from api.models import Genre, MovieInfo
+
+
+def database_browse(genres, released, length, ordering, page_size=20):
+    """
+    What movies/browse would do on the database: the page, then a GROUP BY
+    per facet.
+    """
+    movies = MovieInfo.objects.with_average_rating()
+    for genre in genres:
+        movies = movies.filter(genres__name=genre)
+    low, high = released
+    if low is not None:
+        movies = movies.filter(media_release_date__gte=datetime.date.fromordinal(low))
+    if high is not None:
+        movies = movies.filter(media_release_date__lte=datetime.date.fromordinal(high))
+    low, high = length
+    if low is not None:
+        movies = movies.filter(media_length__gte=low)
+    if high is not None:
+        movies = movies.filter(media_length__lte=high)
+
+    page = list(movies.order_by(ordering, "id").values_list("id", flat=True)[:page_size])
+    count = movies.count()
+    genre_counts = list(
+        Genre.objects.filter(movieinfo__in=movies.values("id"))
+        .values("name")
+        .annotate(count=Count("movieinfo"))
+    )
+    year_counts = list(
+        movies.annotate(year=ExtractYear("media_release_date"))
+        .values("year")
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    return page, count, genre_counts, year_counts
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare movies/browse filters and facet counts from the in-memory "
+        "bitmaps with the same queries on the database, on a synthetic "
+        "catalog in a throwaway database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--movies", type=int, default=20_000)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(
+            verbosity=0, interactive=False, aliases=set(connections), serialized_aliases=set()
+        )
+        try:
+            self.run(options)
+        finally:
+            facets.reset()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, options):
+        synthetic.generate(options["movies"], seed=options["seed"], reindex=False)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        index = facets.build()
+        build_s = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(
+            f"{len(index)} movies indexed in {build_s:.2f}s, peak {peak / 2**20:.1f}MB"
+        )
+
+        rng = random.Random(options["seed"])
+        names = list(Genre.objects.values_list("name", flat=True))
+        dates = MovieInfo.objects.order_by("media_release_date").values_list(
+            "media_release_date", flat=True
+        )
+        first, last = dates.first().toordinal(), dates.last().toordinal()
+        queries = []
+        for _ in range(options["queries"]):
+            low = rng.randint(first, last)
+            queries.append(
+                {
+                    "genres": rng.sample(names, rng.randint(0, 2)),
+                    "released": (low, rng.choice([None, rng.randint(low, last)])),
+                    "length": rng.choice([(None, None), (90, 120), (rng.randint(60, 150), None)]),
+                    "ordering": rng.choice(facets.ORDERINGS),
+                }
+            )
+
+        def bitmaps(query):
+            results, counts = index.browse(**query)
+            return results[:20], len(results), counts
+
+        def database(query):
+            ordering = query["ordering"]
+            return database_browse(query["genres"], query["released"], query["length"], ordering)
+
+        for label, run in (("bitmaps", bitmaps), ("database", database)):
+            timings = []
+            for query in queries:
+                start = time.perf_counter()
+                run(query)
+                timings.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(f"  {label:9} {format_percentiles(timings, 7, 2)}")
+
+        mismatches = sum(
+            bitmaps(query)[1] != database(query)[1] for query in queries
+        )
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"{mismatches} counts differ from the database"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Every count matches the database"))
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import recommendations
+from api.management.timings import format_percentiles
+
+
+class Command(BaseCommand):
+    help = (
+        "Time and measure the memory of building the similar movies file "
+        "from synthetic interactions (1M by default), of an incremental "
+        "refresh and of ranking recommendations. No database is used."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interactions", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=100_000)
+        parser.add_argument("--movies", type=int, default=20_000)
+        parser.add_argument(
+            "--changes", type=int, default=100, help="New interactions before the refresh"
+        )
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if not recommendations.available():
+            raise CommandError("Recommendations need numpy and scipy installed")
+        np = recommendations.np
+        rng = np.random.default_rng(options["seed"])
+
+        def interactions(count):
+            # Popular movies and active users get most of the interactions
+            users = (options["users"] * rng.random(count) ** 2).astype(np.int64)
+            movies = (options["movies"] * rng.random(count) ** 3).astype(np.int64)
+            weights = rng.choice(
+                np.array([1.0, 0.5, 0.2, 0.6, 1.0], dtype=np.float32), size=count
+            )
+            return users, movies, weights
+
+        hex_ids = np.array([f"{i:032x}" for i in range(options["movies"])], dtype="S32")
+        users, movies, weights = interactions(options["interactions"])
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        arrays, _ = recommendations.compute(users, hex_ids[movies], weights)
+        build_s = time.perf_counter() - start
+        _, build_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "recommendations.npz")
+            recommendations.save(arrays, filename)
+            size = os.path.getsize(filename)
+
+        more_users, more_movies, more_weights = interactions(options["changes"])
+        tracemalloc.start()
+        start = time.perf_counter()
+        _, recomputed = recommendations.compute(
+            np.concatenate([users, more_users]),
+            hex_ids[np.concatenate([movies, more_movies])],
+            np.concatenate([weights, more_weights]),
+            previous=arrays,
+        )
+        refresh_s = time.perf_counter() - start
+        _, refresh_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # Each request ranks for one user's picks, as recommend() does after
+        # reading them from the database
+        order = np.argsort(users, kind="stable")
+        bounds = np.searchsorted(users[order], np.arange(options["users"] + 1))
+        timings = []
+        for user in rng.integers(0, options["users"], options["requests"]):
+            rows = order[bounds[user]:bounds[user + 1]]
+            picked = {
+                recommendations.uuid.UUID(hex_ids[movie].decode()): float(weight)
+                for movie, weight in zip(movies[rows], weights[rows])
+            }
+            start = time.perf_counter()
+            recommendations.rank(arrays, picked, set(picked))
+            timings.append((time.perf_counter() - start) * 1000)
+
+        self.stdout.write(
+            f"{options['interactions']} interactions, {len(arrays['users'])} users, "
+            f"{len(arrays['movies'])} movies, top {int(arrays['k'])}"
+        )
+        self.stdout.write(f"  build     {build_s:8.2f}s  peak {build_peak / 2**20:8.1f}MB")
+        self.stdout.write(f"  file      {size / 2**20:8.1f}MB")
+        self.stdout.write(
+            f"  refresh   {refresh_s:8.2f}s  peak {refresh_peak / 2**20:8.1f}MB  "
+            f"({recomputed} movies recomputed after {options['changes']} new interactions)"
+        )
+        self.stdout.write(f"  rank      {format_percentiles(timings, 8, 2)}")
@@ -0,0 +1,99 @@
+import datetime
+import itertools
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api import search
+from api.management.timings import format_percentiles
+from api.models import Genre, MovieInfo
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure search latency against a synthetic catalog. Runs in a "
+        "throwaway test database, the configured one is left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--movies", type=int, default=100_000)
+        parser.add_argument("--queries", type=int, default=500)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        rng = random.Random(options["seed"])
+        vocabulary = [
+            "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10)))
+            for _ in range(20_000)
+        ]
+        # Roughly Zipfian word frequencies, like real text
+        cum_weights = list(
+            itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary)))
+        )
+
+        def words(count):
+            return " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=count))
+
+        genres = Genre.objects.bulk_create(
+            [Genre(name=f"{vocabulary[i]} genre") for i in range(20)]
+        )
+
+        start = time.perf_counter()
+        movies = MovieInfo.objects.bulk_create(
+            [
+                MovieInfo(
+                    media_title=words(rng.randint(1, 4)),
+                    media_release_date=datetime.date(1950 + i % 70, 1, 1),
+                    media_length=rng.randint(70, 200),
+                    media_description=words(rng.randint(10, 30)),
+                )
+                for i in range(options["movies"])
+            ],
+            batch_size=1000,
+        )
+        MovieInfo.genres.through.objects.bulk_create(
+            [
+                MovieInfo.genres.through(movieinfo_id=movie.pk, genre_id=genre.pk)
+                for movie in movies
+                for genre in rng.sample(genres, 2)
+            ],
+            batch_size=1000,
+        )
+        self.stdout.write(f"Loaded {len(movies)} movies in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        terms = search.rebuild_index()
+        self.stdout.write(f"Indexed {terms} terms in {time.perf_counter() - start:.1f}s")
+
+        queries = []
+        for _ in range(options["queries"]):
+            query = words(rng.randint(1, 3))
+            if rng.random() < 0.3:
+                # Misspell one letter
+                pos = rng.randrange(len(query))
+                query = query[:pos] + rng.choice(string.ascii_lowercase) + query[pos + 1:]
+            queries.append(query)
+
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            search.search_movies(query)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{len(queries)} queries: {format_percentiles(timings)}  "
+                f"max {max(timings):7.1f}ms"
+            )
+        )
@@ -0,0 +1,98 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import override_settings
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from rest_framework.renderers import JSONRenderer
+
+from api import synthetic
+from api.models import MovieInfo, Review
+from api.renderers import ORJSONRenderer
+from api.serializers import MovieInfoSerializer, ReviewSerializer
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time serializing and rendering a page of movies and reviews with "
+        "DRF's serializers and JSONRenderer against api/rows.py and "
+        "ORJSONRenderer, in a throwaway database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000, help="Rows per page")
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(
+            verbosity=0, interactive=False, aliases=set(connections), serialized_aliases=set()
+        )
+        try:
+            self.run(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, options):
+        rows = options["rows"]
+        synthetic.generate(rows, seed=options["seed"], reindex=False)
+
+        # Fetch once; only serialization and rendering are timed
+        pages = {
+            "movies": (
+                MovieInfoSerializer,
+                list(MovieInfo.objects.with_related().order_by("id")[:rows]),
+            ),
+            "reviews": (
+                ReviewSerializer,
+                list(Review.objects.select_related("user").order_by("id")[:rows]),
+            ),
+        }
+
+        for name, (serializer_class, instances) in pages.items():
+            results = {}
+            for label, fast, renderer in (
+                ("drf", False, JSONRenderer()),
+                ("fast", True, ORJSONRenderer()),
+            ):
+                with override_settings(FAST_SERIALIZATION=fast):
+                    data = serializer_class(instances, many=True).data
+                    serialize = median_ms(
+                        lambda: serializer_class(instances, many=True).data,
+                        options["repeat"],
+                    )
+                render = median_ms(lambda: renderer.render(data), options["repeat"])
+                results[label] = (serialize, render, renderer.render(data))
+
+            if results["drf"][2] != results["fast"][2]:
+                raise CommandError(f"{name}: the fast path rendered different bytes")
+
+            drf, fast = results["drf"], results["fast"]
+            self.stdout.write(f"{name} ({len(instances)} rows)")
+            for step, i in (("serialize", 0), ("render", 1)):
+                self.stdout.write(
+                    f"  {step:<10} drf {drf[i]:8.2f}ms  fast {fast[i]:8.2f}ms  "
+                    f"{drf[i] / fast[i]:5.1f}x"
+                )
+            total_drf, total_fast = drf[0] + drf[1], fast[0] + fast[1]
+            self.stdout.write(
+                f"  {'total':<10} drf {total_drf:8.2f}ms  fast {total_fast:8.2f}ms  "
+                f"{total_drf / total_fast:5.1f}x"
+            )
@@ -0,0 +1,83 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from api import similarity, synthetic
+from api.management.timings import format_percentiles
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare movies/<pk>/similar's MinHash index with exact Jaccard "
+        "similarity over every movie: recall, candidates and latency, on a "
+        "synthetic catalog in a throwaway database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--movies", type=int, default=10_000)
+        parser.add_argument("--queries", type=int, default=100)
+        parser.add_argument("--top", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(
+            verbosity=0, interactive=False, aliases=set(connections), serialized_aliases=set()
+        )
+        try:
+            self.run(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, options):
+        catalog = synthetic.generate(options["movies"], seed=options["seed"], reindex=False)
+
+        start = time.perf_counter()
+        similarity.rebuild_index()
+        self.stdout.write(
+            f"Indexed {options['movies']} movies in {time.perf_counter() - start:.1f}s"
+        )
+
+        rng = random.Random(options["seed"])
+        top = options["top"]
+        timings = {"lsh": [], "exact": []}
+        recalls, examined = [], []
+        for _ in range(options["queries"]):
+            movie_id = catalog.movie_id(rng.randrange(catalog.movies))
+
+            start = time.perf_counter()
+            found = similarity.similar_movies(movie_id, top)
+            timings["lsh"].append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            exact = similarity.exact_similar_movies(movie_id, top)
+            timings["exact"].append((time.perf_counter() - start) * 1000)
+
+            examined.append(len(similarity.candidates(movie_id)))
+            if exact:
+                # Ties at the cut-off make several top lists equally right,
+                # so a hit is anything at least as similar as the last one
+                cutoff = exact[-1][1]
+                recalls.append(sum(score >= cutoff for _, score in found) / len(exact))
+
+        self.stdout.write(
+            f"  exact  {format_percentiles(timings['exact'], 6, 1)}  "
+            f"{catalog.movies} movies compared"
+        )
+        self.stdout.write(
+            f"  lsh    {format_percentiles(timings['lsh'], 6, 1)}  "
+            f"{statistics.mean(examined):.0f} candidates on average"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"recall@{top} {statistics.mean(recalls):.2f}")
+        )
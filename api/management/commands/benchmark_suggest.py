@@ -0,0 +1,106 @@
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import override_settings
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from api import suggest, synthetic
+from api.management.timings import format_percentiles
+from api.models import MovieInfo, Person
+from api.synthetic import popular
+
+
+def database_suggest(query, limit=suggest.DEFAULT_LIMIT):
+    """
+    What search/suggest would do without an index of its own: prefix
+    matches on the columns, unranked.
+    """
+    movies = MovieInfo.objects.filter(media_title__istartswith=query).values_list(
+        "id", "media_title"
+    )[:limit]
+    people = Person.objects.filter(name__istartswith=query).values_list("id", "name")[:limit]
+    return [*movies, *people][:limit]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the typeahead index behind search/suggest: build time, "
+        "snapshot size and load time, memory, and query latency next to "
+        "prefix queries on the database, on a synthetic catalog in a "
+        "throwaway database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--movies", type=int, default=20_000)
+        parser.add_argument("--queries", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(
+            verbosity=0, interactive=False, aliases=set(connections), serialized_aliases=set()
+        )
+        try:
+            with tempfile.TemporaryDirectory() as directory, override_settings(
+                SUGGEST_SNAPSHOT_PATH=os.path.join(directory, "suggest.pickle")
+            ):
+                self.run(options)
+        finally:
+            suggest.reset()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, options):
+        catalog = synthetic.generate(options["movies"], seed=options["seed"], reindex=False)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        index = suggest.build()
+        build_s = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        suggest.save(index)
+        start = time.perf_counter()
+        loaded = suggest.load()
+        load_s = time.perf_counter() - start
+        self.stdout.write(
+            f"{len(index)} titles and names, {len(index.keys)} keys\n"
+            f"  build  {build_s:7.2f}s  peak {peak / 2**20:.1f}MB\n"
+            f"  load   {load_s:7.2f}s  snapshot {os.path.getsize(suggest.path()) / 2**20:.1f}MB"
+        )
+
+        # Prefixes of popular titles, from one letter to whole words
+        rng = random.Random(options["seed"])
+        titles = dict(
+            MovieInfo.objects.filter(
+                id__in=[catalog.movie_id(i) for i in range(min(1000, catalog.movies))]
+            ).values_list("id", "media_title")
+        )
+        queries = []
+        for _ in range(options["queries"]):
+            title = titles[catalog.movie_id(popular(rng, len(titles)))]
+            queries.append(title[: rng.randint(1, 8)])
+
+        for label, run in (
+            ("index", loaded.suggest),
+            ("index, uncached", lambda query: loaded._search(suggest.query_key(query))),
+            ("database", database_suggest),
+        ):
+            count = len(queries) if label != "database" else min(len(queries), 500)
+            timings = []
+            for query in queries[:count]:
+                start = time.perf_counter()
+                run(query)
+                timings.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(f"  {label:16} {format_percentiles(timings, 7, 3)}")
@@ -0,0 +1,167 @@
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.db.models import F, Sum
+from django.test import Client, override_settings
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from api import synthetic, viewcounts
+from api.management.timings import format_percentiles
+from api.models import MoviePage, MovieViews
+
+
+class DirectCounter:
+    """
+    What movies/<pk> would do without api/viewcounts.py: one UPDATE of the
+    movie's row per view.
+    """
+
+    def __init__(self):
+        self.writes = []
+
+    def record(self, movie_id, views=1, now=None):
+        self.writes.append(views)
+        MoviePage.objects.filter(movie_information_id=movie_id).update(
+            entry_views=F("entry_views") + views
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test movies/<pk> view counting: many threads viewing the same "
+        "movie, with the write-behind counter and with an UPDATE per view, "
+        "on a synthetic catalog in a throwaway database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--views", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--flush-seconds", type=float, default=0.5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(
+            verbosity=0, interactive=False, aliases=set(connections), serialized_aliases=set()
+        )
+        try:
+            # Every request is slow under this load; don't log each one
+            with override_settings(SLOW_REQUEST_MS=float("inf")):
+                self.run(options)
+        finally:
+            # Nothing may be left to write once the database is gone
+            viewcounts.counter.stop()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, options):
+        catalog = synthetic.generate(100, seed=options["seed"], reindex=False)
+        movie_id = catalog.movie_id(0)
+        page = MoviePage.objects.create(
+            movie_information_id=movie_id,
+            wiki_rating=0,
+            box_office_total=0,
+            entry_views=0,
+            release_date=datetime.date(2000, 1, 1),
+        )
+        path = f"/api/v1/movies/{movie_id}"
+        self.stdout.write(
+            f"{options['views']} views of one movie from {options['concurrency']} threads"
+        )
+
+        def request():
+            response = local.client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f"GET {path}: {response.status_code}")
+
+        def record():
+            viewcounts.counter.record(movie_id)
+
+        local = threading.local()
+        failures = []
+        for heading, view in (("GET movies/<pk>", request), ("counting only", record)):
+            self.stdout.write(heading)
+            for label, counter in (
+                ("direct", DirectCounter()),
+                ("write-behind", viewcounts.counter),
+            ):
+                MoviePage.objects.filter(pk=page.pk).update(entry_views=0)
+                MovieViews.objects.all().delete()
+                elapsed, timings, writes, errors = self.measure(counter, view, local, options)
+
+                counted = MoviePage.objects.get(pk=page.pk).entry_views
+                served = len(timings)
+                self.stdout.write(
+                    f"  {label:12} {served / elapsed:8.0f} views/s  "
+                    f"{format_percentiles(timings, 6, 1)}  "
+                    f"{len(writes):5} writes to the row  {len(errors)} errors  {counted} counted"
+                )
+                if errors:
+                    self.stdout.write(f"    {errors[0]}")
+                if counted != served:
+                    failures.append(f"{heading}, {label}: {served} views, {counted} counted")
+                if label == "write-behind":
+                    hourly = MovieViews.objects.aggregate(total=Sum("views"))["total"]
+                    if hourly != served:
+                        failures.append(f"{heading}, {label}: {served} views, {hourly} trending")
+
+        if failures:
+            raise CommandError("Lost views:\n" + "\n".join(failures))
+        self.stdout.write(self.style.SUCCESS("Every view counted"))
+
+    def measure(self, counter, view, local, options):
+        """
+        Call ``view`` --views times from --concurrency threads, with
+        ``counter`` counting. Returns the elapsed seconds, the latency of
+        every successful call, the UPDATEs of the movie's row and the errors.
+        """
+        saved_counter, saved_write = viewcounts.counter, viewcounts.write
+        writes = getattr(counter, "writes", [])
+
+        def write(pending):
+            writes.append(pending)
+            saved_write(pending)
+
+        viewcounts.counter, viewcounts.write = counter, write
+        try:
+            if isinstance(counter, viewcounts.ViewCounter):
+                counter.interval = options["flush_seconds"]
+                counter.start()
+            elapsed, timings, errors = self.load(view, local, options)
+            if isinstance(counter, viewcounts.ViewCounter):
+                counter.stop()
+        finally:
+            viewcounts.counter, viewcounts.write = saved_counter, saved_write
+        return elapsed, timings, writes, errors
+
+    def load(self, view, local, options):
+        errors = []
+
+        def run(_):
+            if not hasattr(local, "client"):
+                local.client = Client()
+            start = time.perf_counter()
+            try:
+                view()
+            except OperationalError as exc:
+                # SQLite refuses concurrent writers outright ("database
+                # table is locked"); other databases queue them
+                errors.append(str(exc))
+                return None
+            return (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            timings = [
+                timing for timing in pool.map(run, range(options["views"])) if timing is not None
+            ]
+        return time.perf_counter() - start, timings, errors
@@ -0,0 +1,25 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import suggest
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the typeahead index behind search/suggest to its snapshot "
+        "file, with popularity as it stands now"
+    )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        index = suggest.build()
+        suggest.save(index)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Indexed {len(index)} titles and names under {len(index.keys)} keys in "
+                f"{time.perf_counter() - start:.1f}s ({suggest.path()}, "
+                f"{os.path.getsize(suggest.path()) / 2**20:.1f}MB)"
+            )
+        )
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import synthetic
+from api.models import MovieInfo
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill an empty database with a seeded synthetic catalog: movies, "
+        "cast and crew, users, reviews, ratings, favorites and watchlists"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            default="1k",
+            help=f"One of {', '.join(synthetic.SIZES)}, or a number of movies",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--no-reindex",
+            action="store_true",
+            help="Skip building the search index",
+        )
+
+    def handle(self, *args, **options):
+        size = options["size"]
+        if size.isdigit():
+            size = int(size)
+        elif size.lower() not in synthetic.SIZES:
+            raise CommandError(f"Unknown size: {size}")
+
+        if MovieInfo.objects.exists():
+            raise CommandError("The database already has movies")
+
+        synthetic.generate(
+            size,
+            seed=options["seed"],
+            reindex=not options["no_reindex"],
+            stdout=self.stdout,
+        )
@@ -0,0 +1,294 @@
+import csv
+import datetime
+import gzip
+import itertools
+import json
+import os
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import search, similarity, suggest, versions
+from api.bulk import chunked, insert_rows
+from api.models import Credit, Genre, MovieInfo, Person
+
+
+# Imported rows get ids derived from their dump keys (tconst / nconst), so a
+# re-run or a resumed run lands on the same rows instead of duplicating them.
+NAMESPACE = uuid.UUID("5b0d6a4e-3f0c-4a8e-9d8e-2f6f1c1e7a10")
+
+NULL = "\\N"
+
+# title.principals categories and the Credit role they become
+CATEGORIES = {
+    "actor": Credit.ACTOR,
+    "actress": Credit.ACTOR,
+    "writer": Credit.WRITER,
+    "director": Credit.DIRECTOR,
+}
+
+
+def key_id(kind, key):
+    return uuid.uuid5(NAMESPACE, f"{kind}:{key}")
+
+
+def value(row, field):
+    found = row.get(field)
+    if found is None or found == NULL or found == "":
+        return None
+    return found
+
+
+def split_list(found):
+    if found is None:
+        return []
+    if isinstance(found, list):
+        return found
+    return [item for item in found.split(",") if item]
+
+
+def characters(found):
+    """
+    The characters column of title.principals, e.g. ``["Neo"]``, as text.
+    """
+    if found is None:
+        return ""
+    try:
+        names = json.loads(found)
+    except ValueError:
+        return found[:200]
+    if isinstance(names, list):
+        return " / ".join(str(name) for name in names)[:200]
+    return str(names)[:200]
+
+
+def year_date(found, default):
+    try:
+        return datetime.date(int(found), 1, 1)
+    except (TypeError, ValueError):
+        return default
+
+
+def read_rows(path):
+    """
+    Yield one dict per row of a CSV, TSV or JSONL file, optionally gzipped.
+    """
+    name = path[:-3] if path.endswith(".gz") else path
+    opener = gzip.open if path.endswith(".gz") else open
+
+    with opener(path, "rt", encoding="utf-8", newline="") as f:
+        if name.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        elif name.endswith(".tsv"):
+            # IMDb dumps don't quote fields, titles keep their quote marks
+            yield from csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_NONE)
+        elif name.endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            raise CommandError(f"Unknown file type: {path}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream an IMDb-style catalog dump (title.basics, name.basics and "
+        "title.principals as CSV, TSV or JSONL, optionally gzipped) into the "
+        "database in chunks"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--titles", help="title.basics file")
+        parser.add_argument("--people", help="name.basics file")
+        parser.add_argument("--principals", help="title.principals file")
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument(
+            "--checkpoint",
+            help="File recording committed progress; an interrupted import "
+            "run again with the same file picks up where it stopped",
+        )
+        parser.add_argument(
+            "--title-types",
+            default="movie",
+            help="Comma separated titleType values to import",
+        )
+        parser.add_argument(
+            "--unknown-date",
+            type=datetime.date.fromisoformat,
+            default=datetime.date(1900, 1, 1),
+            help="Stored when a release or birth year is missing",
+        )
+        parser.add_argument(
+            "--no-reindex",
+            action="store_true",
+            help="Skip rebuilding the search and similarity indexes afterwards",
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.title_types = set(split_list(options["title_types"]))
+        self.genre_ids = dict(Genre.objects.values_list("name", "id"))
+        self.checkpoint = self.load_checkpoint()
+
+        files = [
+            ("titles", self.load_titles),
+            ("people", self.load_people),
+            ("principals", self.load_principals),
+        ]
+        if not any(options[kind] for kind, _ in files):
+            raise CommandError("Pass at least one of --titles, --people, --principals")
+
+        for kind, loader in files:
+            if options[kind]:
+                self.import_file(kind, options[kind], loader)
+
+        if not options["no_reindex"]:
+            start = time.perf_counter()
+            search.rebuild_index()
+            similarity.rebuild_index()
+            suggest.save(suggest.build())
+            self.stdout.write(
+                f"Rebuilt search, similarity and typeahead indexes in "
+                f"{time.perf_counter() - start:.1f}s"
+            )
+
+    def load_checkpoint(self):
+        path = self.options["checkpoint"]
+        if path and os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        return {}
+
+    def save_checkpoint(self):
+        path = self.options["checkpoint"]
+        if not path:
+            return
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.checkpoint, f)
+        os.replace(f"{path}.tmp", path)
+
+    def import_file(self, kind, path, loader):
+        done = self.checkpoint.get(kind, 0)
+        if done:
+            self.stdout.write(f"{kind}: resuming after row {done}")
+
+        rows = itertools.islice(read_rows(path), done, None)
+        start = time.perf_counter()
+        count = 0
+        while True:
+            chunk = list(itertools.islice(rows, self.options["chunk_size"]))
+            if not chunk:
+                break
+
+            with transaction.atomic():
+                loader(chunk)
+            count += len(chunk)
+            # Only recorded once the chunk is committed. A crash in between
+            # replays the chunk, which the stable ids make harmless.
+            self.checkpoint[kind] = done + count
+            self.save_checkpoint()
+
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{kind}: {done + count} rows ({count / elapsed:,.0f} rows/s)"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"{kind}: {count} rows imported"))
+
+    def genre_id(self, name):
+        if name not in self.genre_ids:
+            genre, _ = Genre.objects.get_or_create(name=name)
+            self.genre_ids[name] = genre.pk
+        return self.genre_ids[name]
+
+    def load_titles(self, chunk):
+        movies = []
+        genres = []
+        for row in chunk:
+            if value(row, "titleType") not in self.title_types:
+                continue
+            movie_id = key_id("title", row["tconst"])
+            movies.append((
+                movie_id,
+                (value(row, "primaryTitle") or "")[:100],
+                year_date(value(row, "startYear"), self.options["unknown_date"]),
+                int(value(row, "runtimeMinutes") or 0),
+                value(row, "description") or "",
+                value(row, "image_url") or "",
+            ))
+            for name in split_list(value(row, "genres")):
+                genres.append((movie_id, self.genre_id(name)))
+
+        insert_rows(
+            MovieInfo,
+            [
+                "id",
+                "media_title",
+                "media_release_date",
+                "media_length",
+                "media_description",
+                "image_url",
+            ],
+            movies,
+            ignore_conflicts=True,
+        )
+        insert_rows(
+            MovieInfo.genres.through, ["movieinfo", "genre"], genres, ignore_conflicts=True
+        )
+        # Raw inserts send no signals
+        versions.bump_movies([movie[0] for movie in movies])
+
+    def load_people(self, chunk):
+        people = [
+            (
+                key_id("name", row["nconst"]),
+                year_date(value(row, "birthYear"), self.options["unknown_date"]),
+                (value(row, "primaryName") or "")[:80],
+                value(row, "description") or "",
+                value(row, "image_url") or "",
+            )
+            for row in chunk
+        ]
+        insert_rows(
+            Person,
+            ["id", "birthday", "name", "description", "image_url"],
+            people,
+            ignore_conflicts=True,
+        )
+        versions.bump(versions.person_key(person[0]) for person in people)
+
+    def existing(self, model, ids):
+        found = set()
+        for ids_chunk in chunked(ids):
+            found.update(model.objects.filter(pk__in=ids_chunk).values_list("pk", flat=True))
+        return found
+
+    def load_principals(self, chunk):
+        credits = []
+        for row in chunk:
+            role = CATEGORIES.get(value(row, "category"))
+            if role:
+                credits.append((
+                    key_id("title", row["tconst"]),
+                    key_id("name", row["nconst"]),
+                    role,
+                    int(value(row, "ordering") or 0),
+                    characters(value(row, "characters")),
+                ))
+
+        # Credits for titles or people that weren't imported are dropped
+        movies = self.existing(MovieInfo, {credit[0] for credit in credits})
+        people = self.existing(Person, {credit[1] for credit in credits})
+        credits = [
+            credit for credit in credits if credit[0] in movies and credit[1] in people
+        ]
+
+        insert_rows(
+            Credit,
+            ["movie", "person", "role", "order", "character"],
+            credits,
+            ignore_conflicts=True,
+        )
+        versions.bump_movies({credit[0] for credit in credits})
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import credits, search, similarity, versions
+from api.bulk import chunked
+from api.models import Credit
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the old actor, writer and director tables and their movie "
+        "lists into Credit (see api/credits.py)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--drop-legacy",
+            action="store_true",
+            help="Drop the old tables once they are copied",
+        )
+        parser.add_argument(
+            "--no-reindex",
+            action="store_true",
+            help="Skip rebuilding the search and similarity indexes afterwards",
+        )
+
+    def handle(self, *args, **options):
+        if not credits.legacy_tables():
+            raise CommandError("No old credit tables to copy")
+
+        start = time.perf_counter()
+        copied = credits.copy_legacy(batch_size=options["batch_size"])
+        for role, count in copied.items():
+            self.stdout.write(f"{role}: {count} credits")
+        self.stdout.write(f"Copied in {time.perf_counter() - start:.1f}s")
+
+        # Raw inserts send no signals
+        movie_ids = Credit.objects.values_list("movie_id", flat=True).distinct()
+        for chunk in chunked(movie_ids):
+            versions.bump_movies(chunk)
+        if not options["no_reindex"]:
+            start = time.perf_counter()
+            search.rebuild_index()
+            similarity.rebuild_index()
+            self.stdout.write(
+                f"Rebuilt search and similarity indexes in {time.perf_counter() - start:.1f}s"
+            )
+
+        if options["drop_legacy"]:
+            credits.drop_legacy_tables()
+            self.stdout.write("Dropped the old tables")
+        self.stdout.write(self.style.SUCCESS("Credits migrated"))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import reviews
+
+
+class Command(BaseCommand):
+    help = (
+        "Add the created column, the one review per user and movie constraint "
+        "and the (movie, created) index to an old review table (see api/reviews.py)"
+    )
+
+    def handle(self, *args, **options):
+        missing = reviews.missing()
+        if not missing:
+            self.stdout.write("The review table is up to date")
+            return
+
+        start = time.perf_counter()
+        deleted = reviews.upgrade_table()
+        self.stdout.write(f"Added {', '.join(missing)}")
+        self.stdout.write(f"Deleted {deleted} duplicate reviews")
+        self.stdout.write(f"Migrated in {time.perf_counter() - start:.1f}s")
+        self.stdout.write(self.style.SUCCESS("Reviews migrated"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import ratings
+
+
+class Command(BaseCommand):
+    help = "Rebuild per-movie rating statistics from the Rating table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report movies whose statistics drifted, exit 1 if any",
+        )
+
+    def handle(self, *args, **options):
+        drifted = ratings.recompute(
+            batch_size=options["batch_size"], dry_run=options["check"]
+        )
+
+        if options["check"]:
+            if drifted:
+                raise CommandError(f"{len(drifted)} movies have drifted statistics")
+            self.stdout.write(self.style.SUCCESS("Rating statistics are up to date"))
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f"Updated statistics for {len(drifted)} movies")
+            )
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        "Bring the similar movies file behind users/<pk>/recommendations up "
+        "to date, recomputing only movies whose audience changed"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full", action="store_true", help="Recompute every movie, not only changed ones"
+        )
+        parser.add_argument("--top-k", type=int, default=recommendations.TOP_K)
+
+    def handle(self, *args, **options):
+        if not recommendations.available():
+            raise CommandError("Recommendations need numpy and scipy installed")
+
+        start = time.perf_counter()
+        recomputed, movies, interactions = recommendations.refresh(
+            full=options["full"], k=options["top_k"]
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Recomputed {recomputed} of {movies} movies from {interactions} "
+                f"interactions in {time.perf_counter() - start:.1f}s "
+                f"({recommendations.path()})"
+            )
+        )
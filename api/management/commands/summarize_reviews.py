@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import summaries
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarize the reviews of every movie whose reviews changed since its "
+        "last summary, ahead of readers of movies/<pk>/mistral. An "
+        "interrupted run resumes where it stopped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, help="Mistral calls at once (MISTRAL_MAX_CONCURRENCY)"
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            help="Mistral calls started per second (MISTRAL_REQUESTS_PER_SECOND)",
+        )
+        parser.add_argument("--limit", type=int, help="Stop after this many movies")
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the unfinished run's checkpoint and start from the first movie",
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counts = summaries.summarize_pending(
+            workers=options["workers"],
+            rate=options["rate"],
+            limit=options["limit"],
+            restart=options["restart"],
+        )
+        message = (
+            f"Summarized {counts['summarized']} movies, {counts['unchanged']} unchanged, "
+            f"{counts['failed']} failed in {time.perf_counter() - start:.1f}s"
+        )
+        style = self.style.WARNING if counts["failed"] else self.style.SUCCESS
+        self.stdout.write(style(message))
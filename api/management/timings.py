@@ -0,0 +1,26 @@
+"""
+Latency percentiles for the benchmark_* commands.
+"""
+
+import statistics
+
+
+def percentiles(timings):
+    """
+    ``{"p50_ms", "p95_ms", "p99_ms"}`` of ``timings``, in milliseconds. A
+    single timing stands for every percentile.
+    """
+    timings = sorted(timings)
+    if len(timings) < 2:
+        timings = timings * 2
+    pct = statistics.quantiles(timings, n=100, method="inclusive")
+    return {"p50_ms": pct[49], "p95_ms": pct[94], "p99_ms": pct[98]}
+
+
+def format_percentiles(timings, width=7, digits=1):
+    """
+    ``percentiles()`` as a line of benchmark output.
+    """
+    return "  ".join(
+        f"{name[:3]} {value:{width}.{digits}f}ms" for name, value in percentiles(timings).items()
+    )
@@ -0,0 +1,244 @@
+"""
+Per-request performance instrumentation.
+
+``MetricsMiddleware`` times every request and breaks the time down into
+
+* ``db`` -- SQL, counted by an execute wrapper installed on every database
+  connection as it is opened,
+* ``serialize`` -- building serializer ``.data`` (see api/serializers.py),
+* ``external`` -- calls to other services such as Mistral (``timed()``).
+
+The breakdown goes back to the client in a ``Server-Timing`` header and
+into per-route counters and histograms, served in Prometheus text format
+by ``metrics_view``. Requests slower than ``SLOW_REQUEST_MS`` are logged
+with their slowest queries.
+
+Metrics live in the worker process, so each worker is scraped separately.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import heapq
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Slowest queries kept per request for the slow-request log
+TOP_QUERIES = 5
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.durations = {"db": 0.0, "serialize": 0.0, "external": 0.0}
+        # Min-heap of (seconds, sql), the slowest TOP_QUERIES queries
+        self.slowest = []
+        # Concurrent async work can record into the same request
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.durations[name] += seconds
+
+    def add_query(self, sql, seconds):
+        with self.lock:
+            self.queries += 1
+            self.durations["db"] += seconds
+            entry = (seconds, sql)
+            if len(self.slowest) < TOP_QUERIES:
+                heapq.heappush(self.slowest, entry)
+            elif entry > self.slowest[0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def server_timing(self, total):
+        parts = [f'db;dur={self.durations["db"] * 1000:.1f};desc="{self.queries} queries"']
+        for name in ("serialize", "external"):
+            parts.append(f"{name};dur={self.durations[name] * 1000:.1f}")
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+@contextlib.contextmanager
+def timed(name):
+    """
+    Add the time spent in the block to the current request's ``name``
+    timing. Does nothing outside a request.
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(sql, time.perf_counter() - start)
+
+
+def install_query_wrapper(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.histograms = {}
+
+    def observe(self, route, method, status, timings, total):
+        labels = (route, method)
+        with self.lock:
+            key = (*labels, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for name, buckets, value in (
+                ("http_request_duration_seconds", BUCKETS, total),
+                ("http_request_db_seconds", BUCKETS, timings.durations["db"]),
+                ("http_request_db_queries", QUERY_BUCKETS, timings.queries),
+                ("http_request_serialize_seconds", BUCKETS, timings.durations["serialize"]),
+                ("http_request_external_seconds", BUCKETS, timings.durations["external"]),
+            ):
+                histogram = self.histograms.setdefault((name, labels), Histogram(buckets))
+                histogram.observe(value)
+
+    def clear(self):
+        with self.lock:
+            self.requests.clear()
+            self.histograms.clear()
+
+    def render(self):
+        """
+        Everything recorded so far, in the Prometheus text format.
+        """
+        lines = [
+            "# HELP http_requests_total Requests handled, by route, method and status.",
+            "# TYPE http_requests_total counter",
+        ]
+        with self.lock:
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f'http_requests_total{{route="{route}",method="{method}",'
+                    f'status="{status}"}} {count}'
+                )
+
+            by_name = {}
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                by_name.setdefault(name, []).append((labels, histogram))
+
+            for name, series in by_name.items():
+                lines.append(f"# TYPE {name} histogram")
+                for (route, method), histogram in series:
+                    label = f'route="{route}",method="{method}"'
+                    cumulative = 0
+                    for bound, count in zip(
+                        (*histogram.buckets, "+Inf"), histogram.counts
+                    ):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                    lines.append(f"{name}_sum{{{label}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{label}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _route(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.route
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def finish(self, request, response, timings, token):
+        _current.reset(token)
+        total = time.perf_counter() - timings.start
+
+        if getattr(settings, "SERVER_TIMING", True):
+            response.headers["Server-Timing"] = timings.server_timing(total)
+        registry.observe(_route(request), request.method, response.status_code, timings, total)
+
+        if total * 1000 >= getattr(settings, "SLOW_REQUEST_MS", 500):
+            queries = "\n".join(
+                f"  {seconds * 1000:.1f}ms {sql}"
+                for seconds, sql in sorted(timings.slowest, reverse=True)
+            )
+            logger.warning(
+                "Slow request %s %s: %.0fms, %d queries in %.0fms, serialize %.0fms, "
+                "external %.0fms\n%s",
+                request.method,
+                request.get_full_path(),
+                total * 1000,
+                timings.queries,
+                timings.durations["db"] * 1000,
+                timings.durations["serialize"] * 1000,
+                timings.durations["external"] * 1000,
+                queries,
+            )
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        return self.finish(request, self.get_response(request), timings, token)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        return self.finish(request, await self.get_response(request), timings, token)
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, only answered for ``METRICS_ALLOWED_IPS``.
+    """
+    if request.META.get("REMOTE_ADDR") not in getattr(settings, "METRICS_ALLOWED_IPS", []):
+        raise Http404
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4")
@@ -0,0 +1,219 @@
+"""
+Shared Mistral clients and upstream call control.
+
+Clients are created once and reused so every call shares one connection
+pool instead of opening a new one. The async side also:
+
+* merges concurrent calls for the same key into a single upstream request
+  (``single_flight``),
+* caps how many upstream requests are in flight at once
+  (``MISTRAL_MAX_CONCURRENCY``),
+* bounds every call with ``MISTRAL_TIMEOUT`` seconds.
+
+Batch callers (``manage.py summarize_reviews``) go through
+``complete_with_retries`` instead, which paces calls with a TokenBucket
+and retries rate limited and failed ones with exponential backoff.
+
+asyncio primitives belong to the event loop that created them, so async
+state is kept per loop. Under an ASGI server that is one loop per worker;
+under WSGI, async_to_sync() runs each async view in a loop of its own, and
+the loop's client is closed when asyncio.run() shuts that loop down.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
+from django.conf import settings
+from mistralai import Mistral
+from mistralai.models import SDKError
+
+from api import metrics
+
+
+MODEL = "mistral-small-latest"
+
+# Rate limited, or failing on Mistral's side
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_sync_client = None
+_sync_lock = threading.Lock()
+_loop_states = weakref.WeakKeyDictionary()
+
+
+def _timeout():
+    return getattr(settings, "MISTRAL_TIMEOUT", 30)
+
+
+def _client_options():
+    return {
+        "api_key": os.getenv("MISTRAL_API_KEY", ""),
+        "server_url": getattr(settings, "MISTRAL_SERVER_URL", None),
+        "timeout_ms": int(_timeout() * 1000),
+    }
+
+
+def get_client():
+    """
+    Process-wide client for synchronous callers.
+    """
+    global _sync_client
+    with _sync_lock:
+        if _sync_client is None:
+            _sync_client = Mistral(**_client_options())
+        return _sync_client
+
+
+class _LoopState:
+    def __init__(self, loop):
+        limit = getattr(settings, "MISTRAL_MAX_CONCURRENCY", 4)
+        self.http = httpx.AsyncClient(
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=limit),
+        )
+        self.client = Mistral(async_client=self.http, **_client_options())
+        self.semaphore = asyncio.Semaphore(limit)
+        self.in_flight = {}
+        # asyncio has no hook for a loop shutting down, but asyncio.run()
+        # closes the loop's open async generators first, this one included
+        self.closer = self._close_with(loop)
+        asyncio.ensure_future(anext(self.closer, None), loop=loop)
+
+    async def _close_with(self, loop):
+        try:
+            yield
+        finally:
+            # The state refers to the loop, so the weak key alone never goes
+            _loop_states.pop(loop, None)
+            await self.http.aclose()
+
+
+def _loop_state():
+    loop = asyncio.get_running_loop()
+    state = _loop_states.get(loop)
+    if state is None:
+        state = _loop_states[loop] = _LoopState(loop)
+    return state
+
+
+def reset():
+    """
+    Drop every cached client, e.g. after changing settings in tests.
+    """
+    global _sync_client
+    with _sync_lock:
+        _sync_client = None
+    _loop_states.clear()
+
+
+async def complete(messages):
+    """
+    Run one chat completion, waiting for a free upstream slot first.
+
+    Returns the reply text, or None when Mistral returned nothing. Raises
+    ``asyncio.TimeoutError`` when the call takes longer than
+    ``MISTRAL_TIMEOUT``.
+    """
+    state = _loop_state()
+    async with state.semaphore:
+        with metrics.timed("external"):
+            res = await asyncio.wait_for(
+                state.client.chat.complete_async(model=MODEL, messages=messages),
+                _timeout(),
+            )
+    if res is None:
+        return None
+    return res.choices[0].message.content
+
+
+async def single_flight(key, func):
+    """
+    Await ``func()``, sharing the result with every concurrent caller that
+    uses the same key instead of starting another call.
+    """
+    state = _loop_state()
+    task = state.in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(func())
+        state.in_flight[key] = task
+        task.add_done_callback(lambda _: state.in_flight.pop(key, None))
+    # shield() so one caller going away doesn't cancel the shared call
+    return await asyncio.shield(task)
+
+
+class TokenBucket:
+    """
+    Allows ``rate`` calls per second on average, and bursts of up to
+    ``capacity``. Shared by threads.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for a token and take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def retry_delay(attempt, error=None):
+    """
+    Seconds to wait before retry number ``attempt`` (from 1): what a 429's
+    Retry-After asks for, or else MISTRAL_BACKOFF doubled per attempt with
+    full jitter.
+    """
+    response = getattr(error, "raw_response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return random.uniform(0, settings.MISTRAL_BACKOFF * 2 ** (attempt - 1))
+
+
+def complete_with_retries(messages, bucket=None, retries=None):
+    """
+    Run one chat completion on the process-wide client, taking a token from
+    ``bucket`` before every attempt. Rate limited, failed and timed out
+    attempts are retried up to ``retries`` times (MISTRAL_RETRIES by
+    default); then, or on any other error, the error is raised.
+
+    Returns the reply text, or None when Mistral returned nothing.
+    """
+    retries = settings.MISTRAL_RETRIES if retries is None else retries
+    attempt = 0
+    while True:
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            with metrics.timed("external"):
+                res = get_client().chat.complete(model=MODEL, messages=messages)
+        except (SDKError, httpx.TransportError) as error:
+            retryable = getattr(error, "status_code", None) in RETRY_STATUSES or isinstance(
+                error, httpx.TransportError
+            )
+            attempt += 1
+            if not retryable or attempt > retries:
+                raise
+            time.sleep(retry_delay(attempt, error))
+            continue
+        if res is None:
+            return None
+        return res.choices[0].message.content
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.functions import Coalesce, Now
+from django.utils import timezone
 import uuid
 
 from django.contrib.auth.models import (
@@ -48,48 +50,100 @@ class Person(models.Model):
     def __str__(self):
         return self.name
 
-class Actor(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    person = models.OneToOneField(Person, on_delete=models.CASCADE)
-
-    def __str__(self):
-        return self.person.name
-    
-# Writer Model
-class Writer(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable = False)
-    writer_credit = models.OneToOneField(Person, on_delete=models.CASCADE)
-
-    def __str__(self):
-        return self.writer_credit.name
-
+class MovieInfoQuerySet(models.QuerySet):
+    def with_related(self, fields=None):
+        # Everything MovieInfoSerializer walks, fetched in a fixed number of
+        # queries no matter how many movies or actors are on the page.
+        # ``fields`` limits that to what a sparse response shows (see
+        # api/fieldsets.py): relations it leaves out aren't prefetched and
+        # the description isn't selected.
+        lookups = []
+        if fields is None or "genres" in fields:
+            lookups.append("genres")
+        if fields is None or "actors_list" in fields:
+            lookups.append(
+                models.Prefetch(
+                    "credits",
+                    queryset=Credit.objects.filter(role=Credit.ACTOR)
+                    .select_related("person")
+                    .order_by("order"),
+                    to_attr="prefetched_cast",
+                )
+            )
+        queryset = self.with_average_rating().prefetch_related(*lookups)
+        if fields is not None and "media_description" not in fields:
+            queryset = queryset.defer("media_description")
+        return queryset
 
-# Director Model
-class Director(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable = False)
-    director_credit = models.OneToOneField(Person, on_delete=models.CASCADE)
+    def with_average_rating(self):
+        return self.annotate(
+            average_rating=Coalesce(
+                models.F("rating_stats__average"), models.Value(0.0)
+            )
+        )
 
-    def __str__(self):
-        return self.director_credit.name
-    
 
 # Create your models here.
 class MovieInfo(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     genres = models.ManyToManyField(Genre)
 
-    actors_list = models.ManyToManyField(Actor)
-    writers_list = models.ManyToManyField(Writer)
-    directors_list = models.ManyToManyField(Director)
-
-    media_title = models.CharField(max_length=100)
-    media_release_date = models.DateField()
+    # Indexed for ?ordering= on movie listings
+    media_title = models.CharField(max_length=100, db_index=True)
+    media_release_date = models.DateField(db_index=True)
     media_length = models.IntegerField()
     media_description = models.TextField()
     image_url = models.TextField(default='')
 
+    objects = MovieInfoQuerySet.as_manager()
+
     def __str__(self):
         return self.media_title
+
+    @property
+    def cast(self):
+        # Actor credits in billing order, prefetched by with_related()
+        if "prefetched_cast" in self.__dict__:
+            return self.prefetched_cast
+        return list(
+            self.credits.filter(role=Credit.ACTOR).select_related("person").order_by("order")
+        )
+
+
+# One person's part in one movie. ``order`` is the billing order within the
+# role, ``character`` who an actor played.
+class Credit(models.Model):
+    ACTOR = "actor"
+    WRITER = "writer"
+    DIRECTOR = "director"
+    ROLES = [(ACTOR, "Actor"), (WRITER, "Writer"), (DIRECTOR, "Director")]
+
+    # Both are covered by the indexes below
+    movie = models.ForeignKey(
+        MovieInfo, on_delete=models.CASCADE, related_name="credits", db_index=False
+    )
+    person = models.ForeignKey(
+        Person, on_delete=models.CASCADE, related_name="credits", db_index=False
+    )
+    role = models.CharField(max_length=8, choices=ROLES)
+    order = models.PositiveSmallIntegerField(default=0)
+    character = models.CharField(max_length=200, blank=True, default="")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["movie", "person", "role"], name="unique_credit"
+            ),
+        ]
+        indexes = [
+            # A movie's credits block, in billing order
+            models.Index(fields=["movie", "role", "order"], name="credit_movie_idx"),
+            # A person's filmography
+            models.Index(fields=["person", "role", "movie"], name="credit_person_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.person} ({self.role}) in {self.movie}"
     
 
 class CustomUser(AbstractBaseUser, PermissionsMixin):
@@ -133,12 +187,42 @@ class MoviePage(models.Model):
         return self.movie_information.media_title
     
 
+# Views per movie and hour, behind movies/trending (see api/viewcounts.py)
+class MovieViews(models.Model):
+    movie = models.ForeignKey(MovieInfo, on_delete=models.CASCADE)
+    # Hours since the Unix epoch
+    hour = models.IntegerField()
+    views = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["movie", "hour"], name="unique_movie_hour"),
+        ]
+        indexes = [
+            models.Index(fields=["hour", "movie", "views"], name="movieviews_hour_idx"),
+        ]
+
+
 # Review Model (made because serializer.py had reviews)
 class Review(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     movie = models.ForeignKey(MovieInfo, on_delete=models.CASCADE)
     content = models.TextField()
+    # The database default covers rows loaded with raw inserts
+    created = models.DateTimeField(default=timezone.now, db_default=Now(), editable=False)
+
+    class Meta:
+        constraints = [
+            # One review per user and movie, also the index for looking it up
+            models.UniqueConstraint(
+                fields=["movie", "user"], name="review_unique_movie_user"
+            ),
+        ]
+        indexes = [
+            # A movie's reviews in either order, for cursor pagination
+            models.Index(fields=["movie", "created"], name="review_movie_created_idx"),
+        ]
 
     def __str__(self):
         return self.content
@@ -147,4 +231,108 @@ class Rating(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     movie = models.ManyToManyField(MovieInfo)
-    rating = models.SmallIntegerField(null=True, blank=True)
\ No newline at end of file
+    rating = models.SmallIntegerField(null=True, blank=True)
+
+
+# Running rating totals per movie, kept in step by api/ratings.py
+class MovieRatingStats(models.Model):
+    movie = models.OneToOneField(
+        MovieInfo, on_delete=models.CASCADE, primary_key=True, related_name="rating_stats"
+    )
+    count = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    # 0 until the movie has a rating
+    average = models.FloatField(default=0, db_index=True)
+
+    # Histogram of ratings on the 1-10 scale
+    votes_1 = models.IntegerField(default=0)
+    votes_2 = models.IntegerField(default=0)
+    votes_3 = models.IntegerField(default=0)
+    votes_4 = models.IntegerField(default=0)
+    votes_5 = models.IntegerField(default=0)
+    votes_6 = models.IntegerField(default=0)
+    votes_7 = models.IntegerField(default=0)
+    votes_8 = models.IntegerField(default=0)
+    votes_9 = models.IntegerField(default=0)
+    votes_10 = models.IntegerField(default=0)
+
+    def histogram(self):
+        return {str(value): getattr(self, f"votes_{value}") for value in range(1, 11)}
+
+    def __str__(self):
+        return self.movie.media_title
+
+
+# Search index models (see api/search.py)
+class SearchTerm(models.Model):
+    term = models.CharField(max_length=100, unique=True)
+    doc_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.term
+
+
+class SearchTrigram(models.Model):
+    gram = models.CharField(max_length=3, db_index=True)
+    term = models.ForeignKey(SearchTerm, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["gram", "term"], name="unique_gram_term"),
+        ]
+
+
+class SearchPosting(models.Model):
+    term = models.ForeignKey(SearchTerm, on_delete=models.CASCADE)
+    movie = models.ForeignKey(MovieInfo, on_delete=models.CASCADE)
+    weight = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["term", "movie"], name="unique_term_movie"),
+        ]
+        indexes = [
+            models.Index(fields=["term", "weight", "movie"]),
+        ]
+
+
+# "More like this" index (see api/similarity.py)
+class MovieFeatures(models.Model):
+    movie = models.OneToOneField(MovieInfo, on_delete=models.CASCADE, primary_key=True)
+    # Sorted 64-bit hashes of the movie's genres, actors, writers and
+    # directors
+    hashes = models.BinaryField()
+
+
+class SimilarityBucket(models.Model):
+    # LSH band number in the top bits, the band's MinHash values below
+    key = models.BigIntegerField()
+    movie = models.ForeignKey(MovieInfo, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["key", "movie"], name="unique_bucket_movie"),
+        ]
+
+
+class ReviewSummary(models.Model):
+    movie = models.OneToOneField(MovieInfo, on_delete=models.CASCADE, primary_key=True)
+    # sha256 of the reviews the summary was built from
+    fingerprint = models.CharField(max_length=64)
+    content = models.TextField()
+    stale = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.movie.media_title
+
+
+# Change counters behind the ETag / Last-Modified headers (see api/versions.py)
+class ContentVersion(models.Model):
+    key = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    # Indexed for api/suggest.py, which reads what was bumped lately
+    updated_at = models.DateTimeField(null=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.key} v{self.version}"
@@ -0,0 +1,99 @@
+from asgiref.sync import sync_to_async
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class OptInCursorPagination(CursorPagination):
+    """
+    Keyset pagination that only produces pages when the client asks for
+    them with ``?cursor=`` or ``?page_size=``; otherwise the view returns the
+    plain list it always has so existing clients keep working.
+    """
+
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    # Most rows the plain list holds, or None for no limit
+    unpaginated_limit = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if (
+            self.cursor_query_param not in params
+            and self.page_size_query_param not in params
+        ):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def limit_unpaginated(self, queryset):
+        """
+        ``queryset`` as the plain list serves it, when paginate_queryset()
+        returned None.
+        """
+        if self.unpaginated_limit is None:
+            return queryset
+        return queryset[: self.unpaginated_limit]
+
+
+class AsyncCursorPaginationMixin:
+    """
+    ``apaginate_queryset()`` for the views in api/async_views.py: the
+    paginator's own paginate_queryset(), run in a thread. Its one query
+    would go through a thread under the async ORM too.
+    """
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return await sync_to_async(self.paginate_queryset)(queryset, request, view)
+
+
+class MovieCursorPagination(OptInCursorPagination):
+    """
+    Movies, ordered by the primary key index.
+    """
+
+    ordering = "id"
+
+
+class ReviewCursorPagination(OptInCursorPagination):
+    """
+    A movie's reviews, newest first unless the view's ``?ordering=created``
+    asks for oldest first. Both walk the (movie, created) index.
+
+    A popular movie has far more reviews than one response should carry, so
+    the plain list stops at the first ``max_page_size``; clients wanting the
+    rest ask for pages.
+    """
+
+    ordering = "-created"
+    unpaginated_limit = OptInCursorPagination.max_page_size
+
+
+class AsyncMovieCursorPagination(AsyncCursorPaginationMixin, MovieCursorPagination):
+    pass
+
+
+class AsyncReviewCursorPagination(AsyncCursorPaginationMixin, ReviewCursorPagination):
+    pass
+
+
+class SearchPagination(PageNumberPagination):
+    """
+    Numbered pages over a ranked list of search hits.
+    """
+
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.page_query_param in params or self.page_size_query_param in params
+
+
+class BrowsePagination(PageNumberPagination):
+    """
+    Numbered pages over the movies a browse matched, always paginated.
+    """
+
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
@@ -0,0 +1,133 @@
+"""
+Per-movie rating statistics.
+
+MovieRatingStats holds a running count, sum, mean and 1-10 histogram for
+every movie. Rating writes adjust them with single UPDATE ... SET col =
+col + n statements (see the receivers in api/signals.py), so concurrent
+writers never lose an update and reading an average never scans Rating.
+
+``recompute()`` rebuilds the numbers from the Rating table, for backfills
+and to check for drift (``manage.py recompute_rating_stats``).
+"""
+
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+from api import versions
+from api.models import MovieInfo, MovieRatingStats, Rating
+
+
+SCALE = range(1, 11)
+HISTOGRAM_FIELDS = [f"votes_{value}" for value in SCALE]
+
+
+def ensure_stats(movie_ids):
+    MovieRatingStats.objects.bulk_create(
+        [MovieRatingStats(movie_id=movie_id) for movie_id in movie_ids],
+        ignore_conflicts=True,
+    )
+
+
+def record(movie_ids, value, sign=1):
+    """
+    Add (``sign=1``) or remove (``sign=-1``) one rating of ``value`` for
+    each movie. Values outside the 1-10 scale are not counted.
+    """
+    movie_ids = list(movie_ids)
+    if value not in SCALE or not movie_ids:
+        return
+
+    with transaction.atomic():
+        ensure_stats(movie_ids)
+        count = F("count") + sign
+        total = F("total") + sign * value
+        MovieRatingStats.objects.filter(movie_id__in=movie_ids).update(
+            count=count,
+            total=total,
+            # Every right-hand side reads the row's old values, so the mean
+            # is computed from the new count and total in the same statement
+            average=Coalesce(
+                Cast(total, FloatField()) / NullIf(count, Value(0)), Value(0.0)
+            ),
+            **{f"votes_{value}": F(f"votes_{value}") + sign},
+        )
+        # The average shows up in every movie payload. Listings pick the bump
+        # up as the newest movie stamp; ratings are most of the writes, so they
+        # skip the second stamp on commit
+        versions.bump_movies(movie_ids, catalog=False)
+
+
+def record_ratings(movie_id, rating_ids, sign=1):
+    """
+    Add or remove several existing ratings for one movie.
+    """
+    values = Rating.objects.filter(pk__in=rating_ids).values_list("rating", flat=True)
+    for value in values:
+        record([movie_id], value, sign)
+
+
+def compute(movie_ids=None):
+    """
+    Build fresh statistics from the Rating table, {movie_id: MovieRatingStats}.
+    """
+    rows = Rating.movie.through.objects.filter(rating__rating__in=SCALE)
+    if movie_ids is not None:
+        rows = rows.filter(movieinfo_id__in=movie_ids)
+    rows = rows.values_list("movieinfo_id", "rating__rating").annotate(n=Count("id"))
+
+    stats = {}
+    for movie_id, value, n in rows.order_by():
+        entry = stats.setdefault(movie_id, MovieRatingStats(movie_id=movie_id))
+        entry.count += n
+        entry.total += n * value
+        setattr(entry, f"votes_{value}", n)
+    for entry in stats.values():
+        entry.average = entry.total / entry.count
+    return stats
+
+
+STAT_FIELDS = ["count", "total", "average", *HISTOGRAM_FIELDS]
+
+
+def _same_stats(a, b):
+    return abs(a.average - b.average) < 1e-9 and all(
+        getattr(a, field) == getattr(b, field)
+        for field in STAT_FIELDS
+        if field != "average"
+    )
+
+
+def recompute(batch_size=1000, dry_run=False):
+    """
+    Compare stored statistics with the Rating table and fix any that drifted.
+
+    Returns the ids of movies whose statistics were wrong.
+    """
+    drifted = []
+    movies = MovieInfo.objects.order_by("pk").values_list("pk", flat=True)
+
+    batch = list(movies[:batch_size])
+    while batch:
+        drifted += _recompute_batch(batch, dry_run)
+        batch = list(movies.filter(pk__gt=batch[-1])[:batch_size])
+    return drifted
+
+
+def _recompute_batch(movie_ids, dry_run):
+    fresh = compute(movie_ids)
+    stored = MovieRatingStats.objects.in_bulk(movie_ids)
+
+    changed = []
+    for movie_id in movie_ids:
+        expected = fresh.get(movie_id, MovieRatingStats(movie_id=movie_id))
+        current = stored.get(movie_id)
+        if current is None or not _same_stats(current, expected):
+            changed.append(expected)
+
+    if changed and not dry_run:
+        with transaction.atomic():
+            ensure_stats([entry.movie_id for entry in changed])
+            MovieRatingStats.objects.bulk_update(changed, STAT_FIELDS)
+            versions.bump_movies([entry.movie_id for entry in changed], catalog=False)
+    return [entry.movie_id for entry in changed]
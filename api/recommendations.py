@@ -0,0 +1,434 @@
+"""
+Item-item collaborative filtering.
+
+Favorites, watchlist entries and ratings are implicit feedback. Each
+(user, movie) pair gets a weight, the sum of FAVORITE_WEIGHT,
+WATCHLIST_WEIGHT and ``rating_weight()``, in a sparse user x movie matrix.
+Two movies are similar when the same users picked them, measured as the
+cosine between their columns. ``build()`` keeps the TOP_K most similar
+movies of every movie in one .npz file at ``RECOMMENDATIONS_PATH``:
+
+* ``movies``: movie ids as 32 character hex, sorted,
+* ``neighbors``, ``scores``: movies x TOP_K indexes into ``movies`` and
+  their similarities, most similar first, padded with -1 and 0,
+* ``popular``: the most picked movies, for users with nothing to go on,
+* ``users`` and ``x_*``: the matrix the file was built from.
+
+``refresh()`` rebuilds the matrix, compares it with the stored one and only
+recomputes the movies whose columns changed and the movies sharing a user
+with them; no other similarity can have moved (``manage.py
+refresh_recommendations``).
+
+``recommend()`` reads a user's own picks, adds up their neighbor lists
+weighted by how much the user liked each pick and leaves out what the user
+already has, so serving never touches the matrix.
+
+NumPy and SciPy are dependencies in pyproject.toml. An install without them
+still starts: ``available()`` is false and the endpoint answers 503.
+"""
+
+import os
+import tempfile
+import threading
+import uuid
+
+from django.conf import settings
+
+from api.models import CustomUser, Rating
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+
+TOP_K = 50
+POPULAR = 100
+
+FAVORITE_WEIGHT = 1.0
+WATCHLIST_WEIGHT = 0.5
+# Ratings above the middle of the 1-10 scale count for up to 1.0, lower
+# ones count for nothing
+RATING_MIDPOINT = 5
+RATING_MAX = 10
+
+# Bytes of similarities held as a dense block at once while building
+CHUNK_BYTES = 32 * 1024 * 1024
+FETCH_SIZE = 10000
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def available():
+    return np is not None
+
+
+def rating_weight(value):
+    if value is None:
+        return 0.0
+    return max(0.0, (value - RATING_MIDPOINT) / (RATING_MAX - RATING_MIDPOINT))
+
+
+def interactions():
+    """
+    Every favorite, watchlist entry and liked rating as three arrays: user
+    ids, movie ids (hex) and weights. A pair can appear more than once.
+    """
+    users, movies, weights = [], [], []
+
+    for manager, weight in (
+        (CustomUser.favorites, FAVORITE_WEIGHT),
+        (CustomUser.watchlist, WATCHLIST_WEIGHT),
+    ):
+        start = len(users)
+        rows = manager.through.objects.values_list("customuser_id", "movieinfo_id")
+        for user_id, movie_id in rows.iterator(chunk_size=FETCH_SIZE):
+            users.append(user_id)
+            movies.append(movie_id.hex)
+        weights.append(np.full(len(users) - start, weight, dtype=np.float32))
+
+    values = []
+    rated = Rating.movie.through.objects.filter(
+        rating__rating__gt=RATING_MIDPOINT
+    ).values_list("rating__user_id", "movieinfo_id", "rating__rating")
+    for user_id, movie_id, value in rated.iterator(chunk_size=FETCH_SIZE):
+        users.append(user_id)
+        movies.append(movie_id.hex)
+        values.append(value)
+    values = np.array(values, dtype=np.float32)
+    weights.append((values - RATING_MIDPOINT) / (RATING_MAX - RATING_MIDPOINT))
+
+    return (
+        np.array(users, dtype=np.int64),
+        np.array(movies, dtype="S32"),
+        np.concatenate(weights),
+    )
+
+
+def matrix(users, movies, weights):
+    """
+    The sorted user ids, sorted movie ids and user x movie CSR matrix of
+    ``interactions()``, with repeated pairs summed.
+    """
+    user_index, rows = np.unique(users, return_inverse=True)
+    movie_index, columns = np.unique(movies, return_inverse=True)
+    x = sparse.csr_matrix(
+        (weights.astype(np.float32), (rows, columns)),
+        shape=(len(user_index), len(movie_index)),
+    )
+    return user_index, movie_index, x
+
+
+def _normalized(x):
+    # Columns scaled to unit length, so products of columns are cosines
+    norms = np.sqrt(np.asarray(x.multiply(x).sum(axis=0), dtype=np.float32).ravel())
+    norms[norms == 0] = 1
+    return (x @ sparse.diags(1 / norms)).tocsr()
+
+
+def similar(x, rows, k=TOP_K, chunk_bytes=CHUNK_BYTES):
+    """
+    The ``k`` nearest neighbors and cosine similarities of the movies
+    (columns of ``x``) at ``rows``.
+    """
+    movie_count = x.shape[1]
+    neighbors = np.full((len(rows), k), -1, dtype=np.int32)
+    scores = np.zeros((len(rows), k), dtype=np.float32)
+    keep = min(k, movie_count - 1)
+    if keep < 1 or not len(rows):
+        return neighbors, scores
+
+    normalized = _normalized(x)
+    by_movie = normalized.T.tocsr()
+
+    # Similarities are computed for a block of movies at a time. Only the
+    # nonzero ones are ranked: one sort puts every row's entries in
+    # descending order and the first k of each row are kept
+    step = max(1, chunk_bytes // (12 * movie_count))
+    for start in range(0, len(rows), step):
+        block = rows[start:start + step]
+        similarities = (by_movie[block] @ normalized).tocsr()
+        row = np.repeat(np.arange(len(block)), np.diff(similarities.indptr))
+        column, value = similarities.indices, similarities.data
+        wanted = (column != block[row]) & (value > 0)
+        row, column, value = row[wanted], column[wanted], value[wanted]
+
+        # Rows are already in order; within a row the key falls as the
+        # similarity grows
+        order = np.argsort(row + (1 - value.astype(np.float64) / 2))
+        row, column, value = row[order], column[order], value[order]
+        rank = np.arange(len(row)) - np.searchsorted(row, row)
+        top = rank < keep
+        neighbors[start + row[top], rank[top]] = column[top]
+        scores[start + row[top], rank[top]] = value[top]
+    return neighbors, scores
+
+
+def _positions(index, keys):
+    # Position of every key in the sorted ``index``, -1 where it's missing
+    if not len(index):
+        return np.full(len(keys), -1, dtype=np.int64)
+    positions = np.searchsorted(index, keys).clip(max=len(index) - 1)
+    return np.where(index[positions] == keys, positions, -1)
+
+
+def _reindex(x, users, movies, all_users, all_movies):
+    coo = x.tocoo()
+    return sparse.csr_matrix(
+        (
+            coo.data,
+            (
+                np.searchsorted(all_users, users[coo.row]),
+                np.searchsorted(all_movies, movies[coo.col]),
+            ),
+        ),
+        shape=(len(all_users), len(all_movies)),
+    )
+
+
+def _stored_matrix(previous):
+    return sparse.csr_matrix(
+        (previous["x_data"], previous["x_indices"], previous["x_indptr"]),
+        shape=(len(previous["users"]), len(previous["movies"])),
+    )
+
+
+def _stale(previous, user_index, movie_index, x):
+    """
+    Rows of ``movie_index`` whose neighbors may differ from ``previous``.
+
+    A similarity only changes when one of its two columns does. So besides
+    the changed movies themselves, a movie needs recomputing only if a
+    changed movie was among its neighbors, or now scores higher than its
+    last neighbor does.
+    """
+    all_users = np.union1d(previous["users"], user_index)
+    all_movies = np.union1d(previous["movies"], movie_index)
+    old = _reindex(
+        _stored_matrix(previous), previous["users"], previous["movies"], all_users, all_movies
+    )
+    new = _reindex(x, user_index, movie_index, all_users, all_movies)
+
+    delta = (old - new).tocsr()
+    # Sums of the same weights in another order can differ in the last bit
+    delta.data[np.abs(delta.data) < 1e-6] = 0
+    delta.eliminate_zeros()
+    if not delta.nnz:
+        return np.empty(0, dtype=np.int64)
+    changed = all_movies[np.unique(delta.indices)]
+    changed_rows = _positions(movie_index, changed)
+    changed_rows = changed_rows[changed_rows >= 0]
+    changed_old = _positions(previous["movies"], changed)
+
+    listed = np.isin(previous["neighbors"], changed_old[changed_old >= 0]).any(axis=1)
+    listed = _positions(movie_index, previous["movies"][listed])
+
+    # Best similarity of every movie to a changed one, against the score of
+    # its last neighbor before (0 while it had fewer than k)
+    normalized = _normalized(x)
+    best = (normalized[:, changed_rows].T @ normalized).max(axis=0).toarray().ravel()
+    old_rows = _positions(previous["movies"], movie_index)
+    last = np.where(old_rows >= 0, previous["scores"][old_rows, -1], 0)
+    rising = np.flatnonzero(best > last)
+
+    stale = np.union1d(changed_rows, np.union1d(listed, rising))
+    return stale[stale >= 0]
+
+
+def compute(users, movies, weights, previous=None, k=TOP_K):
+    """
+    The arrays of a recommendations file for the given interactions, and
+    how many movies had their neighbors computed. With the arrays of an
+    earlier file as ``previous``, only movies that may have changed are.
+    """
+    user_index, movie_index, x = matrix(users, movies, weights)
+    movie_count = len(movie_index)
+
+    if previous is None or int(previous["k"]) != k:
+        rows = np.arange(movie_count)
+        neighbors, scores = similar(x, rows, k)
+    else:
+        rows = _stale(previous, user_index, movie_index, x)
+        neighbors = np.full((movie_count, k), -1, dtype=np.int32)
+        scores = np.zeros((movie_count, k), dtype=np.float32)
+
+        # Every movie kept from before is in the new index with the same
+        # column, and so are its neighbors
+        kept = np.setdiff1d(np.arange(movie_count), rows)
+        old_rows = _positions(previous["movies"], movie_index[kept])
+        old_neighbors = previous["neighbors"][old_rows]
+        moved = _positions(movie_index, previous["movies"]).astype(np.int32)
+        neighbors[kept] = np.where(old_neighbors >= 0, moved[old_neighbors], -1)
+        scores[kept] = previous["scores"][old_rows]
+
+        neighbors[rows], scores[rows] = similar(x, rows, k)
+
+    pickers = np.diff(x.tocsc().indptr)
+    popular = np.argsort(-pickers, kind="stable")[:POPULAR].astype(np.int32)
+    arrays = {
+        "k": np.int32(k),
+        "movies": movie_index,
+        "neighbors": neighbors,
+        "scores": scores,
+        "popular": popular,
+        "users": user_index,
+        "x_data": x.data,
+        "x_indices": x.indices,
+        "x_indptr": x.indptr,
+    }
+    return arrays, len(rows)
+
+
+def path():
+    return str(settings.RECOMMENDATIONS_PATH)
+
+
+def load(filename=None):
+    """Every array of the recommendations file, or None if there is none."""
+    try:
+        with np.load(filename or path()) as data:
+            return {name: data[name] for name in data.files}
+    except FileNotFoundError:
+        return None
+
+
+def save(arrays, filename=None):
+    # Written next to the target and renamed over it, so readers in other
+    # processes never see half a file
+    filename = filename or path()
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix=".npz")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(temporary, filename)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def refresh(full=False, k=TOP_K, filename=None):
+    """
+    Bring the recommendations file up to date with the database. Returns
+    (movies recomputed, movies, interactions).
+    """
+    previous = None if full else load(filename)
+    users, movies, weights = interactions()
+    arrays, recomputed = compute(users, movies, weights, previous=previous, k=k)
+    save(arrays, filename)
+    return recomputed, len(arrays["movies"]), len(users)
+
+
+def build(k=TOP_K, filename=None):
+    return refresh(full=True, k=k, filename=filename)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def current(filename=None):
+    """
+    The arrays serving needs, loaded once per process and again whenever
+    the file is replaced. None if there is no file.
+    """
+    filename = filename or path()
+    try:
+        modified = os.stat(filename).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _cache.get(filename)
+    if cached is not None and cached[0] == modified:
+        return cached[1]
+
+    with _cache_lock:
+        cached = _cache.get(filename)
+        if cached is None or cached[0] != modified:
+            try:
+                with np.load(filename) as data:
+                    arrays = {
+                        name: data[name]
+                        for name in ("movies", "neighbors", "scores", "popular")
+                    }
+            except FileNotFoundError:
+                return None
+            cached = _cache[filename] = (modified, arrays)
+    return cached[1]
+
+
+def picks(user_id):
+    """
+    How much the user likes each movie they favorited, watchlisted or
+    liked, and every movie they have already seen or listed.
+    """
+    weights = {}
+    seen = set()
+    for manager, weight in (
+        (CustomUser.favorites, FAVORITE_WEIGHT),
+        (CustomUser.watchlist, WATCHLIST_WEIGHT),
+    ):
+        for movie_id in manager.through.objects.filter(customuser_id=user_id).values_list(
+            "movieinfo_id", flat=True
+        ):
+            weights[movie_id] = weights.get(movie_id, 0.0) + weight
+            seen.add(movie_id)
+    for movie_id, value in Rating.movie.through.objects.filter(
+        rating__user_id=user_id
+    ).values_list("movieinfo_id", "rating__rating"):
+        if weight := rating_weight(value):
+            weights[movie_id] = weights.get(movie_id, 0.0) + weight
+        seen.add(movie_id)
+    return weights, seen
+
+
+def rank(arrays, weights, seen, limit=DEFAULT_LIMIT):
+    """
+    Movie ids for a user with the given ``picks()``: their picks' neighbor
+    lists merged by weighted similarity, then popular movies if that isn't
+    enough. Nothing in ``seen`` is returned.
+    """
+    movies = arrays["movies"]
+    seen_rows = _positions(movies, np.array([m.hex for m in seen], dtype="S32"))
+    excluded = seen_rows[seen_rows >= 0]
+    ranked = np.empty(0, dtype=np.int64)
+
+    if weights:
+        rows = _positions(movies, np.array([m.hex for m in weights], dtype="S32"))
+        liked = np.fromiter(weights.values(), dtype=np.float32, count=len(weights))
+        found = rows >= 0
+        rows, liked = rows[found], liked[found]
+
+        candidates = arrays["neighbors"][rows].ravel()
+        totals = (arrays["scores"][rows] * liked[:, None]).ravel()
+        valid = candidates >= 0
+        candidates, inverse = np.unique(candidates[valid], return_inverse=True)
+        totals = np.bincount(inverse, weights=totals[valid])
+
+        fresh = ~np.isin(candidates, excluded)
+        candidates, totals = candidates[fresh], totals[fresh]
+        # Highest total first, ties in index order
+        ranked = candidates[np.lexsort((candidates, -totals))[:limit]]
+
+    if len(ranked) < limit:
+        popular = arrays["popular"]
+        popular = popular[~np.isin(popular, np.concatenate([excluded, ranked]))]
+        ranked = np.concatenate([ranked, popular[:limit - len(ranked)]])
+
+    return [uuid.UUID(movies[row].decode()) for row in ranked]
+
+
+def recommend(user_id, limit=DEFAULT_LIMIT):
+    """
+    Up to ``limit`` movie ids for the user, best first, or None when there
+    are no recommendations to serve from.
+    """
+    if not available():
+        return None
+    arrays = current()
+    if arrays is None:
+        return None
+    weights, seen = picks(user_id)
+    return rank(arrays, weights, seen, limit)
@@ -0,0 +1,123 @@
+"""
+Read replica routing.
+
+``ReplicaMiddleware`` lets GET, HEAD and OPTIONS requests read from one of
+``DATABASE_REPLICAS``, picked once per request so every query in it sees
+the same snapshot. Everything else uses the primary: writes, reads in other
+requests and management commands, and any read inside a transaction.
+
+Replicas lag behind the primary, so a client that has just written is
+pinned to the primary for ``REPLICA_PIN_SECONDS``. Browsers carry the pin
+in a cookie. Token clients, such as the frontend's server-side fetches, are
+pinned by their Authorization header in the cache, which has to be shared
+between workers (not the default LocMemCache) for that to hold across
+processes.
+"""
+
+import contextvars
+import hashlib
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+PIN_COOKIE = "db_pin"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Replica alias this request may read from, None for the primary
+_read_alias = contextvars.ContextVar("read_alias", default=None)
+# A list rather than a flag so writes made in sync_to_async threads, which
+# run in a copy of the context, are still seen by the middleware
+_wrote = contextvars.ContextVar("wrote", default=None)
+
+
+def _pin_seconds():
+    return getattr(settings, "REPLICA_PIN_SECONDS", 10)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        wrote = _wrote.get()
+        if wrote is not None:
+            # Reads for the rest of the request should see this write
+            wrote.append(True)
+            _read_alias.set(None)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *getattr(settings, "DATABASE_REPLICAS", [])}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in getattr(settings, "DATABASE_REPLICAS", []):
+            return False
+        return None
+
+
+def _pin_key(request):
+    authorization = request.META.get("HTTP_AUTHORIZATION")
+    if not authorization:
+        return None
+    return "db-pin:{}".format(hashlib.sha256(authorization.encode()).hexdigest())
+
+
+def _is_pinned(request):
+    if request.COOKIES.get(PIN_COOKIE):
+        return True
+    key = _pin_key(request)
+    return key is not None and cache.get(key) is not None
+
+
+def _pin(request, response):
+    seconds = _pin_seconds()
+    response.set_cookie(PIN_COOKIE, "1", max_age=seconds, httponly=True, samesite="Lax")
+    key = _pin_key(request)
+    if key is not None:
+        cache.set(key, True, seconds)
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def start(self, request):
+        replicas = getattr(settings, "DATABASE_REPLICAS", [])
+        alias = None
+        if replicas and request.method in SAFE_METHODS and not _is_pinned(request):
+            alias = random.choice(replicas)
+        return _read_alias.set(alias), _wrote.set([])
+
+    def finish(self, request, response, tokens):
+        read_token, wrote_token = tokens
+        if _wrote.get():
+            _pin(request, response)
+        _read_alias.reset(read_token)
+        _wrote.reset(wrote_token)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        tokens = self.start(request)
+        return self.finish(request, self.get_response(request), tokens)
+
+    async def __acall__(self, request):
+        tokens = self.start(request)
+        return self.finish(request, await self.get_response(request), tokens)
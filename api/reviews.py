@@ -0,0 +1,120 @@
+"""
+The move of an existing review table to the current Review model.
+
+Review gained a creation time, a limit of one review per user and movie
+(review_unique_movie_user) and an index for paging a movie's reviews by
+creation time (review_movie_created_idx). The app has no migrations and
+``migrate --run-syncdb`` never alters a table that already exists, so a
+database from before keeps its old api_review table until
+``manage.py migrate_reviews`` brings it up to date (``upgrade_table()``):
+
+* the ``created`` column is added, set to the time of the upgrade on
+  existing reviews,
+* all but one of each user's reviews of a movie are deleted, the newest
+  where they can be told apart,
+* the constraint and the index are added.
+
+Each step is skipped when already done, so running it again is harmless.
+The old table is described by a model in a registry of its own, as in
+api/credits.py.
+"""
+
+from django.apps.registry import Apps
+from django.db import connection, models, transaction
+from django.db.models import Exists, OuterRef, Q
+
+from api.models import Review
+
+
+LEGACY_APPS = Apps()
+
+
+class _LegacyUser(models.Model):
+    id = models.BigAutoField(primary_key=True)
+
+    class Meta:
+        apps = LEGACY_APPS
+        app_label = "api"
+        db_table = "api_customuser"
+
+
+class _LegacyMovie(models.Model):
+    id = models.UUIDField(primary_key=True)
+
+    class Meta:
+        apps = LEGACY_APPS
+        app_label = "api"
+        db_table = "api_movieinfo"
+
+
+class LegacyReview(models.Model):
+    id = models.UUIDField(primary_key=True)
+    user = models.ForeignKey(_LegacyUser, on_delete=models.CASCADE)
+    movie = models.ForeignKey(_LegacyMovie, on_delete=models.CASCADE)
+    content = models.TextField()
+
+    class Meta:
+        apps = LEGACY_APPS
+        app_label = "api"
+        db_table = "api_review"
+
+
+def missing():
+    """
+    The column, constraint and index names of Review the table lacks, in
+    the order ``upgrade_table()`` adds them.
+    """
+    table = Review._meta.db_table
+    with connection.cursor() as cursor:
+        columns = {
+            column.name for column in connection.introspection.get_table_description(cursor, table)
+        }
+        constraints = connection.introspection.get_constraints(cursor, table)
+    found = [] if Review._meta.get_field("created").column in columns else ["created"]
+    for item in (*Review._meta.constraints, *Review._meta.indexes):
+        if item.name not in constraints:
+            found.append(item.name)
+    return found
+
+
+def upgrade_table():
+    """
+    Bring the review table up to date with Review. Returns how many
+    duplicate reviews were deleted.
+    """
+    # One schema editor per step: SQLite rebuilds the table for some of
+    # them, with whatever the model has, which the next check picks up
+    if "created" in missing():
+        # A copy, as SQLite builds a model class around the field
+        field = Review._meta.get_field("created").clone()
+        field.set_attributes_from_name("created")
+        with connection.schema_editor() as editor:
+            editor.add_field(LegacyReview, field)
+
+    deleted = 0
+    if set(missing()) & {constraint.name for constraint in Review._meta.constraints}:
+        newer = Review.objects.filter(movie=OuterRef("movie"), user=OuterRef("user")).filter(
+            Q(created__gt=OuterRef("created")) | Q(created=OuterRef("created"), pk__gt=OuterRef("pk"))
+        )
+        with transaction.atomic():
+            deleted = Review.objects.filter(Exists(newer)).delete()[1].get("api.Review", 0)
+
+    for constraint in Review._meta.constraints:
+        if constraint.name in missing():
+            with connection.schema_editor() as editor:
+                editor.add_constraint(Review, constraint)
+    for index in Review._meta.indexes:
+        if index.name in missing():
+            with connection.schema_editor() as editor:
+                editor.add_index(Review, index)
+    return deleted
+
+
+def create_legacy_table():
+    """
+    Replace the review table with an empty one in the old shape. Only
+    tests need it back.
+    """
+    with connection.schema_editor() as editor:
+        editor.delete_model(Review)
+        editor.create_model(LegacyReview)
@@ -0,0 +1,318 @@
+"""
+Fast read-only serialization.
+
+DRF builds each row by asking every field for its attribute and then its
+representation: several method calls, a try/except and a None check per
+field, repeated for every nested row. On list pages that costs more than
+the queries do.
+
+``builder()`` reads a bound serializer's fields once and returns a function
+that builds the same dict straight from an instance, with an attribute
+lookup and a plain conversion (``str``, ``int``, ...) per field. Related
+rows come from the same select_related and prefetch caches DRF would use.
+A field the builder can't prove it handles identically is left to DRF, one
+field at a time. The one difference is that UUIDs stay UUID objects, which
+every renderer writes the way DRF would have formatted them, so rendered
+output is byte for byte the same (see FastSerializationContractTests).
+
+``FastReadMixin`` puts a builder in front of a serializer's
+``to_representation()``. Writes and validation don't change.
+"""
+
+import functools
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.manager import BaseManager
+from rest_framework import ISO_8601, fields, relations, serializers
+from rest_framework.fields import SkipField, empty
+from rest_framework.relations import PKOnlyObject
+from rest_framework.settings import api_settings
+
+
+def _isoformat(value):
+    return value if isinstance(value, str) else value.isoformat()
+
+
+# Field types whose to_representation() is a plain conversion, keyed by
+# that method so subclasses that override it aren't mistaken for them
+_CONVERSIONS = {
+    fields.CharField.to_representation: str,
+    fields.IntegerField.to_representation: int,
+    fields.FloatField.to_representation: float,
+}
+
+
+def _keep(value):
+    return value
+
+
+def _conversion(field):
+    method = type(field).to_representation
+    if method in _CONVERSIONS:
+        return _CONVERSIONS[method]
+    if method is fields.UUIDField.to_representation and field.uuid_format == "hex_verbose":
+        # Formatting UUIDs in Python is the slowest part of a row, and the
+        # renderer writes them in the same form, so they are left as UUIDs
+        # the way DRF already leaves related primary keys
+        return _keep
+    if method is fields.DateField.to_representation:
+        output_format = getattr(field, "format", api_settings.DATE_FORMAT)
+        if isinstance(output_format, str) and output_format.lower() == ISO_8601:
+            return _isoformat
+    return None
+
+
+def _model_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+
+def _path(model, source_attrs):
+    """
+    The model field at the end of ``source_attrs``, or None when getting
+    there could hit something DRF treats specially: a null or reverse
+    relation on the way, a property, a method.
+    """
+    if model is None or not source_attrs:
+        return None
+    for attr in source_attrs[:-1]:
+        field = _model_field(model, attr)
+        if not (
+            field is not None
+            and field.concrete
+            and (field.many_to_one or field.one_to_one)
+            and not field.null
+        ):
+            return None
+        model = field.related_model
+    return _model_field(model, source_attrs[-1])
+
+
+def _generic(field):
+    # What Serializer.to_representation() does for one field
+    def get(instance):
+        attribute = field.get_attribute(instance)
+        check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+        if check_for_none is None:
+            return None
+        return field.to_representation(attribute)
+
+    return ("value", get)
+
+
+def _annotation(name, convert):
+    # Missing annotations are skipped, as they are by DRF for read-only
+    # fields with no default
+    def get(instance):
+        try:
+            value = instance.__dict__[name]
+        except KeyError:
+            raise SkipField()
+        return None if value is None else convert(value)
+
+    return ("value", get)
+
+
+def _many(name, child):
+    # Prefetched rows are read from the cache directly; going through the
+    # related manager costs more than serializing the row
+    def get(instance):
+        cache = instance.__dict__.get("_prefetched_objects_cache")
+        rows = cache[name] if cache and name in cache else getattr(instance, name).all()
+        return [child(row) for row in rows]
+
+    return get
+
+
+def _listed(name, child):
+    # A property returning rows, such as MovieInfo.cast
+    def get(instance):
+        rows = getattr(instance, name)
+        if rows is None:
+            return None
+        if isinstance(rows, BaseManager):
+            rows = rows.all()
+        return [child(row) for row in rows]
+
+    return get
+
+
+def _is_plain(serializer):
+    return type(serializer).to_representation in (
+        serializers.Serializer.to_representation,
+        FastReadMixin.to_representation,
+    )
+
+
+def _step(field, model):
+    """
+    How to produce one field, as one of
+
+    * ``("attr", source_attrs, convert)``: follow the attributes, then
+      convert unless the value is None (or always pass it through when
+      ``convert`` is None),
+    * ``("related", source_attrs, convert)``: the same, ending at a
+      related row,
+    * ``("call", get, convert)``: the same with a function for the lookup,
+    * ``("value", get)``: a function returning the representation, which
+      may raise SkipField.
+    """
+    source_attrs = field.source_attrs
+    target = _path(model, source_attrs)
+
+    if isinstance(field, serializers.ListSerializer):
+        if (
+            type(field).to_representation is serializers.ListSerializer.to_representation
+            and _is_plain(field.child)
+            and len(source_attrs) == 1
+            and target is not None
+            and target.concrete
+            and target.many_to_many
+        ):
+            return ("call", _many(target.name, builder(field.child)), None)
+        if (
+            type(field).to_representation is serializers.ListSerializer.to_representation
+            and _is_plain(field.child)
+            and len(source_attrs) == 1
+            and isinstance(getattr(model, source_attrs[0], None), property)
+        ):
+            return ("call", _listed(source_attrs[0], builder(field.child)), None)
+        return _generic(field)
+
+    if isinstance(field, serializers.Serializer):
+        if (
+            _is_plain(field)
+            and target is not None
+            and target.concrete
+            and (target.many_to_one or target.one_to_one)
+        ):
+            return ("related", source_attrs, builder(field))
+        return _generic(field)
+
+    if type(field) is relations.PrimaryKeyRelatedField:
+        # DRF reads the foreign key column without loading the related row,
+        # and represents it by the raw key
+        if (
+            field.pk_field is None
+            and len(source_attrs) == 1
+            and target is not None
+            and target.concrete
+            and target.many_to_one
+        ):
+            return ("attr", [target.attname], None)
+        return _generic(field)
+
+    convert = _conversion(field)
+    if convert is None:
+        return _generic(field)
+
+    if target is not None and target.concrete and not target.is_relation:
+        return ("attr", source_attrs, convert)
+
+    # An annotation such as average_rating: set on the instance, unknown to
+    # the model class
+    if (
+        model is not None
+        and len(source_attrs) == 1
+        and not hasattr(model, source_attrs[0])
+        and not field.required
+        and not field.allow_null
+        and field.default is empty
+    ):
+        return _annotation(source_attrs[0], convert)
+
+    return _generic(field)
+
+
+def builder(serializer):
+    """
+    Function building ``serializer.to_representation(instance)``.
+
+    The function is generated as Python source with one statement per
+    field, so there is no per-field loop or dispatch left when it runs, and
+    a related row shared by several fields (``person.name``,
+    ``person.birthday``, ...) is looked up once.
+    """
+    model = getattr(getattr(serializer, "Meta", None), "model", None)
+    namespace = {"SkipField": SkipField}
+    lines = ["def build(instance):", "    row = {}"]
+    related = {}
+
+    readable = [field for field in serializer.fields.values() if not field.write_only]
+    for i, field in enumerate(readable):
+        key = repr(field.field_name)
+        kind, *step = _step(field, model)
+
+        if kind == "value":
+            namespace[f"get_{i}"] = step[0]
+            lines += [
+                "    try:",
+                f"        row[{key}] = get_{i}(instance)",
+                "    except SkipField:",
+                "        pass",
+            ]
+            continue
+
+        if kind == "call":
+            get, convert = step
+            namespace[f"get_{i}"] = get
+            expression = f"get_{i}(instance)"
+        else:
+            source_attrs, convert = step
+            # Related rows are looked up once per row and shared
+            relations = len(source_attrs) if kind == "related" else len(source_attrs) - 1
+            owner = "instance"
+            for depth in range(1, relations + 1):
+                prefix = tuple(source_attrs[:depth])
+                if prefix not in related:
+                    # Only the descriptor can tell a missing cache entry
+                    # from a null relation, but it is much slower
+                    name = related[prefix] = f"related_{len(related)}"
+                    lines += [
+                        f"    {name} = {owner}._state.fields_cache.get({prefix[-1]!r})",
+                        f"    if {name} is None:",
+                        f"        {name} = {owner}.{prefix[-1]}",
+                    ]
+                owner = related[prefix]
+            expression = owner if kind == "related" else f"{owner}.{source_attrs[-1]}"
+
+        if convert is None or convert is _keep:
+            lines.append(f"    row[{key}] = {expression}")
+        else:
+            namespace[f"convert_{i}"] = convert
+            lines += [
+                f"    value = {expression}",
+                f"    row[{key}] = None if value is None else convert_{i}(value)",
+            ]
+
+    lines.append("    return row")
+    exec(_compile("\n".join(lines)), namespace)
+    return namespace["build"]
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(source):
+    # Serializers are created per request, and compiling their builders
+    # each time costs more memory than the rows; the source only varies
+    # with the serializer class and the fields asked for
+    return compile(source, "<api.rows builder>", "exec")
+
+
+class FastReadMixin:
+    """
+    Serialize instances with ``builder()`` unless ``FAST_SERIALIZATION``
+    is off.
+    """
+
+    def to_representation(self, instance):
+        build = self.__dict__.get("_build")
+        if build is None:
+            if getattr(settings, "FAST_SERIALIZATION", True):
+                build = builder(self)
+            else:
+                build = super().to_representation
+            self._build = build
+        return build(instance)
@@ -0,0 +1,349 @@
+"""
+Inverted index search over the movie catalog.
+
+Text from a movie's title, description, genre names and cast/crew names is
+split into terms. Every (term, movie) pair is stored once as a SearchPosting
+with a field weighted score, and every term is broken into trigrams so a
+misspelled query word can still be matched against nearby terms.
+
+The index is kept current by the receivers in api/signals.py. Bulk loads
+that bypass signals should call ``rebuild_index()`` afterwards.
+"""
+
+import math
+import re
+import unicodedata
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+
+from api.bulk import CHUNK_SIZE, chunked, insert_rows, reset_sequences
+from api.models import MovieInfo, SearchPosting, SearchTerm, SearchTrigram
+
+
+TOKEN_RE = re.compile(r"\w+")
+
+# How much a single occurrence of a term counts, per field
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "genre": 1.5,
+    "person": 1.5,
+    "description": 1.0,
+}
+
+MAX_HITS = 1000
+
+# Terms found in more than this share of movies carry almost no ranking
+# signal, so they are dropped whenever the query has a rarer term
+COMMON_TERM_RATIO = 0.2
+MAX_TERM_LENGTH = 100
+
+# Typo matching: words shorter than this are only matched exactly
+MIN_FUZZY_LENGTH = 3
+MIN_SIMILARITY = 0.3
+MAX_EXPANSIONS = 3
+FUZZY_CANDIDATES = 50
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in TOKEN_RE.findall(normalize(text))
+    ]
+
+
+def trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    grams_a, grams_b = trigrams(a), trigrams(b)
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+def index_queryset():
+    return MovieInfo.objects.prefetch_related("genres", "credits__person")
+
+
+def movie_terms(movie):
+    """
+    Map every term in a movie's searchable text to its posting weight.
+    """
+    counts = defaultdict(float)
+
+    def add(text, field):
+        for token in tokenize(text):
+            counts[token] += FIELD_WEIGHTS[field]
+
+    add(movie.media_title, "title")
+    add(movie.media_description, "description")
+    for genre in movie.genres.all():
+        add(genre.name, "genre")
+    for credit in movie.credits.all():
+        add(credit.person.name, "person")
+
+    # Dampen repeated words so a long description can't drown out the title
+    return {term: 1 + math.log(weight) for term, weight in counts.items()}
+
+
+def _ensure_terms(terms):
+    """
+    Return {term: id}, creating any terms (and their trigrams) not yet indexed.
+    """
+    term_ids = {}
+    for chunk in chunked(terms):
+        term_ids.update(
+            SearchTerm.objects.filter(term__in=chunk).values_list("term", "id")
+        )
+
+    missing = [term for term in terms if term not in term_ids]
+    if not missing:
+        return term_ids
+
+    SearchTerm.objects.bulk_create(
+        [SearchTerm(term=term) for term in missing],
+        batch_size=CHUNK_SIZE,
+        ignore_conflicts=True,
+    )
+    created = {}
+    for chunk in chunked(missing):
+        created.update(
+            SearchTerm.objects.filter(term__in=chunk).values_list("term", "id")
+        )
+    SearchTrigram.objects.bulk_create(
+        [
+            SearchTrigram(gram=gram, term_id=term_id)
+            for term, term_id in created.items()
+            for gram in trigrams(term)
+        ],
+        batch_size=CHUNK_SIZE,
+        ignore_conflicts=True,
+    )
+    term_ids.update(created)
+    return term_ids
+
+
+def _adjust_doc_counts(deltas):
+    by_delta = defaultdict(list)
+    for term_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(term_id)
+
+    for delta, term_ids in by_delta.items():
+        for chunk in chunked(term_ids):
+            SearchTerm.objects.filter(id__in=chunk).update(
+                doc_count=F("doc_count") + delta
+            )
+
+
+def _existing_postings(movie_ids):
+    postings = defaultdict(set)
+    for chunk in chunked(movie_ids):
+        for movie_id, term_id in SearchPosting.objects.filter(
+            movie_id__in=chunk
+        ).values_list("movie_id", "term_id"):
+            postings[movie_id].add(term_id)
+    return postings
+
+
+def index_movies(movie_ids):
+    """
+    (Re)build the postings for the given movies.
+    """
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return
+
+    with transaction.atomic():
+        old = _existing_postings(movie_ids)
+        movies = {}
+        for chunk in chunked(movie_ids):
+            movies.update(
+                (movie.pk, movie_terms(movie))
+                for movie in index_queryset().filter(id__in=chunk)
+            )
+
+        term_ids = _ensure_terms(
+            {term for terms in movies.values() for term in terms}
+        )
+
+        for chunk in chunked(movie_ids):
+            SearchPosting.objects.filter(movie_id__in=chunk).delete()
+        SearchPosting.objects.bulk_create(
+            [
+                SearchPosting(term_id=term_ids[term], movie_id=movie_id, weight=weight)
+                for movie_id, terms in movies.items()
+                for term, weight in terms.items()
+            ],
+            batch_size=CHUNK_SIZE,
+        )
+
+        deltas = defaultdict(int)
+        for movie_id in movie_ids:
+            new = {term_ids[term] for term in movies.get(movie_id, ())}
+            for term_id in new - old[movie_id]:
+                deltas[term_id] += 1
+            for term_id in old[movie_id] - new:
+                deltas[term_id] -= 1
+        _adjust_doc_counts(deltas)
+
+
+def unindex_movies(movie_ids):
+    movie_ids = list(movie_ids)
+    with transaction.atomic():
+        deltas = defaultdict(int)
+        for term_ids in _existing_postings(movie_ids).values():
+            for term_id in term_ids:
+                deltas[term_id] -= 1
+        for chunk in chunked(movie_ids):
+            SearchPosting.objects.filter(movie_id__in=chunk).delete()
+        _adjust_doc_counts(deltas)
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Drop and rebuild the whole index. Used after bulk loads.
+    """
+    with transaction.atomic():
+        SearchPosting.objects.all().delete()
+        SearchTrigram.objects.all().delete()
+        SearchTerm.objects.all().delete()
+
+        # The tables are empty, so term ids can be handed out here instead
+        # of being read back after every insert.
+        term_ids = {}
+        doc_counts = defaultdict(int)
+        postings = []
+
+        movies = index_queryset().order_by("pk").iterator(chunk_size=batch_size)
+        for movie in movies:
+            for term, weight in movie_terms(movie).items():
+                term_id = term_ids.setdefault(term, len(term_ids) + 1)
+                doc_counts[term_id] += 1
+                postings.append((term_id, movie.pk, weight))
+            if len(postings) >= batch_size * 10:
+                insert_rows(SearchPosting, ["term", "movie", "weight"], postings)
+                postings = []
+        insert_rows(SearchPosting, ["term", "movie", "weight"], postings)
+
+        # Foreign keys are only checked at commit, so the terms can be
+        # written last, once their document counts are known.
+        insert_rows(
+            SearchTerm,
+            ["id", "term", "doc_count"],
+            [(term_id, term, doc_counts[term_id]) for term, term_id in term_ids.items()],
+        )
+        insert_rows(
+            SearchTrigram,
+            ["gram", "term"],
+            [
+                (gram, term_id)
+                for term, term_id in term_ids.items()
+                for gram in trigrams(term)
+            ],
+        )
+
+        # Explicit ids above don't advance the sequence
+        reset_sequences([SearchTerm])
+
+    return len(term_ids)
+
+
+def _fuzzy_terms(token):
+    """
+    Indexed terms that look like ``token``, as (id, doc_count, similarity).
+    """
+    if len(token) < MIN_FUZZY_LENGTH:
+        return []
+
+    candidates = (
+        SearchTrigram.objects.filter(gram__in=trigrams(token), term__doc_count__gt=0)
+        .values("term_id", "term__term", "term__doc_count")
+        .annotate(shared=Count("id"))
+        .order_by("-shared")[:FUZZY_CANDIDATES]
+    )
+    matches = []
+    for row in candidates:
+        score = similarity(token, row["term__term"])
+        if score >= MIN_SIMILARITY:
+            matches.append((row["term_id"], row["term__doc_count"], score))
+
+    matches.sort(key=lambda match: match[2], reverse=True)
+    return matches[:MAX_EXPANSIONS]
+
+
+def search_movies(query, limit=MAX_HITS):
+    """
+    Rank movies against ``query``.
+
+    Returns a list of (movie_id, score) pairs, best match first. Each query
+    word is looked up exactly; words with no exact match fall back to the
+    closest terms by trigram similarity, scored down by how close they are.
+    Scores are the posting weights times each term's inverse document
+    frequency, so rare words dominate the ranking.
+    """
+    tokens = list(dict.fromkeys(tokenize(query)))
+    if not tokens:
+        return []
+
+    exact = {
+        term: (term_id, doc_count)
+        for term, term_id, doc_count in SearchTerm.objects.filter(
+            term__in=tokens, doc_count__gt=0
+        ).values_list("term", "id", "doc_count")
+    }
+
+    matched = {}
+    for token in tokens:
+        if token in exact:
+            term_id, doc_count = exact[token]
+            matched[term_id] = (doc_count, 1.0)
+            continue
+        for term_id, doc_count, score in _fuzzy_terms(token):
+            if score > matched.get(term_id, (0, 0.0))[1]:
+                matched[term_id] = (doc_count, score)
+
+    if not matched:
+        return []
+
+    total = MovieInfo.objects.count()
+    selective = {
+        term_id: match
+        for term_id, match in matched.items()
+        if match[0] <= total * COMMON_TERM_RATIO
+    }
+    if selective:
+        matched = selective
+
+    if len(matched) == 1:
+        # A single term is already in score order on the (term, weight,
+        # movie) index, so there is nothing to aggregate
+        [(term_id, (doc_count, score))] = matched.items()
+        idf = score * math.log(1 + total / doc_count)
+        hits = (
+            SearchPosting.objects.filter(term_id=term_id)
+            .order_by("-weight", "-movie_id")
+            .values_list("movie_id", "weight")[:limit]
+        )
+        return [(movie_id, weight * idf) for movie_id, weight in hits]
+
+    multipliers = Case(
+        *[
+            When(term_id=term_id, then=Value(score * math.log(1 + total / doc_count)))
+            for term_id, (doc_count, score) in matched.items()
+        ],
+        output_field=FloatField(),
+    )
+    hits = (
+        SearchPosting.objects.filter(term_id__in=matched)
+        .values("movie_id")
+        .annotate(score=Sum(F("weight") * multipliers))
+        .order_by("-score", "movie_id")[:limit]
+    )
+    return [(hit["movie_id"], hit["score"]) for hit in hits]
@@ -1,11 +1,38 @@
 from django.contrib.auth import get_user_model
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
-from api import models
+from api import metrics, models
+from api.rows import FastReadMixin
 
 # Use the custom user model
 User = get_user_model()
 
+
+# Count the time spent building ``.data`` towards the request's serialize
+# timing (see api/metrics.py). Only needed on serializers views use
+# directly, nested ones are timed as part of their parent.
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with metrics.timed("serialize"):
+            return super().data
+
+
+class TimedSerializerMixin:
+    @property
+    def data(self):
+        with metrics.timed("serialize"):
+            return super().data
+
+
+# Takes ``fields``, the names to keep (see api/fieldsets.py), None for all
+class SparseFieldsMixin:
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
 # User creation serializer (inherited from Djoser)
 class UserCreateSerializer(UserCreateSerializer):
     class Meta(UserCreateSerializer.Meta):
@@ -35,34 +62,82 @@ class PersonSerializer(serializers.ModelSerializer):
         fields = ['name', 'birthday', 'description', 'image_url']
 
 
-# Actor serializer with nested Person information
+# An actor's credit, as an entry of a movie's actors_list
 class ActorSerializer(serializers.ModelSerializer):
+    id = serializers.UUIDField(source="person.id")
     name = serializers.CharField(source="person.name")
     birthday = serializers.DateField(source="person.birthday")
     description = serializers.CharField(source="person.description")
     image_url = serializers.CharField(source="person.image_url", required=False)
 
     class Meta:
-        model = models.Actor
-        fields = ['id', 'name', 'birthday', 'description', 'image_url']
+        model = models.Credit
+        fields = ['id', 'name', 'birthday', 'description', 'image_url', 'character']
+
+
+# A movie's credits block (movies/<pk>/credits)
+class CreditPersonSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Person
+        fields = ['id', 'name', 'image_url']
+
+
+class MovieCreditSerializer(TimedSerializerMixin, FastReadMixin, serializers.ModelSerializer):
+    person = CreditPersonSerializer()
+
+    class Meta:
+        model = models.Credit
+        fields = ['person', 'role', 'order', 'character']
+        list_serializer_class = TimedListSerializer
+
+
+# A person's filmography (people/<pk>/credits)
+class CreditMovieSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.MovieInfo
+        fields = ['id', 'media_title', 'media_release_date', 'image_url']
+
+
+class FilmographySerializer(TimedSerializerMixin, FastReadMixin, serializers.ModelSerializer):
+    movie = CreditMovieSerializer()
+
+    class Meta:
+        model = models.Credit
+        fields = ['movie', 'role', 'order', 'character']
+        list_serializer_class = TimedListSerializer
 
 
 # Review serializer
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(TimedSerializerMixin, FastReadMixin, serializers.ModelSerializer):
     user = CustomUserSerializer()
     class Meta:
         model = models.Review
-        fields = ['id', 'user', 'movie', 'content']
+        fields = ['id', 'user', 'movie', 'content', 'created']
+        list_serializer_class = TimedListSerializer
 
 class RatingSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Rating
         fields = ['id', 'user', 'movie', 'rating']
 
+
+# Rating statistics for a single movie
+class MovieRatingStatsSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    sum = serializers.IntegerField(source="total")
+    histogram = serializers.DictField(child=serializers.IntegerField())
+
+    class Meta:
+        model = models.MovieRatingStats
+        fields = ['movie', 'count', 'sum', 'average', 'histogram']
+
 # Movie serializer with nested Genre and Actor serializers
-class MovieInfoSerializer(serializers.ModelSerializer):
+class MovieInfoSerializer(
+    TimedSerializerMixin, SparseFieldsMixin, FastReadMixin, serializers.ModelSerializer
+):
     genres = GenreSerializer(many=True)
-    actors_list = ActorSerializer(many=True)
+    actors_list = ActorSerializer(many=True, source="cast")
+    # Annotated by MovieInfo.objects.with_related()
+    average_rating = serializers.FloatField(read_only=True)
 
     class Meta:
         model = models.MovieInfo
@@ -75,4 +150,6 @@ class MovieInfoSerializer(serializers.ModelSerializer):
             "media_length",
             "media_description",
             "image_url",
+            "average_rating",
         ]
+        list_serializer_class = TimedListSerializer
@@ -0,0 +1,222 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api import metrics, ratings, search, similarity, summaries, versions
+from api.authentication import token_cache
+from api.models import Credit, CustomUser, Genre, MovieInfo, Person, Rating, Review
+
+
+# Keep the search and similarity indexes and the movies' versions in step
+# with the catalog
+
+def movies_changed(movie_ids):
+    movie_ids = list(movie_ids)
+    search.index_movies(movie_ids)
+    similarity.index_movies(movie_ids)
+    versions.bump_movies(movie_ids)
+
+
+@receiver(post_save, sender=MovieInfo)
+def index_saved_movie(sender, instance, **kwargs):
+    movies_changed([instance.pk])
+
+
+@receiver(pre_delete, sender=MovieInfo)
+def unindex_deleted_movie(sender, instance, **kwargs):
+    search.unindex_movies([instance.pk])
+    versions.bump_movies([instance.pk])
+
+
+def reindex_movie_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            movies_changed([instance.pk])
+        return
+
+    # Changed from the other side, e.g. genre.movieinfo_set.add(movie)
+    if action in ("post_add", "post_remove"):
+        movies_changed(pk_set)
+    elif action == "pre_clear":
+        instance._cleared_movie_ids = list(
+            sender.objects.filter(
+                **{f"{type(instance)._meta.model_name}_id": instance.pk}
+            ).values_list("movieinfo_id", flat=True)
+        )
+    elif action == "post_clear":
+        movies_changed(getattr(instance, "_cleared_movie_ids", []))
+
+
+m2m_changed.connect(reindex_movie_relations, sender=MovieInfo.genres.through)
+
+
+@receiver(post_save, sender=Credit)
+@receiver(post_delete, sender=Credit)
+def reindex_credited_movie(sender, instance, origin=None, **kwargs):
+    # Credits deleted along with their movie leave nothing to reindex
+    if isinstance(origin, MovieInfo) or getattr(origin, "model", None) is MovieInfo:
+        return
+    movies_changed([instance.movie_id])
+
+
+@receiver(post_save, sender=Genre)
+def reindex_genre_movies(sender, instance, created, **kwargs):
+    if not created:
+        movies_changed(instance.movieinfo_set.values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender=Genre)
+def remember_genre_movies(sender, instance, **kwargs):
+    # The genre's links are deleted with it without an m2m_changed signal
+    instance._movie_ids = list(instance.movieinfo_set.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Genre)
+def reindex_deleted_genre_movies(sender, instance, **kwargs):
+    movies_changed(getattr(instance, "_movie_ids", []))
+
+
+@receiver(post_save, sender=Person)
+def reindex_person_movies(sender, instance, created, **kwargs):
+    if created:
+        return
+    movies_changed(
+        instance.credits.values_list("movie_id", flat=True).distinct()
+    )
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+def bump_person(sender, instance, **kwargs):
+    versions.bump([versions.person_key(instance.pk)])
+
+
+# Review writes outdate the movie's stored Mistral summary
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def mark_summary_stale(sender, instance, **kwargs):
+    summaries.mark_stale(instance.movie_id)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def bump_reviewed_movie(sender, instance, **kwargs):
+    # Reviews aren't part of movie listings, so the catalog is left alone
+    versions.bump_movies([instance.movie_id], catalog=False)
+
+
+# Favorites and watchlist versions
+
+def bump_user_list(sender, instance, action, reverse, pk_set, **kwargs):
+    list_name = USER_LISTS[sender]
+
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            versions.bump([versions.list_key(list_name, instance.pk)])
+        return
+
+    # Changed from the movie's side: movie.favorites.add(user)
+    if action in ("post_add", "post_remove"):
+        versions.bump(versions.list_key(list_name, user_id) for user_id in pk_set)
+    elif action == "pre_clear":
+        instance._cleared_user_ids = list(
+            sender.objects.filter(movieinfo_id=instance.pk).values_list(
+                "customuser_id", flat=True
+            )
+        )
+    elif action == "post_clear":
+        versions.bump(
+            versions.list_key(list_name, user_id)
+            for user_id in instance._cleared_user_ids
+        )
+
+
+USER_LISTS = {
+    CustomUser.favorites.through: "favorites",
+    CustomUser.watchlist.through: "watchlist",
+}
+for through in USER_LISTS:
+    m2m_changed.connect(bump_user_list, sender=through)
+
+
+# Drop cached credentials once a token or its user changes. djoser's logout
+# and token destroy endpoints delete the token rows.
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def forget_user_tokens(sender, instance, **kwargs):
+    token_cache.delete_user(instance.pk)
+
+
+# Rating statistics
+
+@receiver(post_save, sender=MovieInfo)
+def create_rating_stats(sender, instance, created, **kwargs):
+    if created:
+        ratings.ensure_stats([instance.pk])
+
+
+@receiver(pre_save, sender=Rating)
+def remember_old_rating(sender, instance, **kwargs):
+    instance._old_rating = None
+    if not instance._state.adding:
+        instance._old_rating = (
+            Rating.objects.filter(pk=instance.pk).values_list("rating", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Rating)
+def update_changed_rating(sender, instance, created, **kwargs):
+    old = getattr(instance, "_old_rating", None)
+    if created or old == instance.rating:
+        return
+    movie_ids = list(instance.movie.values_list("pk", flat=True))
+    ratings.record(movie_ids, old, -1)
+    ratings.record(movie_ids, instance.rating, 1)
+
+
+@receiver(pre_delete, sender=Rating)
+def remove_deleted_rating(sender, instance, **kwargs):
+    ratings.record(instance.movie.values_list("pk", flat=True), instance.rating, -1)
+
+
+@receiver(m2m_changed, sender=Rating.movie.through)
+def update_rated_movies(sender, instance, action, reverse, pk_set, **kwargs):
+    sign = {"post_add": 1, "post_remove": -1, "post_clear": -1}.get(action)
+
+    if not reverse:
+        if action == "pre_clear":
+            instance._cleared_movie_ids = list(instance.movie.values_list("pk", flat=True))
+        elif action == "post_clear":
+            ratings.record(instance._cleared_movie_ids, instance.rating, sign)
+        elif sign:
+            ratings.record(pk_set, instance.rating, sign)
+        return
+
+    # Changed from the movie's side: movie.rating_set.add(rating)
+    if action == "pre_clear":
+        instance._cleared_rating_ids = list(instance.rating_set.values_list("pk", flat=True))
+    elif action == "post_clear":
+        ratings.record_ratings(instance.pk, instance._cleared_rating_ids, sign)
+    elif sign:
+        ratings.record_ratings(instance.pk, pk_set, sign)
+
+
+# Time every query for api/metrics.py
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    metrics.install_query_wrapper(connection)
@@ -0,0 +1,251 @@
+"""
+"More like this" over genres, cast and crew.
+
+Two movies are alike in proportion to the Jaccard similarity of their sets
+of genres, actors, writers and directors. Comparing a movie against every
+other one that way is a scan of the whole catalog, so candidates come from
+a locality-sensitive hashing index instead:
+
+* every feature is hashed to 64 bits and the sorted hashes are kept in a
+  MovieFeatures row,
+* a MinHash signature, the minimum of each of NUM_PERM hash functions
+  over the movie's features, is cut into BANDS bands of ROWS values. Each
+  band becomes a SimilarityBucket key, so two movies share a key with
+  probability ``1 - (1 - J**ROWS)**BANDS`` for Jaccard similarity ``J``:
+  about one half at J = 0.1 and above 0.9 from J = 0.2.
+
+``similar_movies()`` reads the movies sharing the most keys with the given
+one, at most MAX_CANDIDATES of them, and ranks those by their exact Jaccard
+similarity from the stored hashes. ``exact_similar_movies()`` does the same
+over every movie, for checking recall (``manage.py benchmark_similarity``).
+
+The index is kept current by the receivers in api/signals.py. Bulk loads
+that bypass signals should call ``rebuild_index()`` afterwards.
+"""
+
+import hashlib
+import random
+from array import array
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count
+
+from api.bulk import CHUNK_SIZE, chunked, insert_rows
+from api.models import Credit, MovieFeatures, MovieInfo, SimilarityBucket
+
+
+NUM_PERM = 128
+BANDS = 64
+ROWS = NUM_PERM // BANDS
+
+MAX_CANDIDATES = 200
+MAX_RESULTS = 20
+
+GENRE_PREFIX = b"g"
+# Feature prefix per credit role, so writing and directing the same movie
+# are different features
+ROLE_PREFIXES = {
+    Credit.ACTOR: b"a",
+    Credit.WRITER: b"w",
+    Credit.DIRECTOR: b"d",
+}
+
+# Band values are folded into a key as a polynomial mod PRIME. The seed is
+# fixed so every process, and every rebuild, computes the same keys.
+PRIME = (1 << 61) - 1
+BAND_MULTIPLIERS = [
+    random.Random(20240601 + row).randrange(1, PRIME) for row in range(ROWS)
+]
+BAND_BITS = 56
+
+
+def feature_hash(prefix, related_id):
+    digest = hashlib.blake2b(prefix + related_id.bytes, digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def _hash_values(feature):
+    # NUM_PERM independent 32-bit hashes of one feature from a single
+    # extendable-output hash call, instead of NUM_PERM multiplications
+    return array("I", hashlib.shake_128(feature.to_bytes(8, "big")).digest(4 * NUM_PERM))
+
+
+def signature(hashes):
+    """The MinHash signature of a set of feature hashes."""
+    return list(map(min, zip(*map(_hash_values, hashes))))
+
+
+def bucket_keys(hashes):
+    """One SimilarityBucket key per band of the MinHash signature of ``hashes``."""
+    values = signature(hashes)
+    keys = []
+    for band in range(BANDS):
+        combined = 0
+        for multiplier, value in zip(BAND_MULTIPLIERS, values[band * ROWS:(band + 1) * ROWS]):
+            combined = (combined + multiplier * value) % PRIME
+        keys.append((band << BAND_BITS) | (combined & ((1 << BAND_BITS) - 1)))
+    return keys
+
+
+def jaccard(a, b):
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+def _pack(hashes):
+    return array("Q", sorted(hashes)).tobytes()
+
+
+def _unpack(data):
+    hashes = array("Q")
+    hashes.frombytes(data)
+    return set(hashes)
+
+
+def movie_features(movie_ids):
+    """{movie id: set of feature hashes}, for movies with any features."""
+    features = defaultdict(set)
+    for chunk in chunked(movie_ids):
+        genres = MovieInfo.genres.through.objects.filter(movieinfo_id__in=chunk)
+        for movie_id, genre_id in genres.values_list("movieinfo_id", "genre_id"):
+            features[movie_id].add(feature_hash(GENRE_PREFIX, genre_id))
+        credits = Credit.objects.filter(movie_id__in=chunk)
+        for movie_id, role, person_id in credits.values_list("movie_id", "role", "person_id"):
+            features[movie_id].add(feature_hash(ROLE_PREFIXES[role], person_id))
+    return features
+
+
+def index_movies(movie_ids):
+    """
+    (Re)build the features and buckets of the given movies.
+    """
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return
+
+    with transaction.atomic():
+        features = movie_features(movie_ids)
+        for chunk in chunked(movie_ids):
+            SimilarityBucket.objects.filter(movie_id__in=chunk).delete()
+            MovieFeatures.objects.filter(movie_id__in=chunk).delete()
+        # Movies deleted in the meantime have no features left
+        MovieFeatures.objects.bulk_create(
+            [
+                MovieFeatures(movie_id=movie_id, hashes=_pack(hashes))
+                for movie_id, hashes in features.items()
+            ],
+            batch_size=CHUNK_SIZE,
+        )
+        SimilarityBucket.objects.bulk_create(
+            [
+                SimilarityBucket(key=key, movie_id=movie_id)
+                for movie_id, hashes in features.items()
+                for key in set(bucket_keys(hashes))
+            ],
+            batch_size=CHUNK_SIZE,
+        )
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Drop and rebuild the whole index. Used after bulk loads.
+    """
+    with transaction.atomic():
+        SimilarityBucket.objects.all().delete()
+        MovieFeatures.objects.all().delete()
+
+        movie_ids = MovieInfo.objects.order_by("pk").values_list("pk", flat=True)
+        batch = []
+        indexed = 0
+        for movie_id in movie_ids.iterator(chunk_size=batch_size):
+            batch.append(movie_id)
+            if len(batch) == batch_size:
+                indexed += _insert(movie_features(batch))
+                batch = []
+        indexed += _insert(movie_features(batch))
+    return indexed
+
+
+def _insert(features):
+    insert_rows(
+        MovieFeatures,
+        ["movie", "hashes"],
+        [(movie_id, _pack(hashes)) for movie_id, hashes in features.items()],
+    )
+    insert_rows(
+        SimilarityBucket,
+        ["key", "movie"],
+        [
+            (key, movie_id)
+            for movie_id, hashes in features.items()
+            for key in set(bucket_keys(hashes))
+        ],
+    )
+    return len(features)
+
+
+def _rank(movie_id, hashes, candidates, limit):
+    scored = [
+        (jaccard(hashes, other), other_id)
+        for other_id, other in candidates
+        if other_id != movie_id
+    ]
+    scored = [(score, other_id) for score, other_id in scored if score > 0]
+    scored.sort(key=lambda hit: (-hit[0], hit[1]))
+    return [(other_id, score) for score, other_id in scored[:limit]]
+
+
+def candidates(movie_id):
+    """
+    Up to MAX_CANDIDATES other movies sharing the most buckets with
+    ``movie_id``, in one query.
+    """
+    keys = SimilarityBucket.objects.filter(movie_id=movie_id).values("key")
+    return [
+        row["movie_id"]
+        for row in SimilarityBucket.objects.filter(key__in=keys)
+        .exclude(movie_id=movie_id)
+        .values("movie_id")
+        .annotate(shared=Count("id"))
+        .order_by("-shared", "movie_id")[:MAX_CANDIDATES]
+    ]
+
+
+def similar_movies(movie_id, limit=MAX_RESULTS):
+    """
+    Movies sharing genres, cast or crew with ``movie_id``, as a list of
+    (movie_id, Jaccard similarity) pairs, most similar first.
+    """
+    candidate_ids = candidates(movie_id)
+    if not candidate_ids:
+        return []
+
+    features = {
+        candidate_id: _unpack(hashes)
+        for candidate_id, hashes in MovieFeatures.objects.filter(
+            movie_id__in=[movie_id, *candidate_ids]
+        ).values_list("movie_id", "hashes")
+    }
+    hashes = features.get(movie_id)
+    if hashes is None:
+        return []
+    return _rank(movie_id, hashes, features.items(), limit)
+
+
+def exact_similar_movies(movie_id, limit=MAX_RESULTS):
+    """
+    ``similar_movies()`` compared against every movie in the index.
+    """
+    hashes = (
+        MovieFeatures.objects.filter(movie_id=movie_id).values_list("hashes", flat=True).first()
+    )
+    if hashes is None:
+        return []
+    everything = MovieFeatures.objects.values_list("movie_id", "hashes").iterator()
+    return _rank(
+        movie_id,
+        _unpack(hashes),
+        ((other_id, _unpack(other)) for other_id, other in everything),
+        limit,
+    )
@@ -0,0 +1,130 @@
+"""
+Streaming responses for whole collections.
+
+A normal list response holds every serialized row and then the rendered
+body in memory at once. With ``?stream=1``, or when the client accepts
+``application/x-ndjson``, views hand their queryset to ``stream()``
+instead. It walks the queryset in chunks, running prefetches one chunk at a
+time, and writes each chunk out before fetching the next, so memory stays
+flat however large the collection is.
+
+``?stream=1`` produces the same bytes as the unpaginated JSON response.
+NDJSON puts one object on each line.
+
+Under ASGI, Django reads a synchronous streaming body into a list before
+sending any of it, so there the body is an async iterator instead, which
+fetches and renders each chunk in the request's sync thread.
+"""
+
+import itertools
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Model
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+
+from api.renderers import ORJSONRenderer
+
+
+CHUNK_SIZE = 200
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if not isinstance(data, list):
+            data = [data]
+        return b"".join(ORJSONRenderer().render(item) + b"\n" for item in data)
+
+
+# For views that stream; NDJSON has to be listed for content negotiation
+RENDERER_CLASSES = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
+
+
+def is_requested(request):
+    return request.query_params.get("stream") in ("1", "true") or isinstance(
+        getattr(request, "accepted_renderer", None), NDJSONRenderer
+    )
+
+
+def _release(instances):
+    """
+    Break the reference cycles Django leaves between model instances.
+
+    Prefetched querysets point back at the instance they were fetched for,
+    and select_related() one-to-ones cache each side on the other. Without
+    this a chunk is only freed by the next garbage collection, by which
+    time several more chunks have piled up.
+    """
+    for instance in instances:
+        prefetched = instance.__dict__.pop("_prefetched_objects_cache", {})
+        for related in prefetched.values():
+            _release(related._result_cache or [])
+        # Prefetch(to_attr=...) lists, such as MovieInfo.prefetched_cast
+        for value in instance.__dict__.values():
+            if isinstance(value, list) and value and isinstance(value[0], Model):
+                _release(value)
+        instance._state.fields_cache.clear()
+
+
+def _rows(queryset, serializer_class, context, chunk_size, serializer_kwargs):
+    # Serializers bound to an instance keep it alive in a reference cycle
+    # until the garbage collector gets round to it, so use one unbound
+    # serializer and hand it each chunk
+    serializer = serializer_class(many=True, context=context, **serializer_kwargs)
+    # iterator() with a chunk_size runs prefetch_related per chunk
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while chunk := list(itertools.islice(rows, chunk_size)):
+        yield from serializer.to_representation(chunk)
+        _release(chunk)
+
+
+def _json(items):
+    renderer = ORJSONRenderer()
+    yield b"["
+    for i, item in enumerate(items):
+        yield (b"," if i else b"") + renderer.render(item)
+    yield b"]"
+
+
+def _ndjson(items):
+    renderer = ORJSONRenderer()
+    for item in items:
+        yield renderer.render(item) + b"\n"
+
+
+async def _aiterate(parts, chunk_size):
+    # One thread hop per chunk of rows rather than per row; thread
+    # sensitive, so the queryset keeps to the connection it started on
+    next_block = sync_to_async(
+        lambda: b"".join(itertools.islice(parts, chunk_size)), thread_sensitive=True
+    )
+    while block := await next_block():
+        yield block
+
+
+def stream(
+    request, queryset, serializer_class, context=None, chunk_size=CHUNK_SIZE, **serializer_kwargs
+):
+    """
+    Stream every row of ``queryset`` serialized with ``serializer_class``,
+    which also gets any other keyword arguments.
+    """
+    items = _rows(
+        queryset, serializer_class, context or {"request": request}, chunk_size, serializer_kwargs
+    )
+
+    if isinstance(getattr(request, "accepted_renderer", None), NDJSONRenderer):
+        parts, content_type = _ndjson(items), NDJSONRenderer.media_type
+    else:
+        parts, content_type = _json(items), "application/json"
+    if isinstance(getattr(request, "_request", request), ASGIRequest):
+        parts = _aiterate(parts, chunk_size)
+    return StreamingHttpResponse(parts, content_type=content_type)
@@ -0,0 +1,363 @@
+"""
+Typeahead suggestions for the search box (search/suggest).
+
+Every process keeps a prefix index over movie titles and people's names in
+memory. Each word of a label starts a key, so "the big sleep", "big sleep"
+and "sleep" all lead to The Big Sleep. Keys are normalized the way the
+search index normalizes text (api/search.py), cut at MAX_KEY characters
+and kept in one sorted list, next to an array of the entry each belongs
+to: a prefix is two bisections and a scan of its range. The matches shown
+are the most popular ones:
+
+* a movie's popularity is how many users favorited, watchlisted or rated
+  it, plus its views over the trending window (api/viewcounts.py),
+* a person's is the sum over the movies they are credited in, plus one
+  per credit.
+
+Short prefixes ("t", "th") cover much of the catalog, so their results
+are cached until the index next changes.
+
+``manage.py build_suggest_index`` writes the index to a snapshot file at
+SUGGEST_SNAPSHOT_PATH, which workers load instead of reading the whole
+catalog, and load again whenever it is replaced. Changes made since are
+caught up from the version counters of api/versions.py: at most every
+SUGGEST_SYNC_SECONDS, the movies and people whose keys were bumped since
+the last sync are read again. Popularity only moves with a new snapshot.
+"""
+
+import bisect
+import heapq
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from api import versions, viewcounts
+from api.bulk import chunked
+from api.models import (
+    Credit,
+    CustomUser,
+    MovieInfo,
+    MovieRatingStats,
+    MovieViews,
+    Person,
+)
+from api.search import normalize
+
+
+MOVIE = "movie"
+PERSON = "person"
+
+MAX_KEY = 40
+# Words of a label past this many don't start keys
+MAX_WORDS = 8
+CACHED_PREFIX = 3
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+
+SNAPSHOT_FORMAT = 1
+
+WORD_RE = re.compile(r"\w\S*")
+# Sorts after every character a key can hold
+_AFTER = chr(0x10FFFF)
+
+
+def words(text):
+    return WORD_RE.findall(normalize(text))
+
+
+def label_keys(label):
+    found = words(label)
+    return {" ".join(found[i:])[:MAX_KEY] for i in range(min(len(found), MAX_WORDS))}
+
+
+def query_key(query):
+    return " ".join(words(query))[:MAX_KEY]
+
+
+class SuggestIndex:
+    """
+    Sorted prefix keys over (type, id, label, popularity) entries.
+    """
+
+    def __init__(self, entries=(), synced_at=None):
+        self.synced_at = synced_at
+        # slot -> (type, id, label, popularity), None once removed
+        self.entries = []
+        self.slots = {}
+        self.free = []
+        self.keys = []
+        self.owners = array("I")
+        self.cache = {}
+        self.lock = threading.Lock()
+
+        pairs = []
+        for entry in entries:
+            slot = self._claim(entry)
+            pairs.extend((key, slot) for key in label_keys(entry[2]))
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.owners = array("I", (slot for _, slot in pairs))
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _claim(self, entry):
+        slot = self.free.pop() if self.free else len(self.entries)
+        if slot == len(self.entries):
+            self.entries.append(entry)
+        else:
+            self.entries[slot] = entry
+        self.slots[entry[:2]] = slot
+        return slot
+
+    def _put(self, entry):
+        self._remove(entry[:2])
+        slot = self._claim(entry)
+        for key in label_keys(entry[2]):
+            position = bisect.bisect_right(self.keys, key)
+            self.keys.insert(position, key)
+            self.owners.insert(position, slot)
+
+    def _remove(self, ref):
+        slot = self.slots.pop(ref, None)
+        if slot is None:
+            return
+        for key in label_keys(self.entries[slot][2]):
+            position = bisect.bisect_left(self.keys, key)
+            while self.owners[position] != slot:
+                position += 1
+            del self.keys[position]
+            del self.owners[position]
+        self.entries[slot] = None
+        self.free.append(slot)
+
+    def update(self, entries, removed=()):
+        """
+        Add or replace ``entries`` and drop the (type, id) pairs in
+        ``removed``.
+        """
+        with self.lock:
+            for ref in removed:
+                self._remove(ref)
+            for entry in entries:
+                self._put(entry)
+            self.cache.clear()
+
+    def suggest(self, query, limit=DEFAULT_LIMIT):
+        """
+        The ``limit`` most popular entries with a word starting with
+        ``query``, as (type, id, label) tuples.
+        """
+        prefix = query_key(query)
+        if not prefix:
+            return []
+        with self.lock:
+            found = self.cache.get(prefix)
+            if found is None:
+                found = self._search(prefix)
+                if len(prefix) <= CACHED_PREFIX:
+                    self.cache[prefix] = found
+        return found[:limit]
+
+    def _search(self, prefix):
+        low = bisect.bisect_left(self.keys, prefix)
+        high = bisect.bisect_left(self.keys, prefix + _AFTER, low)
+        entries = self.entries
+        best = heapq.nsmallest(
+            MAX_LIMIT,
+            set(self.owners[low:high]),
+            key=lambda slot: (-entries[slot][3], entries[slot][2], entries[slot][1]),
+        )
+        return [entries[slot][:3] for slot in best]
+
+    def sync(self):
+        """
+        Read again every movie and person whose version was bumped since
+        the last sync.
+        """
+        started = timezone.now()
+        prefixes = {MOVIE: versions.movie_key(""), PERSON: versions.person_key("")}
+        changed = versions.bumped_since(self.synced_at, prefixes.values())
+
+        entries, removed = [], []
+        for kind, read in ((MOVIE, movie_entries), (PERSON, person_entries)):
+            ids = changed[prefixes[kind]]
+            found = read(ids) if ids else []
+            entries.extend(found)
+            kept = {entry[1] for entry in found}
+            removed.extend((kind, pk) for pk in ids - kept)
+        self.update(entries, removed)
+        self.synced_at = started
+        return len(entries) + len(removed)
+
+    def dump(self):
+        with self.lock:
+            live = [entry for entry in self.entries if entry is not None]
+            slots = {entry[:2]: slot for slot, entry in enumerate(live)}
+            remap = array("I", [0] * len(self.entries))
+            for old, entry in enumerate(self.entries):
+                if entry is not None:
+                    remap[old] = slots[entry[:2]]
+            return {
+                "format": SNAPSHOT_FORMAT,
+                "synced_at": self.synced_at,
+                "entries": live,
+                "keys": self.keys,
+                "owners": array("I", (remap[slot] for slot in self.owners)).tobytes(),
+            }
+
+    @classmethod
+    def undump(cls, data):
+        index = cls(synced_at=data["synced_at"])
+        index.entries = data["entries"]
+        index.slots = {entry[:2]: slot for slot, entry in enumerate(index.entries)}
+        index.keys = data["keys"]
+        index.owners = array("I")
+        index.owners.frombytes(data["owners"])
+        return index
+
+
+def movie_popularity(movie_ids=None):
+    """{movie id: popularity}, for the given movies or all of them."""
+    popularity = Counter()
+
+    def add(queryset, column, total):
+        for chunk in chunked(movie_ids) if movie_ids is not None else [None]:
+            rows = queryset if chunk is None else queryset.filter(**{f"{column}__in": chunk})
+            popularity.update(dict(rows.values(column).annotate(n=total).values_list(column, "n")))
+
+    for relation in (CustomUser.favorites, CustomUser.watchlist):
+        add(relation.through.objects.all(), "movieinfo_id", Count("id"))
+    add(MovieRatingStats.objects.all(), "movie_id", Sum("count"))
+    since = viewcounts.current_hour() - viewcounts.TRENDING_WINDOW_HOURS
+    add(MovieViews.objects.filter(hour__gt=since), "movie_id", Sum("views"))
+    return popularity
+
+
+def movie_entries(movie_ids=None):
+    movies = MovieInfo.objects.order_by()
+    if movie_ids is not None:
+        movie_ids = list(movie_ids)
+        movies = movies.filter(id__in=movie_ids)
+    popularity = movie_popularity(movie_ids)
+    return [
+        (MOVIE, str(movie_id), title, popularity[movie_id])
+        for movie_id, title in movies.values_list("id", "media_title").iterator(chunk_size=5000)
+    ]
+
+
+def person_entries(person_ids=None):
+    people = Person.objects.order_by()
+    credits = Credit.objects.order_by()
+    if person_ids is not None:
+        person_ids = list(person_ids)
+        people = people.filter(id__in=person_ids)
+        credits = credits.filter(person_id__in=person_ids)
+
+    credited = defaultdict(list)
+    for person_id, movie_id in credits.values_list("person_id", "movie_id").iterator(
+        chunk_size=5000
+    ):
+        credited[person_id].append(movie_id)
+    movies = None if person_ids is None else {m for ids in credited.values() for m in ids}
+    popularity = movie_popularity(movies)
+
+    return [
+        (
+            PERSON,
+            str(person_id),
+            name,
+            sum(popularity[movie_id] + 1 for movie_id in credited.get(person_id, ())),
+        )
+        for person_id, name in people.values_list("id", "name").iterator(chunk_size=5000)
+    ]
+
+
+def build():
+    """A SuggestIndex over the whole catalog."""
+    # Anything bumped while the catalog is read is read again on first sync
+    synced_at = timezone.now()
+    return SuggestIndex([*movie_entries(), *person_entries()], synced_at=synced_at)
+
+
+def path():
+    return str(settings.SUGGEST_SNAPSHOT_PATH)
+
+
+def save(index, filename=None):
+    # Written next to the target and renamed over it, so readers in other
+    # processes never see half a file
+    filename = filename or path()
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix=".pickle")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(index.dump(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, filename)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def load(filename=None):
+    """The SuggestIndex in the snapshot file, or None if there is none."""
+    try:
+        with open(filename or path(), "rb") as f:
+            data = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    if data.get("format") != SNAPSHOT_FORMAT:
+        return None
+    return SuggestIndex.undump(data)
+
+
+_state = {"index": None, "modified": None, "checked": 0.0}
+_state_lock = threading.Lock()
+
+
+def reset():
+    """Forget this process's index."""
+    with _state_lock:
+        _state.update(index=None, modified=None, checked=0.0)
+
+
+def current():
+    """
+    This process's index: loaded from the snapshot, or built from the
+    database when there is none, and kept in sync.
+    """
+    interval = settings.SUGGEST_SYNC_SECONDS
+    if _state["index"] is not None and time.monotonic() - _state["checked"] < interval:
+        return _state["index"]
+
+    with _state_lock:
+        if _state["index"] is not None and time.monotonic() - _state["checked"] < interval:
+            return _state["index"]
+        try:
+            modified = os.stat(path()).st_mtime_ns
+        except FileNotFoundError:
+            modified = None
+        if modified is not None and modified != _state["modified"]:
+            index = load()
+            if index is not None:
+                _state.update(index=index, modified=modified)
+        if _state["index"] is None:
+            _state["index"] = build()
+        _state["index"].sync()
+        _state["checked"] = time.monotonic()
+    return _state["index"]
+
+
+def suggest(query, limit=DEFAULT_LIMIT):
+    return current().suggest(query, limit)
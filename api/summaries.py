@@ -0,0 +1,589 @@
+"""
+Stored Mistral summaries of a movie's reviews.
+
+A summary is generated once per review set and kept in ReviewSummary along
+with a fingerprint of the reviews it was built from. Review writes mark the
+summary stale (see api/signals.py and ReviewDetail.patch), and the next read
+regenerates it. Fresh summaries are also kept in the default cache so
+repeated reads never touch the database.
+
+With ``REVIEW_SUMMARY_SERVE_STALE`` enabled, a stale summary is returned
+immediately while a replacement is generated in the background, so only the
+very first reader of a movie ever waits on the LLM.
+
+Prompts are kept within REVIEW_SUMMARY_TOKEN_BUDGET estimated tokens, so a
+movie with thousands of reviews can't outgrow the context window. Reviews
+are read in chunks and packed into batches that fit the budget. A movie
+whose reviews fit one batch is summarized in one call. Otherwise every
+batch is summarized at once (map) and the summaries combined into one
+(reduce). REVIEW_SUMMARY_SAMPLE_SIZE limits a movie to its most recent or
+longest reviews.
+
+``manage.py summarize_reviews`` (``summarize_pending()``) fills the store
+ahead of readers: it summarizes every movie whose reviews changed since its
+last summary, a few Mistral calls at a time and at most
+MISTRAL_REQUESTS_PER_SECOND. Movies are taken in id order and the last one
+finished is written to REVIEW_SUMMARY_CHECKPOINT_PATH as the run goes, so
+an interrupted run resumes where it stopped instead of starting over.
+"""
+
+import asyncio
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.functions import Length
+from django.utils.html import strip_tags
+
+from api import mistral, versions
+from api.models import ContentVersion, MovieInfo, Review, ReviewSummary
+
+
+logger = logging.getLogger(__name__)
+
+
+CACHE_KEY = "review-summary:{}"
+# Reviews read from the database at a time
+REVIEW_CHUNK = 500
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def cache_key(movie_id):
+    return CACHE_KEY.format(movie_id)
+
+
+def cache_timeout():
+    return getattr(settings, "REVIEW_SUMMARY_CACHE_TIMEOUT", 60)
+
+
+def review_fingerprint(movie_id):
+    digest = hashlib.sha256()
+    reviews = Review.objects.filter(movie=movie_id).order_by("id")
+    for review_id, content in reviews.values_list("id", "content").iterator(
+        chunk_size=REVIEW_CHUNK
+    ):
+        digest.update(f"{review_id}:{content}\0".encode())
+    return digest.hexdigest()
+
+
+def _review_version(movie_id):
+    return ContentVersion.objects.filter(key=versions.movie_key(movie_id)).values_list(
+        "version", flat=True
+    )
+
+
+def review_state(movie_id):
+    """
+    ``(version, fingerprint)`` of the movie's reviews. Every review write
+    bumps the movie's version (see api/signals.py), and the version is read
+    first, so while it stays put the fingerprint still holds.
+    """
+    return _review_version(movie_id).first(), review_fingerprint(movie_id)
+
+
+def reviews_changed(movie_id, state):
+    """
+    Whether the movie's reviews differ from those ``state`` was taken of,
+    reading them again only if the movie's version moved since.
+    """
+    version, fingerprint = state
+    if _review_version(movie_id).first() == version:
+        return False
+    return review_fingerprint(movie_id) != fingerprint
+
+
+# Rough token count of English text, close enough to budget prompts by
+CHARS_PER_TOKEN = 4
+# Each review's separator and framing
+SEPARATOR = "\n\n---\n\n"
+
+SUMMARY_PROMPT = (
+    "The following are reviews made by users for the movie {title}, separated by "
+    "---. Summarize the general sentiment and highlight any key points made by reviewers "
+    "without bullet points or any formatting. Keep it short and succinct. If there "
+    "are no reviews say 'No reviews made'."
+)
+MAP_PROMPT = (
+    "The following are some of the reviews made by users for the movie {title}, "
+    "separated by ---. Summarize their general sentiment and key points in a few "
+    "sentences without bullet points or any formatting."
+)
+REDUCE_PROMPT = (
+    "The following are summaries of groups of reviews made by users for the movie "
+    "{title}, separated by ---. Combine them into one summary of the general "
+    "sentiment, highlighting the key points made by reviewers, without bullet points "
+    "or any formatting. Keep it short and succinct."
+)
+
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def token_budget():
+    return settings.REVIEW_SUMMARY_TOKEN_BUDGET
+
+
+class Packer:
+    """
+    Packs texts into batches of at most ``budget`` estimated tokens. A text
+    longer than ``limit`` tokens is cut short; the limit is at most half
+    the budget, so every batch takes at least two texts.
+    """
+
+    def __init__(self, budget, limit):
+        self.budget = budget
+        self.limit = min(limit, budget // 2 - estimate_tokens(SEPARATOR))
+        self.batch = []
+        self.tokens = 0
+
+    def add(self, text):
+        """Add ``text``. Returns the batch it closed, if it closed one."""
+        if estimate_tokens(text) > self.limit:
+            text = text[: self.limit * CHARS_PER_TOKEN - 1] + "…"
+        tokens = estimate_tokens(text + SEPARATOR)
+        closed = None
+        if self.batch and self.tokens + tokens > self.budget:
+            closed = self.flush()
+        self.batch.append(text)
+        self.tokens += tokens
+        return closed
+
+    def flush(self):
+        """The batch being packed, if it has any text."""
+        batch, self.batch, self.tokens = self.batch, [], 0
+        return batch or None
+
+
+def pack(texts, budget=None):
+    """Yield ``texts`` in batches of at most ``budget`` estimated tokens."""
+    packer = Packer(budget or token_budget(), settings.REVIEW_SUMMARY_REVIEW_TOKENS)
+    for text in texts:
+        batch = packer.add(text)
+        if batch:
+            yield batch
+    batch = packer.flush()
+    if batch:
+        yield batch
+
+
+def sampled_reviews(movie_id):
+    """
+    The movie's reviews, or with REVIEW_SUMMARY_SAMPLE_SIZE set, that many
+    of the most recent or longest (REVIEW_SUMMARY_SAMPLE_BY).
+    """
+    reviews = Review.objects.filter(movie=movie_id)
+    size = settings.REVIEW_SUMMARY_SAMPLE_SIZE
+    if not size:
+        return reviews.order_by()
+    order = {"recent": "-created", "longest": Length("content").desc()}[
+        settings.REVIEW_SUMMARY_SAMPLE_BY
+    ]
+    return reviews.order_by(order, "id")[:size]
+
+
+def review_batches(movie_id):
+    """The movie's review texts, read in chunks, in budget sized batches."""
+    contents = sampled_reviews(movie_id).values_list("content", flat=True)
+    yield from pack(
+        strip_tags(content) for content in contents.iterator(chunk_size=REVIEW_CHUNK)
+    )
+
+
+def build_messages(movie, texts, prompt=SUMMARY_PROMPT):
+    messages = [{"role": "system", "content": prompt.format(title=movie.media_title)}]
+    if texts:
+        messages.append({"role": "user", "content": SEPARATOR.join(texts)})
+    return messages
+
+
+def map_reduce(movie, batches, complete, workers=1):
+    """
+    Summarize the review ``batches`` with ``complete(messages)``, up to
+    ``workers`` calls at once. A single batch is summarized in one call;
+    more are each summarized (map), then their summaries combined into one
+    (reduce), in rounds while they don't fit the budget together.
+
+    Returns None if any call returned nothing.
+    """
+    batches = iter(batches)
+    first = next(batches, [])
+    second = next(batches, None)
+    if second is None:
+        return complete(build_messages(movie, first))
+
+    with ThreadPoolExecutor(workers, thread_name_prefix="summary") as pool:
+
+        def summarize(batches, prompt):
+            return list(
+                pool.map(lambda batch: complete(build_messages(movie, batch, prompt)), batches)
+            )
+
+        partials = summarize(itertools.chain([first, second], batches), MAP_PROMPT)
+        while None not in partials:
+            groups = list(pack(partials))
+            if len(groups) == 1:
+                return complete(build_messages(movie, groups[0], REDUCE_PROMPT))
+            partials = summarize(groups, REDUCE_PROMPT)
+    return None
+
+
+def generate_summary(movie):
+    """
+    Ask Mistral to summarize the movie's reviews. Returns None on failure.
+    """
+    return map_reduce(
+        movie,
+        review_batches(movie.pk),
+        mistral.complete_with_retries,
+        workers=settings.MISTRAL_MAX_CONCURRENCY,
+    )
+
+
+def refresh_summary(movie, state=None):
+    """
+    Generate and store a new summary of the reviews in ``state``
+    (review_state(), read now by default). Returns the content, or None on
+    failure.
+    """
+    state = state or review_state(movie.pk)
+    content = generate_summary(movie)
+    if content is None:
+        return None
+    store_summary(movie, state, content)
+    return content
+
+
+def store_summary(movie, state, content):
+    """
+    Store ``content``, summarizing the reviews in ``state``. Returns
+    whether it is already stale.
+    """
+    # A review written while Mistral was busy makes this summary outdated
+    # before it is even stored
+    stale = reviews_changed(movie.pk, state)
+    ReviewSummary.objects.update_or_create(
+        movie=movie,
+        defaults={"fingerprint": state[1], "content": content, "stale": stale},
+    )
+    if not stale:
+        cache.set(cache_key(movie.pk), content, cache_timeout())
+    return stale
+
+
+def _refresh_worker(movie_id):
+    try:
+        movie = MovieInfo.objects.get(pk=movie_id)
+        refresh_summary(movie)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(movie_id)
+        close_old_connections()
+
+
+def run_in_background(func, *args):
+    threading.Thread(target=func, args=args, daemon=True).start()
+
+
+def schedule_refresh(movie_id):
+    with _refreshing_lock:
+        if movie_id in _refreshing:
+            return
+        _refreshing.add(movie_id)
+    run_in_background(_refresh_worker, movie_id)
+
+
+def get_summary(movie):
+    """
+    Return the summary for the movie's current reviews, generating it only
+    when the reviews changed since it was last built.
+    """
+    content = cache.get(cache_key(movie.pk))
+    if content is not None:
+        return content
+
+    summary = ReviewSummary.objects.filter(movie=movie).first()
+    if summary is not None and not summary.stale:
+        cache.set(cache_key(movie.pk), summary.content, cache_timeout())
+        return summary.content
+
+    state = review_state(movie.pk)
+    if summary is not None and summary.fingerprint == state[1]:
+        # Written to, but ended up with the same reviews (e.g. an edit that
+        # didn't change the text)
+        ReviewSummary.objects.filter(pk=summary.pk).update(stale=False)
+        cache.set(cache_key(movie.pk), summary.content, cache_timeout())
+        return summary.content
+
+    if summary is not None and getattr(settings, "REVIEW_SUMMARY_SERVE_STALE", False):
+        schedule_refresh(movie.pk)
+        return summary.content
+
+    return refresh_summary(movie, state)
+
+
+def mark_stale(movie_id):
+    ReviewSummary.objects.filter(movie=movie_id).update(stale=True)
+    cache.delete(cache_key(movie_id))
+
+
+# Batch summarization, see manage.py summarize_reviews
+
+def pending_movies():
+    """
+    Movies whose summary is stale, or reviewed movies without one, in id
+    order.
+    """
+    reviewed = Exists(Review.objects.filter(movie=OuterRef("pk")))
+    summarized = Exists(ReviewSummary.objects.filter(movie=OuterRef("pk")))
+    return MovieInfo.objects.filter(
+        Q(reviewsummary__stale=True) | (reviewed & ~summarized)
+    ).order_by("pk")
+
+
+def checkpoint_path():
+    return str(settings.REVIEW_SUMMARY_CHECKPOINT_PATH)
+
+
+def load_checkpoint():
+    """The unfinished run's progress, or None."""
+    try:
+        with open(checkpoint_path()) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(progress):
+    # Written next to the target and renamed over it, so an interruption
+    # never leaves half a file
+    filename = checkpoint_path()
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(progress, f)
+        os.replace(temporary, filename)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def clear_checkpoint():
+    try:
+        os.unlink(checkpoint_path())
+    except FileNotFoundError:
+        pass
+
+
+def _summarize_worker(movie, complete):
+    # The reviews are read here, a batch at a time as the calls go, so the
+    # movies queued up don't hold theirs in memory
+    try:
+        return map_reduce(movie, review_batches(movie.pk), complete)
+    finally:
+        close_old_connections()
+
+
+def summarize_pending(workers=None, rate=None, limit=None, restart=False):
+    """
+    Summarize the pending_movies(), resuming the unfinished run unless
+    ``restart``. Up to ``workers`` Mistral calls run at once (default
+    MISTRAL_MAX_CONCURRENCY), started at ``rate`` per second at most
+    (default MISTRAL_REQUESTS_PER_SECOND). Stops after ``limit`` movies when
+    given, leaving the rest to the next run.
+
+    Movies are read and summaries stored on the calling thread; the pool
+    reads each movie's reviews and waits on Mistral. Returns a dict counting the movies
+    ``summarized``, ``unchanged`` (their reviews came back to what the
+    stored summary covers) and ``failed``, the latter logged and left for
+    the next run.
+    """
+    workers = workers or settings.MISTRAL_MAX_CONCURRENCY
+    bucket = mistral.TokenBucket(rate or settings.MISTRAL_REQUESTS_PER_SECOND)
+    progress = None if restart else load_checkpoint()
+    progress = progress or {"after": None, "failed": []}
+    counts = {"summarized": 0, "unchanged": 0, "failed": 0}
+
+    movies = pending_movies()
+    if progress["after"] is not None:
+        movies = movies.filter(pk__gt=progress["after"])
+    if limit is not None:
+        movies = movies[:limit]
+
+    # Movie ids in the order taken, and which of them are finished; the
+    # checkpoint moves past a movie once every one before it is too
+    taken = deque()
+    finished = set()
+
+    def finish(movie_id):
+        finished.add(movie_id)
+        while taken and taken[0] in finished:
+            finished.discard(taken[0])
+            progress["after"] = str(taken.popleft())
+        save_checkpoint(progress)
+
+    def collect(done):
+        for future in done:
+            movie, state = in_flight.pop(future)
+            try:
+                content = future.result()
+                if content is None:
+                    raise ValueError("Mistral returned no summary")
+            except Exception:
+                logger.exception("Summarizing movie %s failed", movie.pk)
+                progress["failed"].append(str(movie.pk))
+                counts["failed"] += 1
+            else:
+                store_summary(movie, state, content)
+                counts["summarized"] += 1
+            finish(movie.pk)
+
+    in_flight = {}
+    pool = ThreadPoolExecutor(workers, thread_name_prefix="summarize")
+    try:
+        for movie in movies.iterator(chunk_size=100):
+            state = review_state(movie.pk)
+            summary = ReviewSummary.objects.filter(movie=movie).first()
+            taken.append(movie.pk)
+            if summary is not None and summary.fingerprint == state[1]:
+                ReviewSummary.objects.filter(pk=summary.pk).update(stale=False)
+                counts["unchanged"] += 1
+                finish(movie.pk)
+                continue
+
+            # Keep the next movies queued, but not the whole catalog
+            while len(in_flight) >= 2 * workers:
+                collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+            # One call after another within a movie; the pool runs movies
+            # side by side
+            future = pool.submit(
+                _summarize_worker,
+                movie,
+                functools.partial(mistral.complete_with_retries, bucket=bucket),
+            )
+            in_flight[future] = (movie, state)
+
+        while in_flight:
+            collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+    finally:
+        # Calls already running are waited for, the rest are dropped
+        pool.shutdown(cancel_futures=True)
+
+    if limit is None or sum(counts.values()) < limit:
+        clear_checkpoint()
+    return counts
+
+
+# Async counterparts, used by the ASGI view
+
+# aiterator() can't run values_list() queries chunked (they start in the
+# event loop), so the review reads go through a thread in one hop instead
+areview_state = sync_to_async(review_state)
+areviews_changed = sync_to_async(reviews_changed)
+
+
+async def areview_batches(movie_id):
+    packer = Packer(token_budget(), settings.REVIEW_SUMMARY_REVIEW_TOKENS)
+    contents = sampled_reviews(movie_id).values_list("content", flat=True)
+    async for content in contents.aiterator(chunk_size=REVIEW_CHUNK):
+        batch = packer.add(strip_tags(content))
+        if batch:
+            yield batch
+    batch = packer.flush()
+    if batch:
+        yield batch
+
+
+async def amap_reduce(movie, batches, complete):
+    """
+    Async ``map_reduce``. Each batch is sent as soon as it is read; how
+    many calls run at once is up to ``complete``.
+    """
+    first = await anext(batches, [])
+    second = await anext(batches, None)
+    if second is None:
+        return await complete(build_messages(movie, first))
+
+    def summarize(batch, prompt):
+        return asyncio.ensure_future(complete(build_messages(movie, batch, prompt)))
+
+    tasks = [summarize(first, MAP_PROMPT), summarize(second, MAP_PROMPT)]
+    try:
+        async for batch in batches:
+            tasks.append(summarize(batch, MAP_PROMPT))
+        partials = await asyncio.gather(*tasks)
+        while None not in partials:
+            groups = list(pack(partials))
+            if len(groups) == 1:
+                return await complete(build_messages(movie, groups[0], REDUCE_PROMPT))
+            tasks = [summarize(group, REDUCE_PROMPT) for group in groups]
+            partials = await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return None
+
+
+async def agenerate_summary(movie):
+    return await amap_reduce(movie, areview_batches(movie.pk), mistral.complete)
+
+
+async def _arefresh_summary(movie, state):
+    content = await agenerate_summary(movie)
+    if content is None:
+        return None
+
+    stale = await areviews_changed(movie.pk, state)
+    await ReviewSummary.objects.aupdate_or_create(
+        movie=movie,
+        defaults={"fingerprint": state[1], "content": content, "stale": stale},
+    )
+    if not stale:
+        await cache.aset(cache_key(movie.pk), content, cache_timeout())
+    return content
+
+
+async def aget_summary(movie):
+    """
+    Async ``get_summary``. Concurrent readers of the same movie share one
+    Mistral call.
+    """
+    content = await cache.aget(cache_key(movie.pk))
+    if content is not None:
+        return content
+
+    summary = await ReviewSummary.objects.filter(movie=movie).afirst()
+    if summary is not None and not summary.stale:
+        await cache.aset(cache_key(movie.pk), summary.content, cache_timeout())
+        return summary.content
+
+    state = await areview_state(movie.pk)
+    if summary is not None and summary.fingerprint == state[1]:
+        await ReviewSummary.objects.filter(pk=summary.pk).aupdate(stale=False)
+        await cache.aset(cache_key(movie.pk), summary.content, cache_timeout())
+        return summary.content
+
+    if summary is not None and getattr(settings, "REVIEW_SUMMARY_SERVE_STALE", False):
+        schedule_refresh(movie.pk)
+        return summary.content
+
+    return await mistral.single_flight(
+        ("summary", movie.pk, state[1]),
+        lambda: _arefresh_summary(movie, state),
+    )
@@ -0,0 +1,282 @@
+"""
+Seeded synthetic catalog for benchmarks.
+
+``generate()`` fills the database with movies, people, users, reviews,
+ratings, favorites and watchlists. The same seed and size always produce
+the same rows with the same ids, so benchmark runs can be compared with
+each other.
+
+Popularity is heavily skewed the way real catalogs are: a few movies and
+actors get most of the credits, reviews, ratings and list entries. Ids are
+derived from each row's index rather than remembered, and rows are written
+one chunk of movies at a time, so generating a million movies doesn't need
+a million of anything in memory.
+"""
+
+import datetime
+import itertools
+import random
+import string
+import time
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from api import ratings, search, similarity
+from api.bulk import insert_rows, reset_sequences
+from api.models import (
+    Credit,
+    CustomUser,
+    Genre,
+    MovieInfo,
+    Person,
+    Rating,
+    Review,
+)
+
+
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+
+GENRES = [
+    "Action", "Adventure", "Animation", "Biography", "Comedy", "Crime",
+    "Documentary", "Drama", "Family", "Fantasy", "History", "Horror", "Music",
+    "Mystery", "Romance", "Sci-Fi", "Sport", "Thriller", "War", "Western",
+]
+
+PASSWORD = "benchmark"
+
+# Reviews are spread over the following ten years or so
+REVIEWS_SINCE = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Leading bits of each id, per table
+_KINDS = {
+    "genre": 1,
+    "person": 2,
+    "movie": 6,
+    "review": 7,
+    "rating": 8,
+}
+
+
+class Catalog:
+    """
+    Sizes of a generated catalog, and the ids of its rows.
+    """
+
+    def __init__(self, movies, seed=0):
+        self.seed = seed
+        self.movies = movies
+        self.people = max(100, movies)
+        self.users = max(20, movies // 10)
+        # People are split into actors, then writers, then directors
+        self.actors = int(self.people * 0.7)
+        self.writers = int(self.people * 0.15)
+        self.directors = self.people - self.actors - self.writers
+
+    def id(self, kind, index):
+        return uuid.UUID(int=(_KINDS[kind] << 120) | (self.seed << 64) | index)
+
+    def actor_id(self, index):
+        return self.id("person", index)
+
+    def writer_id(self, index):
+        return self.id("person", self.actors + index)
+
+    def director_id(self, index):
+        return self.id("person", self.actors + self.writers + index)
+
+    def movie_id(self, index):
+        return self.id("movie", index)
+
+    def user_id(self, index):
+        return index + 1
+
+
+def popular(rng, count):
+    """
+    Random index in ``range(count)``, low indexes far more likely.
+    """
+    return int(count * rng.random() ** 3)
+
+
+def distinct(rng, count, k):
+    k = min(k, count)
+    picked = set()
+    while len(picked) < k:
+        picked.add(popular(rng, count))
+    return picked
+
+
+def long_tail(rng, cap):
+    """
+    How many reviews or ratings a movie gets: mostly a few, sometimes many.
+    """
+    return min(cap, int(rng.paretovariate(1.2)) - 1)
+
+
+class Generator:
+    def __init__(self, catalog, chunk_size=2000, stdout=None):
+        self.catalog = catalog
+        self.chunk_size = chunk_size
+        self.stdout = stdout
+        self.rng = random.Random(catalog.seed)
+        self.vocabulary = [
+            "".join(self.rng.choices(string.ascii_lowercase, k=self.rng.randint(3, 10)))
+            for _ in range(5000)
+        ]
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def words(self, count):
+        vocabulary = self.vocabulary
+        return " ".join(vocabulary[popular(self.rng, len(vocabulary))] for _ in range(count))
+
+    def run(self, reindex=True):
+        start = time.perf_counter()
+        with transaction.atomic():
+            self.genres()
+            self.people()
+            self.users()
+        for first in range(0, self.catalog.movies, self.chunk_size):
+            with transaction.atomic():
+                self.movies(range(first, min(first + self.chunk_size, self.catalog.movies)))
+        self.log(f"Generated {self.catalog.movies} movies in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        ratings.recompute()
+        if reindex:
+            search.rebuild_index()
+            similarity.rebuild_index()
+        self.log(f"Built statistics and indexes in {time.perf_counter() - start:.1f}s")
+
+    def genres(self):
+        insert_rows(
+            Genre,
+            ["id", "name"],
+            [(self.catalog.id("genre", i), name) for i, name in enumerate(GENRES)],
+        )
+
+    def people(self):
+        catalog = self.catalog
+        rng = self.rng
+        rows = (
+            (
+                catalog.id("person", i),
+                datetime.date(1930, 1, 1) + datetime.timedelta(days=rng.randrange(25_000)),
+                self.words(2).title()[:80],
+                self.words(rng.randint(10, 40)),
+                "",
+            )
+            for i in range(catalog.people)
+        )
+        for chunk in iter(lambda: list(itertools.islice(rows, self.chunk_size * 5)), []):
+            insert_rows(Person, ["id", "birthday", "name", "description", "image_url"], chunk)
+
+    def users(self):
+        catalog = self.catalog
+        # Hashing is deliberately slow, every user shares one hash
+        password = make_password(PASSWORD)
+        insert_rows(
+            CustomUser,
+            [
+                "id", "password", "last_login", "is_superuser", "email",
+                "username", "is_active", "is_staff", "is_admin",
+            ],
+            [
+                (
+                    catalog.user_id(i), password, None, False,
+                    f"user{i}@example.com", f"user{i}", True, False, False,
+                )
+                for i in range(catalog.users)
+            ],
+        )
+        reset_sequences([CustomUser])
+
+    def movies(self, indexes):
+        catalog = self.catalog
+        rng = self.rng
+        movies, genres, credits = [], [], []
+        reviews, rating_rows, rated = [], [], []
+        favorites, watchlist = [], []
+
+        for i in indexes:
+            movie_id = catalog.movie_id(i)
+            movies.append((
+                movie_id,
+                self.words(rng.randint(1, 4)).title()[:100],
+                datetime.date(1920, 1, 1) + datetime.timedelta(days=rng.randrange(38_000)),
+                rng.randint(70, 200),
+                self.words(rng.randint(20, 80)),
+                "",
+            ))
+            for genre in rng.sample(range(len(GENRES)), rng.randint(1, 3)):
+                genres.append((movie_id, catalog.id("genre", genre)))
+            # The best known actors are billed first
+            actors = sorted(distinct(rng, catalog.actors, rng.randint(4, 12)))
+            for order, actor in enumerate(actors):
+                character = self.words(1).title()[:200]
+                credits.append((movie_id, catalog.actor_id(actor), Credit.ACTOR, order, character))
+            writers = sorted(distinct(rng, catalog.writers, rng.randint(1, 2)))
+            for order, writer in enumerate(writers):
+                credits.append((movie_id, catalog.writer_id(writer), Credit.WRITER, order, ""))
+            director = catalog.director_id(popular(rng, catalog.directors))
+            credits.append((movie_id, director, Credit.DIRECTOR, 0, ""))
+
+            # One review per user and movie
+            for n, user in enumerate(distinct(rng, catalog.users, long_tail(rng, 50))):
+                reviews.append((
+                    catalog.id("review", i * 64 + n),
+                    catalog.user_id(user),
+                    movie_id,
+                    self.words(rng.randint(10, 60)),
+                    REVIEWS_SINCE + datetime.timedelta(seconds=rng.randrange(300_000_000)),
+                ))
+            for n in range(long_tail(rng, 200)):
+                rating_id = catalog.id("rating", i * 256 + n)
+                rating_rows.append((
+                    rating_id,
+                    catalog.user_id(popular(rng, catalog.users)),
+                    min(10, max(1, round(rng.gauss(7, 2)))),
+                ))
+                rated.append((rating_id, movie_id))
+
+        # A list entry per movie, mostly from the most active users
+        for entries in (favorites, watchlist):
+            pairs = {
+                (popular(rng, catalog.users), popular(rng, len(indexes)))
+                for _ in indexes
+            }
+            entries.extend(
+                (catalog.user_id(user), catalog.movie_id(indexes[movie]))
+                for user, movie in sorted(pairs)
+            )
+
+        insert_rows(
+            MovieInfo,
+            [
+                "id", "media_title", "media_release_date", "media_length",
+                "media_description", "image_url",
+            ],
+            movies,
+        )
+        insert_rows(MovieInfo.genres.through, ["movieinfo", "genre"], genres)
+        insert_rows(Credit, ["movie", "person", "role", "order", "character"], credits)
+        insert_rows(Review, ["id", "user", "movie", "content", "created"], reviews)
+        insert_rows(Rating, ["id", "user", "rating"], rating_rows)
+        insert_rows(Rating.movie.through, ["rating", "movieinfo"], rated)
+        insert_rows(CustomUser.favorites.through, ["customuser", "movieinfo"], favorites)
+        insert_rows(CustomUser.watchlist.through, ["customuser", "movieinfo"], watchlist)
+
+
+def generate(size="1k", seed=0, reindex=True, stdout=None):
+    """
+    Fill the database with a synthetic catalog. ``size`` is a key of
+    ``SIZES`` or a number of movies. Returns the Catalog.
+    """
+    movies = SIZES[size.lower()] if isinstance(size, str) else size
+    catalog = Catalog(movies, seed=seed)
+    Generator(catalog, stdout=stdout).run(reindex=reindex)
+    return catalog
@@ -1,3 +1,2569 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import decimal
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import serializers
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from api import (
+    credits,
+    facets,
+    metrics,
+    mistral,
+    ratings,
+    recommendations,
+    reviews,
+    search,
+    similarity,
+    suggest,
+    summaries,
+    synthetic,
+    versions,
+    viewcounts,
+)
+from api.bulk import insert_rows
+from api.renderers import ORJSONRenderer
+from api.serializers import MovieInfoSerializer
+from api.rows import FastReadMixin, builder
+from api.management.commands.benchmark_api import compare
+from api.management.commands.benchmark_async import free_port
+from api.management.timings import percentiles
+from api.replicas import PIN_COOKIE, ReplicaRouter
+from api.authentication import token_cache
+from api.views import UserFavoriteList
+from api.models import (
+    ContentVersion,
+    Credit,
+    CustomUser,
+    Genre,
+    MovieInfo,
+    MoviePage,
+    MovieRatingStats,
+    MovieViews,
+    Person,
+    Rating,
+    Review,
+    ReviewSummary,
+    SearchPosting,
+    SearchTerm,
+    SimilarityBucket,
+)
+
+
+def make_movie(title, genres=(), actors=()):
+    movie = MovieInfo.objects.create(
+        media_title=title,
+        media_release_date=datetime.date(2000, 1, 1),
+        media_length=120,
+        media_description=f"{title} description",
+    )
+    movie.genres.set(genres)
+    set_cast(movie, actors)
+    return movie
+
+
+def set_cast(movie, people):
+    movie.credits.filter(role=Credit.ACTOR).delete()
+    for order, person in enumerate(people):
+        Credit.objects.create(movie=movie, person=person, role=Credit.ACTOR, order=order)
+
+
+def make_person(name):
+    return Person.objects.create(
+        name=name, birthday=datetime.date(1970, 1, 1), description=f"{name} bio"
+    )
+
+
+def make_user(username):
+    user = CustomUser.objects.create_user(
+        email=f"{username}@example.com", username=username, password="password"
+    )
+    token = Token.objects.create(user=user)
+    return user, token
+
+
+class MovieListPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        genres = [Genre.objects.create(name=f"Genre {i}") for i in range(3)]
+        actors = [make_person(f"Actor {i}") for i in range(4)]
+        cls.movies = [
+            make_movie(f"Movie {i}", genres=genres[: i % 3 + 1], actors=actors)
+            for i in range(12)
+        ]
+        cls.user, _ = make_user("lister")
+        cls.user.favorites.set(cls.movies)
+        cls.user.watchlist.set(cls.movies[:5])
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_plain_list_is_unchanged(self):
+        response = self.client.get("/api/v1/movies")
+        self.assertEqual(len(response.json()), 12)
+        self.assertEqual(len(response.json()[0]["actors_list"]), 4)
+
+    def test_cursor_pages_cover_every_movie_once(self):
+        seen = []
+        url = "/api/v1/movies?page_size=5"
+        while url:
+            body = self.client.get(url).json()
+            seen.extend(movie["id"] for movie in body["results"])
+            url = body["next"]
+        self.assertEqual(sorted(seen), sorted(str(m.id) for m in self.movies))
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for base in (
+            "/api/v1/movies",
+            f"/api/v1/users/{self.user.id}/favorites",
+            f"/api/v1/users/{self.user.id}/watchlist",
+            "/api/v1/movies/search?q=Movie",
+        ):
+            sep = "&" if "?" in base else "?"
+            small, _ = self.count_queries(f"{base}{sep}page_size=2")
+            large, _ = self.count_queries(f"{base}{sep}page_size=12")
+            self.assertEqual(small, large, base)
+            unpaginated, _ = self.count_queries(base)
+            self.assertLessEqual(unpaginated, large, base)
+
+
+class MovieSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.noir = Genre.objects.create(name="Noir")
+        cls.actor = make_person("Humphrey Bogart")
+        cls.falcon = make_movie(
+            "The Maltese Falcon", genres=[cls.noir], actors=[cls.actor]
+        )
+        cls.sleep = make_movie("The Big Sleep", actors=[cls.actor])
+        cls.other = make_movie("Casablanca")
+        cls.other.media_description = "Of all the falcon joints in all the towns"
+        cls.other.save()
+
+    def search(self, query, **params):
+        response = self.client.get("/api/v1/movies/search", {"q": query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def titles(self, query):
+        return [movie["media_title"] for movie in self.search(query)]
+
+    def test_title_match_outranks_description_match(self):
+        self.assertEqual(self.titles("falcon"), ["The Maltese Falcon", "Casablanca"])
+
+    def test_matches_genres_and_people(self):
+        self.assertEqual(self.titles("noir"), ["The Maltese Falcon"])
+        self.assertCountEqual(
+            self.titles("bogart"), ["The Maltese Falcon", "The Big Sleep"]
+        )
+
+    def test_misspelled_words_match_by_trigram(self):
+        self.assertEqual(self.titles("maltise")[0], "The Maltese Falcon")
+        self.assertIn("The Big Sleep", self.titles("humphery"))
+
+    def test_index_follows_catalog_changes(self):
+        self.noir.name = "Detective"
+        self.noir.save()
+        self.assertEqual(self.titles("noir"), [])
+        self.assertEqual(self.titles("detective"), ["The Maltese Falcon"])
+
+        set_cast(self.sleep, [])
+        self.assertEqual(self.titles("bogart"), ["The Maltese Falcon"])
+
+        self.falcon.delete()
+        self.assertEqual(self.titles("maltese"), [])
+        self.assertEqual(SearchTerm.objects.get(term="maltese").doc_count, 0)
+
+    def test_rebuild_matches_incremental_index(self):
+        incremental = set(
+            SearchPosting.objects.values_list("term__term", "movie_id", "weight")
+        )
+        search.rebuild_index()
+        rebuilt = set(
+            SearchPosting.objects.values_list("term__term", "movie_id", "weight")
+        )
+        self.assertEqual(incremental, rebuilt)
+
+    def test_paginated_results(self):
+        body = self.search("the", page_size=1)
+        self.assertEqual(body["count"], 3)
+        self.assertEqual(len(body["results"]), 1)
+        self.assertIsNotNone(body["next"])
+
+
+@override_settings(REVIEW_SUMMARY_SERVE_STALE=False)
+class ReviewSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.movie = make_movie("Heat")
+        cls.user, cls.token = make_user("critic")
+        cls.review = Review.objects.create(
+            user=cls.user, movie=cls.movie, content="Great shootout"
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        for name, fake in (
+            ("generate_summary", self.fake_generate),
+            ("agenerate_summary", self.afake_generate),
+        ):
+            patcher = mock.patch.object(summaries, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fake_generate(self, movie):
+        self.calls += 1
+        return f"summary {self.calls}"
+
+    async def afake_generate(self, movie):
+        return self.fake_generate(movie)
+
+    def summary(self):
+        response = self.client.get(f"/api/v1/movies/{self.movie.id}/mistral")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["message"]
+
+    def auth(self):
+        return {"HTTP_AUTHORIZATION": f"Token {self.token.key}"}
+
+    def test_repeated_reads_are_served_from_the_store(self):
+        self.assertEqual(self.summary(), "summary 1")
+        cache.clear()
+        with self.assertNumQueries(2):
+            self.assertEqual(self.summary(), "summary 1")
+        with self.assertNumQueries(1):
+            self.assertEqual(self.summary(), "summary 1")
+        self.assertEqual(self.calls, 1)
+
+    def test_review_writes_mark_summary_stale(self):
+        self.summary()
+        other, token = make_user("other")
+        self.client.post(
+            f"/api/v1/movies/{self.movie.id}/reviews",
+            {"content": "Too long"},
+            HTTP_AUTHORIZATION=f"Token {token.key}",
+        )
+        self.assertEqual(self.summary(), "summary 2")
+
+        url = f"/api/v1/movies/{self.movie.id}/reviews/{self.review.id}"
+        self.client.patch(
+            url,
+            {"content": "Best shootout"},
+            content_type="application/json",
+            **self.auth(),
+        )
+        self.assertEqual(self.summary(), "summary 3")
+
+        self.client.delete(url, **self.auth())
+        self.assertEqual(self.summary(), "summary 4")
+
+    def test_reviews_are_read_once_per_refresh(self):
+        self.assertEqual(self.summary(), "summary 1")
+        stored = ReviewSummary.objects.get(movie=self.movie)
+        self.assertFalse(stored.stale)
+
+        state = summaries.review_state(self.movie.id)
+        with mock.patch.object(summaries, "review_fingerprint") as fingerprint:
+            self.assertFalse(summaries.store_summary(self.movie, state, "again"))
+        fingerprint.assert_not_called()
+
+        # A review written while Mistral was busy
+        Review.objects.create(user=make_user("late")[0], movie=self.movie, content="Meh")
+        self.assertTrue(summaries.store_summary(self.movie, state, "outdated"))
+
+    def test_unchanged_reviews_reuse_summary(self):
+        self.summary()
+        url = f"/api/v1/movies/{self.movie.id}/reviews/{self.review.id}"
+        self.client.patch(
+            url,
+            {"content": "Great shootout"},
+            content_type="application/json",
+            **self.auth(),
+        )
+        self.assertEqual(self.summary(), "summary 1")
+
+    @override_settings(REVIEW_SUMMARY_SERVE_STALE=True)
+    def test_serve_stale_while_regenerating(self):
+        self.summary()
+        Review.objects.create(user=make_user("late")[0], movie=self.movie, content="Meh")
+
+        scheduled = []
+        with mock.patch.object(
+            summaries, "run_in_background", lambda func, *args: scheduled.append(args)
+        ):
+            self.assertEqual(self.summary(), "summary 1")
+            self.assertEqual(self.summary(), "summary 1")
+        self.assertEqual(scheduled, [(self.movie.id,)])
+
+        summaries._refresh_worker(self.movie.id)
+        self.assertEqual(self.summary(), "summary 2")
+
+
+class FakeMistralHandler(BaseHTTPRequestHandler):
+    """
+    Imitates Mistral's chat completion endpoint, slowly. The first
+    ``server.rate_limited`` calls are turned away with ``server.status``.
+    """
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers["Content-Length"])
+        self.rfile.read(length)
+        with server.lock:
+            server.largest = max(server.largest, length)
+            limited = server.rate_limited > 0
+            if limited:
+                server.rate_limited -= 1
+                server.rejected += 1
+        if limited:
+            body = json.dumps({"message": "Requests rate limit exceeded"}).encode()
+            self.send_response(server.status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        with server.lock:
+            server.calls += 1
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+        time.sleep(server.delay)
+        with server.lock:
+            server.active -= 1
+
+        body = json.dumps({
+            "id": "fake",
+            "object": "chat.completion",
+            "model": "mistral-small-latest",
+            "created": 0,
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "Fake summary"},
+            }],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeMistralServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delay=0.3):
+        super().__init__(("127.0.0.1", 0), FakeMistralHandler)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.calls = self.active = self.peak = 0
+        self.rate_limited = self.rejected = 0
+        self.status = 429
+        # Longest request body, in bytes
+        self.largest = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def handle_error(self, request, client_address):
+        # Timed out clients hang up before the reply is written
+        pass
+
+
+class AsyncMistralSuggestionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = [make_movie(f"Popular {i}") for i in range(4)]
+
+    def setUp(self):
+        cache.clear()
+        self.server = FakeMistralServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        overrides = override_settings(
+            MISTRAL_SERVER_URL=self.server.url,
+            MISTRAL_MAX_CONCURRENCY=2,
+            MISTRAL_TIMEOUT=5,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        env = mock.patch.dict(os.environ, {"MISTRAL_API_KEY": "test-key"})
+        env.start()
+        self.addCleanup(env.stop)
+        mistral.reset()
+        self.addCleanup(mistral.reset)
+
+    async def fetch(self, movie, count):
+        client = AsyncClient()
+        return await asyncio.gather(
+            *[client.get(f"/api/v1/movies/{movie.id}/mistral") for _ in range(count)]
+        )
+
+    async def test_concurrent_requests_share_one_upstream_call(self):
+        responses = await self.fetch(self.movies[0], 10)
+
+        self.assertEqual(self.server.calls, 1)
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), {"message": "Fake summary"})
+
+    async def test_upstream_concurrency_is_capped(self):
+        client = AsyncClient()
+        await asyncio.gather(
+            *[client.get(f"/api/v1/movies/{movie.id}/mistral") for movie in self.movies]
+        )
+        self.assertEqual(self.server.calls, 4)
+        self.assertLessEqual(self.server.peak, 2)
+
+    async def test_slow_upstream_times_out(self):
+        self.server.delay = 1
+        with override_settings(MISTRAL_TIMEOUT=0.2):
+            [response] = await self.fetch(self.movies[0], 1)
+        self.assertEqual(response.status_code, 504)
+
+    async def test_upstream_errors(self):
+        self.server.rate_limited = 1
+        [response] = await self.fetch(self.movies[0], 1)
+        self.assertEqual(response.status_code, 503)
+
+        self.server.rate_limited, self.server.status = 1, 500
+        [response] = await self.fetch(self.movies[1], 1)
+        self.assertEqual(response.status_code, 502)
+
+        with override_settings(MISTRAL_SERVER_URL=f"http://127.0.0.1:{free_port()}"):
+            mistral.reset()
+            [response] = await self.fetch(self.movies[2], 1)
+        self.assertEqual(response.status_code, 503)
+
+    def test_clients_close_with_their_loop(self):
+        async def complete():
+            await mistral.complete([{"role": "user", "content": "Hi"}])
+            return mistral._loop_state().http
+
+        http = asyncio.run(complete())
+        self.assertTrue(http.is_closed)
+
+        # Served through WSGI, each request runs in a loop of its own
+        for movie in self.movies[:2]:
+            response = self.client.get(f"/api/v1/movies/{movie.id}/mistral")
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mistral._loop_states), 0)
+
+
+class SummarizeReviewsTests(TransactionTestCase):
+    # Committed rows, read by the pool's threads on connections of their own
+    # and by the endpoint through the replica aliases
+    databases = {"default", "replica_1", "replica_2"}
+
+    def setUp(self):
+        self.user = make_user("reviewer")[0]
+        self.late = make_user("late reviewer")[0]
+        self.movies = [make_movie(f"Batch {i}") for i in range(5)]
+        for movie in self.movies[:4]:
+            Review.objects.create(user=self.user, movie=movie, content=f"On {movie.media_title}")
+
+        cache.clear()
+        self.server = FakeMistralServer(delay=0.05)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = override_settings(
+            MISTRAL_SERVER_URL=self.server.url,
+            MISTRAL_REQUESTS_PER_SECOND=1000,
+            MISTRAL_BACKOFF=0.01,
+            REVIEW_SUMMARY_CHECKPOINT_PATH=os.path.join(directory.name, "checkpoint.json"),
+            REVIEW_SUMMARY_SERVE_STALE=False,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        env = mock.patch.dict(os.environ, {"MISTRAL_API_KEY": "test-key"})
+        env.start()
+        self.addCleanup(env.stop)
+        mistral.reset()
+        self.addCleanup(mistral.reset)
+
+    def summarize(self, *args):
+        out = io.StringIO()
+        call_command("summarize_reviews", *args, stdout=out)
+        return out.getvalue()
+
+    def summarized(self):
+        return set(
+            ReviewSummary.objects.filter(stale=False, content="Fake summary").values_list(
+                "movie_id", flat=True
+            )
+        )
+
+    def test_only_changed_movies_are_summarized(self):
+        ReviewSummary.objects.create(
+            movie=self.movies[0],
+            fingerprint=summaries.review_fingerprint(self.movies[0].id),
+            content="Up to date",
+        )
+        ReviewSummary.objects.create(
+            movie=self.movies[1], fingerprint="outdated", content="Old", stale=True
+        )
+
+        self.assertIn("Summarized 3 movies, 0 unchanged, 0 failed", self.summarize())
+        self.assertEqual(self.server.calls, 3)
+        self.assertEqual(self.summarized(), {movie.id for movie in self.movies[1:4]})
+
+        # Readers get the stored summary without waiting on Mistral
+        response = self.client.get(f"/api/v1/movies/{self.movies[2].id}/mistral")
+        self.assertEqual(response.json(), {"message": "Fake summary"})
+        self.assertEqual(self.server.calls, 3)
+
+        self.assertIn("Summarized 0 movies", self.summarize())
+        Review.objects.create(user=self.late, movie=self.movies[2], content="Changed my mind")
+        self.assertIn("Summarized 1 movies", self.summarize())
+        self.assertEqual(self.server.calls, 4)
+
+    def test_rate_limited_calls_are_retried(self):
+        self.server.rate_limited = 3
+        self.assertIn("Summarized 4 movies, 0 unchanged, 0 failed", self.summarize())
+        self.assertEqual(self.server.rejected, 3)
+        self.assertEqual(self.server.calls, 4)
+        self.assertEqual(len(self.summarized()), 4)
+
+    @override_settings(MISTRAL_RETRIES=2)
+    def test_movies_still_rate_limited_are_left_for_the_next_run(self):
+        self.server.rate_limited = 3
+        with self.assertLogs("api.summaries", "ERROR"):
+            output = self.summarize("--workers", "1", "--limit", "1")
+        self.assertIn("Summarized 0 movies, 0 unchanged, 1 failed", output)
+        self.assertEqual(ReviewSummary.objects.count(), 0)
+
+        self.assertIn("Summarized 3 movies", self.summarize())
+        self.assertIn("Summarized 1 movies", self.summarize())
+        self.assertEqual(len(self.summarized()), 4)
+
+    def test_interrupted_run_resumes_from_its_checkpoint(self):
+        first = sorted(self.movies[:4], key=lambda movie: movie.pk)[:2]
+        self.assertIn("Summarized 2 movies", self.summarize("--limit", "2"))
+        self.assertEqual(summaries.load_checkpoint()["after"], str(first[-1].pk))
+
+        # Written behind the checkpoint, so left for the next run
+        Review.objects.create(user=self.late, movie=first[0], content="Late")
+        self.assertIn("Summarized 2 movies", self.summarize())
+        self.assertIsNone(summaries.load_checkpoint())
+        self.assertIn("Summarized 1 movies", self.summarize())
+        self.assertEqual(self.server.calls, 5)
+
+    def test_workers_and_rate_are_bounded(self):
+        self.server.delay = 0.2
+        self.summarize("--workers", "2")
+        self.assertLessEqual(self.server.peak, 2)
+
+        bucket = mistral.TokenBucket(rate=50)
+        start = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+
+class FakeLLM:
+    """
+    Stands in for Mistral in summaries.map_reduce(), recording the
+    estimated tokens of every prompt and how many calls overlapped.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.prompts = []
+        self.lock = threading.Lock()
+        self.active = self.peak = 0
+
+    def __call__(self, messages):
+        with self.lock:
+            self.prompts.append(messages)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        return self.reply(messages)
+
+    def reply(self, messages):
+        return f"Summary of {len(messages[-1]['content'])} characters"
+
+    def tokens(self):
+        return [
+            sum(summaries.estimate_tokens(message["content"]) for message in messages)
+            for messages in self.prompts
+        ]
+
+
+@override_settings(
+    REVIEW_SUMMARY_TOKEN_BUDGET=2000,
+    REVIEW_SUMMARY_REVIEW_TOKENS=500,
+    REVIEW_SUMMARY_SAMPLE_SIZE=0,
+)
+class ReviewSummaryPipelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.movie = make_movie("Crowded")
+        users = CustomUser.objects.bulk_create(
+            CustomUser(username=f"crowd{i}", email=f"crowd{i}@example.com") for i in range(120)
+        )
+        start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        Review.objects.bulk_create(
+            Review(
+                user=user,
+                movie=cls.movie,
+                content=f"<p>Review {i}: {'fine ' * (60 + i)}</p>",
+                created=start + datetime.timedelta(hours=i),
+            )
+            for i, user in enumerate(users)
+        )
+        cls.small = make_movie("Quiet")
+        Review.objects.create(user=users[0], movie=cls.small, content="<b>Loved</b> it")
+
+    def summarize(self, movie, llm, workers=4):
+        return summaries.map_reduce(movie, summaries.review_batches(movie.pk), llm, workers)
+
+    def test_prompts_stay_within_the_budget(self):
+        llm = FakeLLM()
+        self.assertEqual(self.summarize(self.movie, llm), llm.reply(llm.prompts[-1]))
+
+        contents = Review.objects.filter(movie=self.movie).values_list("content", flat=True)
+        everything = sum(summaries.estimate_tokens(content) for content in contents)
+        prompt = summaries.estimate_tokens(summaries.REDUCE_PROMPT.format(title="Crowded"))
+        self.assertGreater(everything, 8 * 2000)
+        self.assertGreater(len(llm.prompts), 8)
+        self.assertLessEqual(max(llm.tokens()), 2000 + prompt)
+        # Maps, then one reduce over all of them
+        self.assertEqual(
+            [messages[0]["content"] for messages in llm.prompts[-2:]],
+            [
+                summaries.MAP_PROMPT.format(title="Crowded"),
+                summaries.REDUCE_PROMPT.format(title="Crowded"),
+            ],
+        )
+
+    @override_settings(REVIEW_SUMMARY_TOKEN_BUDGET=400)
+    def test_summaries_are_reduced_in_rounds(self):
+        llm = FakeLLM()
+        self.summarize(self.movie, llm)
+        reduce_prompt = summaries.REDUCE_PROMPT.format(title="Crowded")
+        reduces = [messages for messages in llm.prompts if messages[0]["content"] == reduce_prompt]
+        self.assertGreater(len(reduces), 1)
+        self.assertEqual(llm.prompts[-1], reduces[-1])
+        self.assertLessEqual(max(llm.tokens()), 400 + summaries.estimate_tokens(reduce_prompt))
+
+    def test_batches_are_summarized_concurrently(self):
+        llm = FakeLLM(delay=0.05)
+        start = time.perf_counter()
+        self.summarize(self.movie, llm)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(llm.peak, 4)
+        # One after another would take a delay per call
+        self.assertLess(elapsed, 0.05 * len(llm.prompts) / 2)
+
+    def test_few_reviews_take_one_call(self):
+        llm = FakeLLM()
+        self.summarize(self.small, llm)
+        self.assertEqual(
+            llm.prompts,
+            [[
+                {"role": "system", "content": summaries.SUMMARY_PROMPT.format(title="Quiet")},
+                {"role": "user", "content": "Loved it"},
+            ]],
+        )
+
+    def test_sample_of_recent_or_longest_reviews(self):
+        # The latest reviews are also the longest
+        for sample_by in ("recent", "longest"):
+            with self.subTest(sample_by), override_settings(
+                REVIEW_SUMMARY_SAMPLE_SIZE=3, REVIEW_SUMMARY_SAMPLE_BY=sample_by
+            ):
+                llm = FakeLLM()
+                self.summarize(self.movie, llm)
+                [[_, reviews]] = llm.prompts
+                self.assertEqual(
+                    [text.split(":")[0] for text in reviews["content"].split("---")],
+                    ["Review 119", "\n\nReview 118", "\n\nReview 117"],
+                )
+
+    async def test_endpoint_summarizes_in_parts(self):
+        server = FakeMistralServer(delay=0.05)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        env = mock.patch.dict(os.environ, {"MISTRAL_API_KEY": "test-key"})
+        env.start()
+        self.addCleanup(env.stop)
+        mistral.reset()
+        self.addCleanup(mistral.reset)
+        await cache.aclear()
+
+        with override_settings(
+            MISTRAL_SERVER_URL=server.url, MISTRAL_MAX_CONCURRENCY=3, SLOW_REQUEST_MS=10_000
+        ):
+            response = await AsyncClient().get(f"/api/v1/movies/{self.movie.id}/mistral")
+        self.assertEqual(response.json(), {"message": "Fake summary"})
+        self.assertGreater(server.calls, 8)
+        self.assertEqual(server.peak, 3)
+        # Tokens of JSON escaped text, plus the request's own fields
+        self.assertLess(server.largest, 2000 * summaries.CHARS_PER_TOKEN + 1000)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = [make_movie(f"Listed {i}") for i in range(3)]
+        cls.user, cls.token = make_user("cached")
+
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+
+    def add_favorite(self, movie, token=None, user=None):
+        return self.client.post(
+            f"/api/v1/users/{(user or self.user).id}/favorites",
+            {"movie_id": str(movie.id)},
+            HTTP_AUTHORIZATION=f"Token {(token or self.token).key}",
+        )
+
+    def count_write_queries(self, movie):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.add_favorite(movie)
+        self.assertEqual(response.status_code, 201)
+        return len(ctx.captured_queries)
+
+    def test_cached_token_skips_auth_queries(self):
+        cold = self.count_write_queries(self.movies[0])
+        warm = self.count_write_queries(self.movies[1])
+        # The token + user lookup is gone once the token is cached
+        self.assertEqual(cold - warm, 1)
+
+        with mock.patch.object(
+            UserFavoriteList, "authentication_classes", [TokenAuthentication]
+        ):
+            uncached = self.count_write_queries(self.movies[2])
+        self.assertEqual(uncached, cold)
+
+    def test_logout_forgets_token(self):
+        self.add_favorite(self.movies[0])
+        response = self.client.post(
+            "/api/v1/auth/token/logout",
+            HTTP_AUTHORIZATION=f"Token {self.token.key}",
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.add_favorite(self.movies[1]).status_code, 401)
+
+    def test_revocations_in_other_workers_apply_within_seconds(self):
+        self.add_favorite(self.movies[0])
+        # Logged out through another worker process, whose cache this isn't
+        with mock.patch.object(token_cache, "delete"):
+            Token.objects.filter(key=self.token.key).delete()
+        self.assertEqual(self.add_favorite(self.movies[1]).status_code, 201)
+
+        self.assertLessEqual(token_cache.ttl, 5)
+        later = time.monotonic() + token_cache.ttl + 1
+        with mock.patch("api.authentication.time.monotonic", return_value=later):
+            self.assertEqual(self.add_favorite(self.movies[2]).status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.add_favorite(self.movies[0])
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.add_favorite(self.movies[1]).status_code, 401)
+
+    def test_other_users_list_is_rejected(self):
+        other, _ = make_user("other")
+        self.assertEqual(self.add_favorite(self.movies[0], user=other).status_code, 401)
+        self.assertEqual(other.favorites.count(), 0)
+
+
+class UserListBulkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = [make_movie(f"Imported {i}") for i in range(30)]
+        cls.user, cls.token = make_user("importer")
+
+    def bulk(self, method, list_name, movie_ids):
+        response = getattr(self.client, method)(
+            f"/api/v1/users/{self.user.id}/{list_name}/bulk",
+            {"movie_ids": [str(movie_id) for movie_id in movie_ids]},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {self.token.key}",
+        )
+        return response
+
+    def test_add_reports_each_id(self):
+        self.user.watchlist.add(self.movies[0])
+        missing = uuid.uuid4()
+        response = self.bulk("post", "watchlist", [self.movies[0].id, self.movies[1].id, missing])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["results"],
+            {
+                str(self.movies[0].id): "already_present",
+                str(self.movies[1].id): "added",
+                str(missing): "not_found",
+            },
+        )
+        self.assertEqual(self.user.watchlist.count(), 2)
+
+    def test_remove_reports_each_id(self):
+        self.user.favorites.add(self.movies[0])
+        response = self.bulk("delete", "favorites", [self.movies[0].id, self.movies[1].id])
+
+        self.assertEqual(
+            response.json()["results"],
+            {str(self.movies[0].id): "removed", str(self.movies[1].id): "not_present"},
+        )
+        self.assertEqual(self.user.favorites.count(), 0)
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        self.bulk("post", "favorites", [self.movies[0].id])
+        with CaptureQueriesContext(connection) as small:
+            self.bulk("post", "favorites", [m.id for m in self.movies[1:3]])
+        with CaptureQueriesContext(connection) as large:
+            self.bulk("post", "favorites", [m.id for m in self.movies[3:]])
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+        with CaptureQueriesContext(connection) as removal:
+            self.bulk("delete", "favorites", [m.id for m in self.movies])
+        self.assertEqual(len(removal.captured_queries), len(large.captured_queries))
+        self.assertEqual(self.user.favorites.count(), 0)
+
+    def test_rejects_bad_input(self):
+        self.assertEqual(self.bulk("post", "favorites", []).status_code, 400)
+        self.assertEqual(self.bulk("post", "favorites", ["not-a-uuid"]).status_code, 400)
+
+
+class RatingStatisticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = [make_movie(f"Rated {i}") for i in range(3)]
+        cls.users = [make_user(f"rater{i}")[0] for i in range(3)]
+
+    def rate(self, user, movie, value):
+        rating = Rating.objects.create(user=user, rating=value)
+        rating.movie.add(movie)
+        return rating
+
+    def statistics(self, movie):
+        response = self.client.get(f"/api/v1/movies/{movie.id}/statistics")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_statistics_follow_rating_writes(self):
+        movie = self.movies[0]
+        first = self.rate(self.users[0], movie, 8)
+        second = self.rate(self.users[1], movie, 4)
+
+        stats = self.statistics(movie)
+        self.assertEqual((stats["count"], stats["sum"], stats["average"]), (2, 12, 6.0))
+        self.assertEqual(stats["histogram"]["8"], 1)
+        self.assertEqual(stats["histogram"]["4"], 1)
+
+        second.rating = 10
+        second.save()
+        stats = self.statistics(movie)
+        self.assertEqual((stats["sum"], stats["average"]), (18, 9.0))
+        self.assertEqual(stats["histogram"]["4"], 0)
+
+        first.delete()
+        second.movie.remove(movie)
+        stats = self.statistics(movie)
+        self.assertEqual((stats["count"], stats["sum"], stats["average"]), (0, 0, 0.0))
+
+    def test_rating_writes_bump_only_the_movie(self):
+        movie = self.movies[1]
+        etag = self.client.get("/api/v1/movies")["ETag"]
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.rate(self.users[0], movie, 6)
+        self.assertEqual(callbacks, [])
+        self.assertEqual(
+            ContentVersion.objects.get(key=versions.movie_key(movie.id)).version, 2
+        )
+        # Still the newest movie bump, so listings see the new average
+        self.assertNotEqual(self.client.get("/api/v1/movies")["ETag"], etag)
+
+    def test_recompute_fixes_drift(self):
+        self.rate(self.users[0], self.movies[0], 7)
+        self.assertEqual(ratings.recompute(dry_run=True), [])
+
+        MovieRatingStats.objects.filter(movie=self.movies[0]).update(count=5, votes_7=0)
+        with self.assertRaises(CommandError):
+            call_command("recompute_rating_stats", "--check", stdout=io.StringIO())
+
+        call_command("recompute_rating_stats", stdout=io.StringIO())
+        stats = self.statistics(self.movies[0])
+        self.assertEqual((stats["count"], stats["histogram"]["7"]), (1, 1))
+        self.assertEqual(ratings.recompute(dry_run=True), [])
+
+    def test_list_includes_and_sorts_by_average(self):
+        for user, value in zip(self.users, (9, 7, 8)):
+            self.rate(user, self.movies[1], value)
+        self.rate(self.users[0], self.movies[2], 5)
+
+        movies = self.client.get("/api/v1/movies?ordering=-average_rating").json()
+        self.assertEqual(
+            [(movie["media_title"], movie["average_rating"]) for movie in movies],
+            [("Rated 1", 8.0), ("Rated 2", 5.0), ("Rated 0", 0.0)],
+        )
+
+        page = self.client.get("/api/v1/movies?ordering=-average_rating&page_size=2").json()
+        rest = self.client.get(page["next"]).json()
+        self.assertEqual(
+            [movie["media_title"] for movie in page["results"] + rest["results"]],
+            ["Rated 1", "Rated 2", "Rated 0"],
+        )
+
+
+class ImportCatalogTests(TestCase):
+    TITLES = (
+        "tconst\ttitleType\tprimaryTitle\tstartYear\truntimeMinutes\tgenres\n"
+        "tt1\tmovie\tThe \"Quoted\" One\t1999\t136\tAction,Sci-Fi\n"
+        "tt2\tmovie\tSecond\t\\N\t\\N\tDrama\n"
+        "tt3\ttvEpisode\tSkipped\t2001\t22\tDrama\n"
+    )
+    PRINCIPALS = (
+        "tconst\tordering\tnconst\tcategory\n"
+        "tt1\t1\tnm1\tactor\n"
+        "tt1\t2\tnm2\tactress\n"
+        "tt1\t3\tnm3\tdirector\n"
+        "tt2\t1\tnm1\tactor\n"
+        "tt2\t2\tnm3\twriter\n"
+        "tt3\t1\tnm1\tactor\n"
+        "tt1\t4\tnm9\tactor\n"
+    )
+    PEOPLE = [
+        {"nconst": "nm1", "primaryName": "Keanu Reeves", "birthYear": "1964"},
+        {"nconst": "nm2", "primaryName": "Carrie-Anne Moss", "birthYear": "1967"},
+        {"nconst": "nm3", "primaryName": "Lana Wachowski", "birthYear": "\\N"},
+    ]
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.titles = self.write("title.basics.tsv.gz", self.TITLES)
+        self.people = self.write(
+            "name.basics.jsonl", "".join(json.dumps(row) + "\n" for row in self.PEOPLE)
+        )
+        self.principals = self.write("title.principals.tsv", self.PRINCIPALS)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "wt", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def run_import(self, *args):
+        call_command(
+            "import_catalog",
+            "--titles", self.titles,
+            "--people", self.people,
+            "--principals", self.principals,
+            "--chunk-size", "2",
+            *args,
+            stdout=io.StringIO(),
+        )
+
+    def test_imports_movies_people_and_credits(self):
+        self.run_import()
+
+        first = MovieInfo.objects.get(media_title='The "Quoted" One')
+        self.assertEqual(first.media_release_date, datetime.date(1999, 1, 1))
+        self.assertCountEqual(
+            first.genres.values_list("name", flat=True), ["Action", "Sci-Fi"]
+        )
+        self.assertEqual(
+            [actor.person.name for actor in first.cast],
+            ["Keanu Reeves", "Carrie-Anne Moss"],
+        )
+        self.assertEqual(
+            list(
+                first.credits.filter(role=Credit.DIRECTOR).values_list("person__name", flat=True)
+            ),
+            ["Lana Wachowski"],
+        )
+
+        second = MovieInfo.objects.get(media_title="Second")
+        self.assertEqual(second.media_release_date, datetime.date(1900, 1, 1))
+        self.assertEqual(second.credits.filter(role=Credit.WRITER).count(), 1)
+        self.assertFalse(MovieInfo.objects.filter(media_title="Skipped").exists())
+        self.assertEqual(
+            Credit.objects.filter(role=Credit.ACTOR).values("person").distinct().count(), 2
+        )
+
+        # The search index is rebuilt afterwards
+        self.assertCountEqual(
+            [movie_id for movie_id, _ in search.search_movies("keanu")],
+            [first.pk, second.pk],
+        )
+
+    def test_rerun_does_not_duplicate(self):
+        self.run_import("--no-reindex")
+        self.run_import("--no-reindex")
+        self.assertEqual(MovieInfo.objects.count(), 2)
+        self.assertEqual(Person.objects.count(), 3)
+        self.assertEqual(Credit.objects.filter(role=Credit.ACTOR).count(), 3)
+
+    def test_resumes_from_checkpoint(self):
+        checkpoint = os.path.join(self.tmp.name, "checkpoint.json")
+        with open(checkpoint, "w") as f:
+            json.dump({"titles": 2}, f)
+
+        self.run_import("--no-reindex", "--checkpoint", checkpoint)
+        self.assertEqual(list(MovieInfo.objects.values_list("media_title", flat=True)), [])
+
+        with open(checkpoint) as f:
+            self.assertEqual(json.load(f), {"titles": 3, "people": 3, "principals": 7})
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.genre = Genre.objects.create(name="Drama")
+        cls.actor = make_person("Repeat Actor")
+        cls.movie = make_movie("Polled", genres=[cls.genre], actors=[cls.actor])
+        cls.other = make_movie("Untouched")
+        cls.user, cls.token = make_user("poller")
+        cls.user.favorites.add(cls.movie)
+
+    def assertRevalidates(self, url, changed):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        etag = first["ETag"]
+
+        # Answered from the version table alone, before any serializer
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        changed()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_movie_detail(self):
+        url = f"/api/v1/movies/{self.movie.id}"
+        self.assertRevalidates(url, lambda: self.rename_genre("Melodrama"))
+        self.assertRevalidates(url, lambda: self.movie.genres.clear())
+        self.assertRevalidates(url, lambda: self.rename_actor("Renamed Actor"))
+        self.assertRevalidates(
+            url, lambda: Review.objects.create(user=self.user, movie=self.movie, content="ok")
+        )
+
+    def test_movie_list(self):
+        self.assertRevalidates("/api/v1/movies", lambda: make_movie("New"))
+        self.assertRevalidates("/api/v1/movies?page_size=1", lambda: self.rate(self.other, 7))
+
+    def test_review_list(self):
+        url = f"/api/v1/movies/{self.movie.id}/reviews"
+        self.assertRevalidates(
+            url, lambda: Review.objects.create(user=self.user, movie=self.movie, content="ok")
+        )
+
+        review = Review.objects.get(movie=self.movie)
+        self.assertRevalidates(
+            url,
+            lambda: self.client.patch(
+                f"/api/v1/movies/{self.movie.id}/reviews/{review.id}",
+                {"content": "edited"},
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Token {self.token.key}",
+            ),
+        )
+
+    def test_user_lists(self):
+        url = f"/api/v1/users/{self.user.id}/favorites"
+        self.assertRevalidates(url, lambda: self.user.favorites.add(self.other))
+        self.assertRevalidates(url, lambda: self.other.favorites.remove(self.user))
+        self.assertRevalidates(
+            url,
+            lambda: self.client.post(
+                f"{url}/bulk",
+                {"movie_ids": [str(self.other.id)]},
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Token {self.token.key}",
+            ),
+        )
+        # Movie changes show up in the list payload too
+        self.assertRevalidates(url, lambda: self.rate(self.movie, 3))
+
+    def test_unrelated_changes_keep_etag(self):
+        url = f"/api/v1/movies/{self.movie.id}"
+        etag = self.client.get(url)["ETag"]
+        self.other.genres.add(self.genre)
+        self.user.watchlist.add(self.other)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_catalog_is_the_newest_movie(self):
+        url = "/api/v1/movies"
+        etag = self.client.get(url)["ETag"]
+
+        # Stamped again on commit, after every bump made before it
+        key = versions.movie_key(self.other.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            versions.bump_movies([self.other.id])
+            stamped = ContentVersion.objects.get(key=key).updated_at
+        self.assertGreater(ContentVersion.objects.get(key=key).updated_at, stamped)
+        self.assertNotEqual(self.client.get(url)["ETag"], etag)
+
+        # No catalog-wide row for concurrent writers to queue on
+        self.assertFalse(ContentVersion.objects.filter(key=versions.CATALOG).exists())
+
+    def test_if_modified_since(self):
+        url = f"/api/v1/movies/{self.movie.id}"
+        last_modified = self.client.get(url)["Last-Modified"]
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def rename_genre(self, name):
+        self.genre.name = name
+        self.genre.save()
+
+    def rename_actor(self, name):
+        self.actor.name = name
+        self.actor.save()
+
+    def rate(self, movie, value):
+        rating = Rating.objects.create(user=self.user, rating=value)
+        rating.movie.add(movie)
+
+
+def insert_movies(count, genres, actors, user):
+    # Raw inserts, the signal receivers would dominate the test's runtime
+    movies = [
+        (
+            uuid.uuid4(),
+            f"Bulk {i}",
+            datetime.date(2000, 1, 1),
+            90,
+            "A long description. " * 20,
+        )
+        for i in range(count)
+    ]
+    insert_rows(
+        MovieInfo,
+        ["id", "media_title", "media_release_date", "media_length", "media_description", "image_url"],
+        [(*movie, "") for movie in movies],
+    )
+    insert_rows(
+        MovieInfo.genres.through,
+        ["movieinfo", "genre"],
+        [(movie[0], genre.pk) for movie in movies for genre in genres],
+    )
+    insert_rows(
+        Credit,
+        ["movie", "person", "role", "order", "character"],
+        [
+            (movie[0], actor.pk, Credit.ACTOR, order, "")
+            for movie in movies
+            for order, actor in enumerate(actors)
+        ],
+    )
+    user.favorites.add(*[movie[0] for movie in movies])
+
+
+class StreamingResponseTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.genres = [Genre.objects.create(name=f"Stream {i}") for i in range(3)]
+        cls.actors = [make_person(f"Streamer {i}") for i in range(3)]
+        cls.user, _ = make_user("streamer")
+        cls.movie = make_movie("Reviewed", genres=cls.genres, actors=cls.actors)
+        for i in range(5):
+            reviewer, _ = make_user(f"reviewer{i}")
+            Review.objects.create(user=reviewer, movie=cls.movie, content=f"Review {i}")
+
+    @classmethod
+    def add_movies(cls, count):
+        insert_movies(count, cls.genres, cls.actors, cls.user)
+
+    def read(self, url, **extra):
+        response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        if response.streaming:
+            return b"".join(response.streaming_content)
+        return response.content
+
+    def peak_memory(self, url, **extra):
+        tracemalloc.start()
+        try:
+            response = self.client.get(url, **extra)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return peak
+
+    def test_stream_matches_plain_response(self):
+        self.add_movies(30)
+        for url in (
+            "/api/v1/movies",
+            "/api/v1/movies?ordering=-media_title",
+            f"/api/v1/users/{self.user.id}/favorites",
+            f"/api/v1/movies/{self.movie.id}/reviews",
+        ):
+            joiner = "&" if "?" in url else "?"
+            self.assertEqual(self.read(f"{url}{joiner}stream=1"), self.read(url))
+
+    def test_ndjson(self):
+        self.add_movies(5)
+        body = self.read("/api/v1/movies", HTTP_ACCEPT="application/x-ndjson")
+        lines = body.decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], json.loads(self.read("/api/v1/movies")))
+
+    def test_peak_memory_is_flat(self):
+        self.add_movies(200)
+        small = self.peak_memory("/api/v1/movies?stream=1")
+        small_plain = self.peak_memory("/api/v1/movies")
+
+        self.add_movies(1000)
+        large = self.peak_memory("/api/v1/movies?stream=1")
+        large_plain = self.peak_memory("/api/v1/movies")
+
+        # Six times the rows, about the same peak
+        self.assertLess(large, small * 1.5)
+        self.assertGreater(large_plain, small_plain * 3)
+        self.assertLess(large * 3, large_plain)
+
+
+class ASGIStreamingTests(TransactionTestCase):
+    # Committed rows: ASGIHandler runs sync views in a thread of their own,
+    # on connections of their own, reads through the replica aliases
+    databases = {"default", "replica_1", "replica_2"}
+
+    def setUp(self):
+        self.genres = [Genre.objects.create(name=f"Stream {i}") for i in range(3)]
+        self.actors = [make_person(f"Streamer {i}") for i in range(3)]
+        self.user, _ = make_user("streamer")
+
+    async def get(self, path, query):
+        """
+        GET through ASGIHandler, the way uvicorn serves movie/asgi.py,
+        dropping the body as it is sent. Returns the status and body size.
+        """
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [(b"host", b"testserver")],
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+        }
+        received = False
+        sent = {"status": None, "size": 0}
+
+        async def receive():
+            nonlocal received
+            if received:
+                # The client stays connected until the response is done
+                await asyncio.Event().wait()
+            received = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                sent["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                sent["size"] += len(message.get("body", b""))
+
+        await ASGIHandler()(scope, receive, send)
+        return sent["status"], sent["size"]
+
+    def peak_memory(self, query):
+        tracemalloc.start()
+        try:
+            status, size = asyncio.run(self.get("/api/v1/movies", query))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(status, 200)
+        return peak, size
+
+    def test_peak_memory_is_flat(self):
+        # The first request loads the URLconf, views and serializers
+        asyncio.run(self.get("/api/v1/movies", "stream=1"))
+
+        insert_movies(200, self.genres, self.actors, self.user)
+        small, small_size = self.peak_memory("stream=1")
+
+        insert_movies(1000, self.genres, self.actors, self.user)
+        large, large_size = self.peak_memory("stream=1")
+
+        # Six times the bytes sent, about the same peak
+        self.assertGreater(large_size, small_size * 5)
+        self.assertLess(large, small * 1.5)
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    # The replica aliases mirror the test database, so committed rows are
+    # visible through them
+    databases = {"default", "replica_1", "replica_2"}
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.movies = [make_movie(f"Replicated {i}") for i in range(3)]
+        self.user, self.token = make_user("replicated")
+
+    def tearDown(self):
+        cache.clear()
+        token_cache.clear()
+
+    def queries_by_alias(self, request):
+        contexts = {alias: CaptureQueriesContext(connections[alias]) for alias in self.databases}
+        for context in contexts.values():
+            context.__enter__()
+        try:
+            response = request()
+        finally:
+            for context in contexts.values():
+                context.__exit__(None, None, None)
+        return response, {alias: len(context) for alias, context in contexts.items()}
+
+    def read(self, **extra):
+        return self.queries_by_alias(lambda: self.client.get("/api/v1/movies", **extra))
+
+    def test_safe_reads_use_one_replica(self):
+        response, queries = self.read()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+        self.assertEqual(queries["default"], 0)
+        # Picked once per request, not per query
+        self.assertEqual(sorted(queries.values())[1], 0)
+
+    def test_writer_is_pinned_to_primary(self):
+        response, queries = self.queries_by_alias(
+            lambda: self.client.post(
+                f"/api/v1/users/{self.user.id}/favorites",
+                {"movie_id": str(self.movies[0].id)},
+                HTTP_AUTHORIZATION=f"Token {self.token.key}",
+            )
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(queries["replica_1"] + queries["replica_2"], 0)
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        # Pinned by cookie, and by token for clients that drop cookies
+        _, queries = self.read()
+        self.assertEqual(queries["replica_1"] + queries["replica_2"], 0)
+        self.client.cookies.clear()
+        _, queries = self.read(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertEqual(queries["replica_1"] + queries["replica_2"], 0)
+
+        # Until the pin expires
+        cache.clear()
+        _, queries = self.read(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertEqual(queries["default"], 0)
+
+    def test_reads_inside_transactions_use_primary(self):
+        router = ReplicaRouter()
+        with override_settings(DATABASE_REPLICAS=["replica_1"]):
+            self.assertEqual(router.allow_migrate("replica_1", "api"), False)
+            self.assertTrue(router.allow_relation(self.movies[0], self.movies[1]))
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(MovieInfo), "default")
+
+
+class SyntheticDataTests(TestCase):
+    def snapshot(self):
+        favorites = CustomUser.favorites.through.objects.order_by("customuser_id", "movieinfo_id")
+        return {
+            "movies": list(MovieInfo.objects.order_by("id").values_list("id", "media_title")),
+            "reviews": list(Review.objects.order_by("id").values_list("id", "user_id", "movie_id")),
+            "ratings": list(
+                MovieRatingStats.objects.order_by("movie_id").values_list("movie_id", "count", "total")
+            ),
+            "favorites": list(favorites.values_list("customuser_id", "movieinfo_id")),
+        }
+
+    def generate(self, seed):
+        with transaction.atomic():
+            synthetic.generate(60, seed=seed)
+            snapshot = self.snapshot()
+            transaction.set_rollback(True)
+        return snapshot
+
+    def test_same_seed_same_rows(self):
+        first = self.generate(1)
+        self.assertEqual(len(first["movies"]), 60)
+        self.assertEqual(len(first["ratings"]), 60)
+        self.assertTrue(first["reviews"])
+        self.assertTrue(first["favorites"])
+        self.assertEqual(self.generate(1), first)
+        self.assertNotEqual(self.generate(2)["movies"], first["movies"])
+
+    def test_fan_out(self):
+        catalog = synthetic.generate(60, seed=3)
+        movie = MovieInfo.objects.get(pk=catalog.movie_id(0))
+        self.assertTrue(1 <= movie.genres.count() <= 3)
+        self.assertTrue(4 <= len(movie.cast) <= 12)
+        self.assertEqual(movie.credits.filter(role=Credit.DIRECTOR).count(), 1)
+        # The index is built, so generated titles can be searched
+        self.assertIn(movie.pk, [hit for hit, _ in search.search_movies(movie.media_title)])
+        self.assertEqual(CustomUser.objects.count(), catalog.users)
+
+
+class BenchmarkBaselineTests(TestCase):
+    baseline = {
+        "endpoints": {
+            "GET movies": {"p95_ms": 10.0, "queries": 4, "peak_kb": 100.0},
+        },
+        "concurrent": {"workers": 4, "requests_per_s": 100.0},
+    }
+
+    def results(self, **changes):
+        entry = {"p95_ms": 12.0, "queries": 4, "peak_kb": 110.0, **changes}
+        return {"endpoints": {"GET movies": entry}}
+
+    def test_within_thresholds(self):
+        self.assertEqual(compare(self.results(), self.baseline), [])
+
+    def test_regressions(self):
+        self.assertEqual(len(compare(self.results(queries=5), self.baseline)), 1)
+        self.assertEqual(len(compare(self.results(p95_ms=25.0), self.baseline)), 1)
+        self.assertEqual(len(compare(self.results(peak_kb=200.0), self.baseline)), 1)
+
+        slow = {**self.results(), "concurrent": {"workers": 4, "requests_per_s": 40.0}}
+        self.assertEqual(len(compare(slow, self.baseline)), 1)
+
+    def test_new_endpoints_need_a_baseline(self):
+        results = self.results()
+        results["endpoints"]["GET movies/new"] = results["endpoints"]["GET movies"]
+        [failure] = compare(results, self.baseline)
+        self.assertIn("GET movies/new", failure)
+
+    def test_percentiles_of_one_timing(self):
+        self.assertEqual(percentiles([4.0]), {"p50_ms": 4.0, "p95_ms": 4.0, "p99_ms": 4.0})
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.movie = make_movie("Heat", genres=[Genre.objects.create(name="Crime")])
+
+    def setUp(self):
+        metrics.registry.clear()
+        cache.clear()
+
+    def timings(self, response):
+        return {
+            part.split(";")[0]: part
+            for part in response.headers["Server-Timing"].split(", ")
+        }
+
+    def test_server_timing_counts_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/v1/movies")
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {"db", "serialize", "external", "total"})
+        self.assertIn(f'desc="{len(ctx.captured_queries)} queries"', timings["db"])
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_can_be_turned_off(self):
+        self.assertNotIn("Server-Timing", self.client.get("/api/v1/movies").headers)
+
+    def test_metrics_endpoint(self):
+        self.client.get("/api/v1/movies")
+        self.client.get(f"/api/v1/movies/{self.movie.id}")
+
+        body = self.client.get("/internal/metrics").content.decode()
+        self.assertIn(
+            'http_requests_total{route="api/v1/movies",method="GET",status="200"} 1', body
+        )
+        self.assertIn(
+            'http_request_db_queries_count{route="api/v1/movies/<uuid:pk>",method="GET"} 1',
+            body,
+        )
+        self.assertIn(
+            'http_request_duration_seconds_bucket{route="api/v1/movies",method="GET",le="+Inf"} 1',
+            body,
+        )
+
+        response = self.client.get("/internal/metrics", REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_queries(self):
+        with self.assertLogs("api.metrics", "WARNING") as logs:
+            self.client.get("/api/v1/movies")
+        self.assertIn("Slow request GET /api/v1/movies", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+
+    def test_external_calls_are_timed(self):
+        class Chat:
+            async def complete_async(self, model, messages):
+                await asyncio.sleep(0.05)
+                return None
+
+        state = mock.Mock(semaphore=asyncio.Semaphore(1), in_flight={})
+        state.client.chat = Chat()
+        with mock.patch.object(mistral, "_loop_state", lambda: state):
+            response = self.client.get(f"/api/v1/movies/{self.movie.id}/mistral")
+
+        external = self.timings(response)["external"]
+        self.assertGreaterEqual(float(external.split("dur=")[1]), 50)
+
+
+class FastSerializationContractTests(TestCase):
+    """
+    The fast read path has to write exactly the bytes DRF's serializers and
+    JSONRenderer would.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        genres = [Genre.objects.create(name=name) for name in ("Drama", "Ñoño\u2029")]
+        cls.actors = [make_person("Zoë 🎬"), make_person("Line\u2028Break")]
+        cls.user, _ = make_user("contract")
+        cls.rated = make_movie("Rated", genres=genres, actors=cls.actors)
+        cls.unrated = make_movie("Unrated \"quoted\"", genres=genres[:1])
+        for value in (7, 8, 8):
+            rating = Rating.objects.create(user=cls.user, rating=value)
+            rating.movie.add(cls.rated)
+        cls.review = Review.objects.create(user=cls.user, movie=cls.rated, content="Ünïcode")
+        cls.user.favorites.set([cls.rated, cls.unrated])
+
+    def drf(self, url):
+        with override_settings(FAST_SERIALIZATION=False), mock.patch(
+            "api.renderers.orjson", None
+        ):
+            return self.client.get(url)
+
+    def test_responses_match_drf(self):
+        movie = self.rated.id
+        for url in (
+            "/api/v1/movies",
+            "/api/v1/movies?page_size=1",
+            "/api/v1/movies?stream=1",
+            f"/api/v1/movies/{movie}",
+            f"/api/v1/movies/{movie}/reviews",
+            f"/api/v1/movies/{movie}/reviews/{self.review.id}",
+            f"/api/v1/movies/{movie}/statistics",
+            f"/api/v1/movies/{movie}/credits",
+            f"/api/v1/people/{self.actors[0].id}/credits",
+            f"/api/v1/users/{self.user.id}/favorites",
+            "/api/v1/movies/search?q=rated",
+        ):
+            expected = self.drf(url)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(b"".join(response), b"".join(expected), url)
+
+    def test_ndjson_matches_drf(self):
+        url = "/api/v1/movies"
+        with override_settings(FAST_SERIALIZATION=False), mock.patch(
+            "api.renderers.orjson", None
+        ):
+            expected = b"".join(self.client.get(url, HTTP_ACCEPT="application/x-ndjson"))
+        response = self.client.get(url, HTTP_ACCEPT="application/x-ndjson")
+        self.assertEqual(b"".join(response), expected)
+
+    def test_fields_left_to_drf(self):
+        class LooseSerializer(FastReadMixin, serializers.ModelSerializer):
+            shout = serializers.SerializerMethodField()
+            average_rating = serializers.FloatField(read_only=True)
+            favorited_by = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+
+            class Meta:
+                model = MovieInfo
+                fields = ["id", "shout", "average_rating", "favorited_by", "media_release_date"]
+
+            def get_shout(self, movie):
+                return movie.media_title.upper()
+
+        # Without the annotation average_rating is skipped, as DRF does
+        for queryset in (MovieInfo.objects.all(), MovieInfo.objects.with_average_rating()):
+            movies = list(queryset.order_by("media_title"))
+            with override_settings(FAST_SERIALIZATION=False):
+                expected = LooseSerializer(movies, many=True).data
+            self.assertEqual(
+                JSONRenderer().render(LooseSerializer(movies, many=True).data),
+                JSONRenderer().render(expected),
+            )
+
+    def test_builders_are_compiled_once(self):
+        # Serializers are created per request; their builders share code
+        first, second = (
+            builder(MovieInfoSerializer(self.rated, fields={"id", "media_title"}))
+            for _ in range(2)
+        )
+        self.assertIsNot(first, second)
+        self.assertIs(first.__code__, second.__code__)
+
+    def test_renderer_matches_drf(self):
+        data = {
+            "when": datetime.datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc),
+            "day": datetime.date(2024, 1, 2),
+            "id": uuid.UUID(int=1),
+            "price": decimal.Decimal("1.50"),
+            "text": "a\u2028b\u2029c é",
+            "counts": {1: 2},
+            "nested": [None, True, 1.25, "x"],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            ORJSONRenderer().render(data, "application/json; indent=2"),
+            JSONRenderer().render(data, "application/json; indent=2"),
+        )
+
+
+class SparseFieldsetTests(TestCase):
+    grid = "fields=id,media_title,image_url,media_release_date"
+
+    @classmethod
+    def setUpTestData(cls):
+        genres = [Genre.objects.create(name=f"Sparse {i}") for i in range(2)]
+        actors = [make_person(f"Sparse Actor {i}") for i in range(5)]
+        cls.movies = [
+            make_movie(f"Sparse {i}", genres=genres, actors=actors) for i in range(4)
+        ]
+        cls.user, _ = make_user("sparse")
+        cls.user.favorites.set(cls.movies)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return response, ctx.captured_queries
+
+    def test_grid_view_skips_relations_and_description(self):
+        full, full_queries = self.get("/api/v1/movies")
+        grid, grid_queries = self.get(f"/api/v1/movies?{self.grid}")
+
+        self.assertEqual(
+            [set(movie) for movie in grid.json()],
+            [{"id", "media_title", "image_url", "media_release_date"}] * 4,
+        )
+        self.assertEqual(len(grid_queries), len(full_queries) - 2)
+        self.assertNotIn("media_description", grid_queries[-1]["sql"])
+        self.assertLess(len(grid.content) * 4, len(full.content))
+
+    def test_expand_includes_only_named_relations(self):
+        response, queries = self.get("/api/v1/movies?fields=id&expand=genres")
+        self.assertEqual(set(response.json()[0]), {"id", "genres"})
+        self.assertEqual(len(response.json()[0]["genres"]), 2)
+        self.assertFalse(any("api_actor" in query["sql"] for query in queries))
+
+        response, _ = self.get("/api/v1/movies?expand=actors_list")
+        movie = response.json()[0]
+        self.assertIn("media_description", movie)
+        self.assertIn("actors_list", movie)
+        self.assertNotIn("genres", movie)
+
+    def test_every_movie_endpoint_takes_fieldsets(self):
+        movie = self.movies[0]
+        for url in (
+            f"/api/v1/movies/{movie.id}?{self.grid}",
+            f"/api/v1/movies?{self.grid}&page_size=2",
+            f"/api/v1/movies?{self.grid}&stream=1",
+            f"/api/v1/movies/search?q=sparse&{self.grid}",
+            f"/api/v1/users/{self.user.id}/favorites?{self.grid}",
+            f"/api/v1/users/{self.user.id}/favorites?{self.grid}&page_size=2",
+        ):
+            body = json.loads(b"".join(self.get(url)[0]))
+            rows = body.get("results", [body]) if isinstance(body, dict) else body
+            for row in rows:
+                self.assertEqual(
+                    set(row), {"id", "media_title", "image_url", "media_release_date"}, url
+                )
+
+    def test_unknown_names_are_rejected(self):
+        response = self.client.get("/api/v1/movies?fields=id,budget")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"fields": ["Unknown field: budget"]})
+
+        response = self.client.get(f"/api/v1/users/{self.user.id}/favorites?expand=media_title")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("expand", response.json())
+
+
+class ScalableReviewTests(TestCase):
+    REVIEWS = 100_000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.movie = make_movie("Crowded")
+        cls.user, cls.token = make_user("latecomer")
+
+        # Raw inserts, one reviewer per review
+        users = range(1000, 1000 + cls.REVIEWS)
+        insert_rows(
+            CustomUser,
+            ["id", "password", "email", "username", "is_active", "is_staff", "is_admin", "is_superuser"],
+            [(i, "", f"r{i}@example.com", f"r{i}", True, False, False, False) for i in users],
+        )
+        cls.start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        insert_rows(
+            Review,
+            ["id", "user", "movie", "content", "created"],
+            [
+                (
+                    uuid.UUID(int=n + 1),
+                    user,
+                    cls.movie.pk,
+                    f"Review {n}",
+                    cls.start + datetime.timedelta(minutes=n),
+                )
+                for n, user in enumerate(users)
+            ],
+        )
+
+    def auth(self):
+        return {"HTTP_AUTHORIZATION": f"Token {self.token.key}"}
+
+    def page(self, url):
+        # The content version, then the page with its users joined in
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def created(self, body):
+        return [datetime.datetime.fromisoformat(review["created"]) for review in body["results"]]
+
+    def test_newest_first_pages_follow_each_other(self):
+        url = f"/api/v1/movies/{self.movie.id}/reviews?page_size=50"
+        first = self.page(url)
+        second = self.page(first["next"])
+
+        created = self.created(first) + self.created(second)
+        newest = self.start + datetime.timedelta(minutes=self.REVIEWS - 1)
+        self.assertEqual(created[0], newest)
+        self.assertEqual(created, sorted(created, reverse=True))
+        self.assertEqual(len(set(created)), 100)
+        self.assertEqual(first["results"][0]["user"]["username"], f"r{1000 + self.REVIEWS - 1}")
+
+    def test_plain_list_is_capped(self):
+        for prefix in ("/api/v1/", "/api/v1/async/"):
+            response = self.client.get(f"{prefix}movies/{self.movie.id}/reviews")
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertEqual(len(body), 100)
+            newest = self.start + datetime.timedelta(minutes=self.REVIEWS - 1)
+            self.assertEqual(datetime.datetime.fromisoformat(body[0]["created"]), newest)
+
+    def test_oldest_first(self):
+        body = self.page(f"/api/v1/movies/{self.movie.id}/reviews?page_size=10&ordering=created")
+        self.assertEqual(self.created(body)[0], self.start)
+        self.assertEqual(self.created(body), sorted(self.created(body)))
+
+    def test_pages_use_the_movie_created_index(self):
+        for ordering in ("created", "-created"):
+            plan = (
+                Review.objects.filter(movie=self.movie)
+                .order_by(ordering)[:50]
+                .explain()
+            )
+            self.assertIn("review_movie_created_idx", plan)
+
+    def test_create_is_one_insert(self):
+        url = f"/api/v1/movies/{self.movie.id}/reviews"
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url, {"content": "<b>Late</b> to the party"}, **self.auth())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["content"], "<b>Late</b> to the party")
+        self.assertIn("created", response.json())
+
+        review_queries = [q["sql"] for q in ctx.captured_queries if '"api_review"' in q["sql"]]
+        self.assertEqual(len(review_queries), 1)
+        self.assertTrue(review_queries[0].startswith("INSERT"))
+
+        response = self.client.post(url, {"content": "Again"}, **self.auth())
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Review.objects.filter(movie=self.movie, user=self.user).count(), 1)
+
+    def test_constraint_holds_without_the_view(self):
+        Review.objects.create(movie=self.movie, user=self.user, content="First")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Review.objects.create(movie=self.movie, user=self.user, content="Second")
+
+
+class ReviewCreateUnknownMovieTests(TransactionTestCase):
+    # Foreign keys are only checked when the outermost transaction commits,
+    # which TestCase never does
+
+    def test_unknown_movie_is_404(self):
+        user, token = make_user("lost")
+        response = self.client.post(
+            f"/api/v1/movies/{uuid.uuid4()}/reviews",
+            {"content": "Where am I"},
+            HTTP_AUTHORIZATION=f"Token {token.key}",
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Review.objects.exists())
+
+
+@skipUnless(recommendations.available(), "needs numpy and scipy")
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = [make_movie(f"Picked {i}") for i in range(6)]
+        first, second, third = (make_user(f"picker{i}")[0] for i in range(3))
+        first.favorites.add(cls.movies[0], cls.movies[1])
+        second.favorites.add(cls.movies[0], cls.movies[1], cls.movies[2])
+        third.favorites.add(cls.movies[3])
+        third.watchlist.add(cls.movies[4], cls.movies[3])
+        cls.user, cls.token = make_user("recommended")
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = override_settings(
+            RECOMMENDATIONS_PATH=os.path.join(directory.name, "recommendations.npz")
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def recommended(self, **params):
+        response = self.client.get(f"/api/v1/users/{self.user.id}/recommendations", params)
+        self.assertEqual(response.status_code, 200)
+        return [movie["id"] for movie in response.json()]
+
+    def test_neighbors_of_picks_come_first(self):
+        recommendations.build()
+        self.user.favorites.add(self.movies[0])
+
+        ids = self.recommended()
+        self.assertEqual(ids[:2], [str(self.movies[1].id), str(self.movies[2].id)])
+        self.assertNotIn(str(self.movies[0].id), ids)
+
+    def test_listed_and_rated_movies_are_left_out(self):
+        recommendations.build()
+        self.user.favorites.add(self.movies[0])
+        self.user.watchlist.add(self.movies[1])
+        rating = Rating.objects.create(user=self.user, rating=2)
+        rating.movie.add(self.movies[2])
+
+        ids = self.recommended()
+        for movie in self.movies[:3]:
+            self.assertNotIn(str(movie.id), ids)
+
+    def test_users_without_picks_get_popular_movies(self):
+        recommendations.build()
+        ids = self.recommended(limit=2)
+        self.assertEqual(set(ids), {str(self.movies[0].id), str(self.movies[1].id)})
+
+    def test_limit_is_validated(self):
+        for limit in ("0", "x", str(recommendations.MAX_LIMIT + 1)):
+            response = self.client.get(
+                f"/api/v1/users/{self.user.id}/recommendations", {"limit": limit}
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_unavailable_before_the_first_build(self):
+        response = self.client.get(f"/api/v1/users/{self.user.id}/recommendations")
+        self.assertEqual(response.status_code, 503)
+
+    def test_refresh_only_recomputes_what_changed(self):
+        out = io.StringIO()
+        call_command("refresh_recommendations", stdout=out)
+        self.assertIn("Recomputed 5 of 5 movies", out.getvalue())
+
+        out = io.StringIO()
+        call_command("refresh_recommendations", stdout=out)
+        self.assertIn("Recomputed 0 of 5 movies", out.getvalue())
+
+        # Nobody else picked movie 5, so nothing else can be affected
+        self.user.favorites.add(self.movies[5])
+        out = io.StringIO()
+        call_command("refresh_recommendations", stdout=out)
+        self.assertIn("Recomputed 1 of 6 movies", out.getvalue())
+
+    def test_incremental_refresh_matches_a_full_build(self):
+        np = recommendations.np
+        rng = np.random.default_rng(0)
+        movies = np.array([f"{i:032x}" for i in range(300)], dtype="S32")
+
+        def interactions(count):
+            return (
+                (400 * rng.random(count) ** 2).astype(np.int64),
+                movies[(300 * rng.random(count) ** 2).astype(np.int64)],
+                rng.random(count).astype(np.float32),
+            )
+
+        before = interactions(5000)
+        previous, _ = recommendations.compute(*before, k=10)
+        after = [np.concatenate(pair) for pair in zip(before, interactions(20))]
+
+        incremental, recomputed = recommendations.compute(*after, previous=previous, k=10)
+        full, _ = recommendations.compute(*after, k=10)
+        self.assertLess(recomputed, len(full["movies"]))
+        np.testing.assert_array_equal(incremental["neighbors"], full["neighbors"])
+        np.testing.assert_allclose(incremental["scores"], full["scores"], atol=1e-6)
+
+
+class SimilarMoviesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.noir, cls.crime = Genre.objects.create(name="Noir"), Genre.objects.create(name="Crime")
+        cls.actors = [make_person(f"Character actor {i}") for i in range(6)]
+        cls.falcon = make_movie(
+            "The Maltese Falcon", genres=[cls.noir, cls.crime], actors=cls.actors[:4]
+        )
+        cls.sleep = make_movie(
+            "The Big Sleep", genres=[cls.noir, cls.crime], actors=cls.actors[:3]
+        )
+        cls.musical = make_movie("Singin' in the Rain", actors=cls.actors[4:])
+
+    def similar(self, movie, **params):
+        response = self.client.get(f"/api/v1/movies/{movie.id}/similar", params)
+        self.assertEqual(response.status_code, 200)
+        return [movie["media_title"] for movie in response.json()]
+
+    def test_ranks_by_shared_genres_and_cast(self):
+        self.assertEqual(self.similar(self.falcon), ["The Big Sleep"])
+        self.assertEqual(
+            similarity.similar_movies(self.falcon.id),
+            [(self.sleep.id, 5 / 6)],
+        )
+
+    def test_index_follows_relation_changes(self):
+        self.musical.genres.set([self.noir, self.crime])
+        set_cast(self.musical, self.actors[:4])
+        self.assertEqual(self.similar(self.falcon)[0], "Singin' in the Rain")
+
+        set_cast(self.sleep, [])
+        self.sleep.genres.clear()
+        self.assertNotIn("The Big Sleep", self.similar(self.falcon))
+
+        self.musical.delete()
+        self.assertFalse(SimilarityBucket.objects.filter(movie_id=self.musical.id).exists())
+
+    def test_rebuild_matches_incremental_index(self):
+        incremental = set(SimilarityBucket.objects.values_list("key", "movie_id"))
+        similarity.rebuild_index()
+        rebuilt = set(SimilarityBucket.objects.values_list("key", "movie_id"))
+        self.assertEqual(incremental, rebuilt)
+
+    def test_lsh_agrees_with_exact_jaccard(self):
+        for movie in (self.falcon, self.sleep, self.musical):
+            self.assertEqual(
+                similarity.similar_movies(movie.id), similarity.exact_similar_movies(movie.id)
+            )
+
+    def test_fixed_number_of_queries(self):
+        # The movie, its candidates, their features, then the page
+        with self.assertNumQueries(6):
+            self.similar(self.falcon)
+
+    def test_unknown_movie_and_bad_limit(self):
+        response = self.client.get(f"/api/v1/movies/{uuid.uuid4()}/similar")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f"/api/v1/movies/{self.falcon.id}/similar", {"limit": "0"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ViewCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.movie = make_movie("Vertigo")
+        cls.other = make_movie("Rear Window")
+        cls.page = MoviePage.objects.create(
+            movie_information=cls.movie,
+            wiki_rating=0,
+            box_office_total=0,
+            entry_views=10,
+            release_date=datetime.date(1958, 5, 9),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.counter = viewcounts.ViewCounter()
+        patcher = mock.patch.object(viewcounts, "counter", self.counter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def entry_views(self):
+        self.page.refresh_from_db()
+        return self.page.entry_views
+
+    def test_views_are_buffered_until_flushed(self):
+        for _ in range(3):
+            response = self.client.get(f"/api/v1/movies/{self.movie.id}")
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.counter.pending(), 3)
+        self.assertEqual(self.entry_views(), 10)
+        self.assertEqual(self.counter.flush(), 3)
+        self.assertEqual(self.entry_views(), 13)
+        self.assertEqual(MovieViews.objects.get(movie=self.movie).views, 3)
+        self.assertEqual(self.counter.pending(), 0)
+
+    def test_concurrent_views_flush_in_a_few_queries(self):
+        def view():
+            for _ in range(250):
+                self.counter.record(self.movie.id)
+                self.counter.record(self.other.id)
+
+        threads = [threading.Thread(target=view) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.counter.flush()
+        updates = [q for q in queries if q["sql"].startswith("UPDATE")]
+        # One per hour and count, and one for entry_views
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(self.entry_views(), 10 + 2000)
+        self.assertEqual(
+            dict(MovieViews.objects.values_list("movie_id", "views")),
+            {self.movie.id: 2000, self.other.id: 2000},
+        )
+
+    def test_failed_flush_keeps_the_views(self):
+        self.counter.record(self.movie.id, views=5)
+        with mock.patch.object(viewcounts, "write", side_effect=RuntimeError("down")):
+            with self.assertRaises(RuntimeError):
+                self.counter.flush()
+        self.assertEqual(self.counter.pending(), 5)
+        self.counter.flush()
+        self.assertEqual(self.entry_views(), 15)
+
+    def test_stop_flushes_what_is_left(self):
+        self.counter.interval = 3600
+        self.counter.start()
+        self.counter.record(self.movie.id, views=2)
+        self.counter.stop()
+        self.assertEqual(self.entry_views(), 12)
+
+    def test_trending_decays_older_views(self):
+        now = time.time()
+        # 40 views two days ago weigh 10, less than 15 views now
+        self.counter.record(self.movie.id, views=40, now=now - 48 * 3600)
+        self.counter.record(self.other.id, views=15, now=now)
+        self.counter.flush()
+        self.assertEqual(
+            [movie_id for movie_id, _ in viewcounts.trending(now=now)],
+            [self.other.id, self.movie.id],
+        )
+        scores = dict(viewcounts.trending(now=now))
+        self.assertAlmostEqual(scores[self.movie.id], 10.0)
+
+        # Views from before the window are left out
+        self.assertEqual(viewcounts.trending(now=now + 8 * 24 * 3600), [])
+
+    def test_trending_endpoint(self):
+        self.counter.record(self.movie.id, views=3)
+        self.counter.record(self.other.id, views=1)
+        self.counter.flush()
+
+        response = self.client.get("/api/v1/movies/trending", {"fields": "media_title"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(), [{"media_title": "Vertigo"}, {"media_title": "Rear Window"}]
+        )
+        self.assertEqual(self.client.get("/api/v1/movies/trending?limit=0").status_code, 400)
+
+
+class CreditTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bogart, cls.bacall = make_person("Humphrey Bogart"), make_person("Lauren Bacall")
+        cls.hawks = make_person("Howard Hawks")
+        cls.sleep = make_movie("The Big Sleep", actors=[cls.bogart, cls.bacall])
+        cls.sleep.media_release_date = datetime.date(1946, 8, 23)
+        cls.sleep.save()
+        cls.falcon = make_movie("The Maltese Falcon", actors=[cls.bogart])
+        Credit.objects.create(
+            movie=cls.sleep, person=cls.hawks, role=Credit.DIRECTOR, character=""
+        )
+        Credit.objects.filter(movie=cls.sleep, person=cls.bogart).update(character="Marlowe")
+
+    def test_movie_credits_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/api/v1/movies/{self.sleep.id}/credits")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row["person"]["name"], row["role"], row["order"]) for row in response.json()],
+            [
+                ("Humphrey Bogart", "actor", 0),
+                ("Lauren Bacall", "actor", 1),
+                ("Howard Hawks", "director", 0),
+            ],
+        )
+        self.assertEqual(response.json()[0]["character"], "Marlowe")
+        credit_queries = [q for q in queries if "api_credit" in q["sql"]]
+        self.assertEqual(len(credit_queries), 1)
+
+    def test_filmography_newest_first_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/api/v1/people/{self.bogart.id}/credits")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [row["movie"]["media_title"] for row in response.json()],
+            ["The Maltese Falcon", "The Big Sleep"],
+        )
+        self.assertEqual(len(queries), 1)
+
+    def test_unknown_movie_or_person(self):
+        for url in (f"/api/v1/movies/{uuid.uuid4()}/credits", f"/api/v1/people/{uuid.uuid4()}/credits"):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        uncredited = make_person("Extra")
+        self.assertEqual(self.client.get(f"/api/v1/people/{uncredited.id}/credits").json(), [])
+
+    def test_actors_list_follows_billing_order(self):
+        set_cast(self.sleep, [self.bacall, self.bogart])
+        movie = self.client.get(f"/api/v1/movies/{self.sleep.id}").json()
+        self.assertEqual(
+            [actor["name"] for actor in movie["actors_list"]],
+            ["Lauren Bacall", "Humphrey Bogart"],
+        )
+        self.assertEqual(movie["actors_list"][0]["id"], str(self.bacall.id))
+
+    def test_search_and_similarity_follow_credits(self):
+        self.assertIn(self.sleep.id, [hit for hit, _ in search.search_movies("hawks")])
+        self.assertEqual(similarity.similar_movies(self.falcon.id)[0][0], self.sleep.id)
+
+        Credit.objects.filter(person=self.hawks).delete()
+        self.assertEqual(search.search_movies("hawks"), [])
+
+
+class MigrateCreditsTests(TransactionTestCase):
+    def setUp(self):
+        credits.create_legacy_tables()
+        self.addCleanup(credits.drop_legacy_tables)
+
+    def test_copies_old_tables_in_link_order(self):
+        movie = make_movie("Casablanca")
+        bogart, bergman = make_person("Humphrey Bogart"), make_person("Ingrid Bergman")
+        curtiz = make_person("Michael Curtiz")
+        people = {Credit.ACTOR: [bergman, bogart], Credit.DIRECTOR: [curtiz], Credit.WRITER: []}
+        for role, role_model, person_field, link_model, role_field in credits.LEGACY:
+            for person in people[role]:
+                role_row = role_model.objects.create(
+                    id=uuid.uuid4(), **{f"{person_field}_id": person.id}
+                )
+                link_model.objects.create(movieinfo_id=movie.id, **{role_field: role_row})
+
+        out = io.StringIO()
+        call_command("migrate_credits", "--drop-legacy", stdout=out)
+        self.assertIn("actor: 2 credits", out.getvalue())
+        self.assertEqual(
+            list(
+                movie.credits.order_by("role", "order").values_list("person__name", "role", "order")
+            ),
+            [
+                ("Ingrid Bergman", "actor", 0),
+                ("Humphrey Bogart", "actor", 1),
+                ("Michael Curtiz", "director", 0),
+            ],
+        )
+        self.assertEqual(credits.legacy_tables(), [])
+        self.assertIn(movie.id, [hit for hit, _ in search.search_movies("curtiz")])
+
+        with self.assertRaises(CommandError):
+            call_command("migrate_credits", stdout=io.StringIO())
+
+
+class MigrateReviewsTests(TransactionTestCase):
+    def setUp(self):
+        reviews.create_legacy_table()
+        self.addCleanup(reviews.upgrade_table)
+
+    def test_brings_an_old_table_up_to_date(self):
+        vertigo, psycho = make_movie("Vertigo"), make_movie("Psycho")
+        alice, bob = make_user("alice")[0], make_user("bob")[0]
+        for user, movie in ((alice, vertigo), (alice, vertigo), (bob, vertigo), (alice, psycho)):
+            reviews.LegacyReview.objects.create(
+                id=uuid.uuid4(), user_id=user.id, movie_id=movie.id, content="Review"
+            )
+        self.assertEqual(
+            reviews.missing(), ["created", "review_unique_movie_user", "review_movie_created_idx"]
+        )
+
+        out = io.StringIO()
+        call_command("migrate_reviews", stdout=out)
+        self.assertIn("Deleted 1 duplicate reviews", out.getvalue())
+        self.assertEqual(reviews.missing(), [])
+        self.assertEqual(
+            sorted(Review.objects.values_list("user__username", "movie__media_title")),
+            [("alice", "Psycho"), ("alice", "Vertigo"), ("bob", "Vertigo")],
+        )
+        self.assertNotIn(None, Review.objects.values_list("created", flat=True))
+        with self.assertRaises(IntegrityError):
+            Review.objects.create(user=bob, movie=vertigo, content="Again")
+
+        out = io.StringIO()
+        call_command("migrate_reviews", stdout=out)
+        self.assertIn("up to date", out.getvalue())
+
+
+class SuggestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sleep = make_movie("The Big Sleep")
+        cls.heat = make_movie("The Big Heat")
+        cls.amelie = make_movie("Amélie")
+        cls.bogart = make_person("Humphrey Bogart")
+        set_cast(cls.sleep, [cls.bogart])
+        fan = make_user("fan")[0]
+        fan.favorites.add(cls.heat)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = override_settings(
+            SUGGEST_SNAPSHOT_PATH=os.path.join(directory.name, "suggest.pickle"),
+            SUGGEST_SYNC_SECONDS=0,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        suggest.reset()
+        self.addCleanup(suggest.reset)
+
+    def suggested(self, query, **params):
+        response = self.client.get("/api/v1/search/suggest", {"q": query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(entry["type"], entry["label"]) for entry in response.json()]
+
+    def test_any_word_matches_most_popular_first(self):
+        self.assertEqual(
+            self.suggested("the b"),
+            [("movie", "The Big Heat"), ("movie", "The Big Sleep")],
+        )
+        self.assertEqual(self.suggested("sle"), [("movie", "The Big Sleep")])
+        self.assertEqual(self.suggested("AME"), [("movie", "Amélie")])
+        self.assertEqual(self.suggested("bog"), [("person", "Humphrey Bogart")])
+        self.assertEqual(self.suggested("big", limit=1), [("movie", "The Big Heat")])
+        self.assertEqual(self.suggested("zz"), [])
+
+        entry = self.client.get("/api/v1/search/suggest", {"q": "hum"}).json()[0]
+        self.assertEqual(entry, {"id": str(self.bogart.id), "label": "Humphrey Bogart", "type": "person"})
+
+    def test_rejects_missing_query_and_bad_limit(self):
+        self.assertEqual(self.client.get("/api/v1/search/suggest").status_code, 400)
+        response = self.client.get("/api/v1/search/suggest", {"q": "the", "limit": "100"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_follows_catalog_changes(self):
+        self.assertEqual(self.suggested("big s"), [("movie", "The Big Sleep")])
+
+        self.sleep.media_title = "The Long Sleep"
+        self.sleep.save()
+        self.heat.delete()
+        bacall = make_person("Lauren Bacall")
+        self.bogart.delete()
+
+        self.assertEqual(self.suggested("big"), [])
+        self.assertEqual(self.suggested("long"), [("movie", "The Long Sleep")])
+        self.assertEqual(self.suggested("la"), [("person", "Lauren Bacall")])
+        self.assertEqual(self.suggested("hum"), [])
+        bacall.delete()
+        self.assertEqual(self.suggested("la"), [])
+
+    def test_loads_snapshot_instead_of_reading_catalog(self):
+        out = io.StringIO()
+        call_command("build_suggest_index", stdout=out)
+        self.assertIn("Indexed 4 titles and names", out.getvalue())
+
+        with mock.patch.object(suggest, "build") as build:
+            self.assertEqual(self.suggested("ame"), [("movie", "Amélie")])
+            # Made after the snapshot, caught up from its version
+            make_movie("American Graffiti")
+            self.assertEqual(
+                self.suggested("ame"), [("movie", "American Graffiti"), ("movie", "Amélie")]
+            )
+        build.assert_not_called()
+
+    def test_index_stays_consistent_through_updates(self):
+        index = suggest.SuggestIndex(
+            [("movie", str(i), f"Title {i} part {i % 3}", i) for i in range(20)]
+        )
+        index.update(
+            [("movie", "3", "Renamed", 100), ("person", "x", "Title Person", 0)],
+            removed=[("movie", str(i)) for i in range(0, 20, 2)],
+        )
+        self.assertEqual(index.keys, sorted(index.keys))
+        self.assertEqual(index.suggest("ren"), [("movie", "3", "Renamed")])
+        self.assertEqual(
+            [id_ for _, id_, _ in index.suggest("title", limit=3)], ["19", "17", "15"]
+        )
+        self.assertEqual(
+            [id_ for _, id_, _ in index.suggest("part 1", limit=20)], ["19", "13", "7", "1"]
+        )
+
+        copy = suggest.SuggestIndex.undump(index.dump())
+        self.assertEqual(len(copy), len(index))
+        for query in ("ren", "title", "part 1", "person"):
+            self.assertEqual(copy.suggest(query, limit=20), index.suggest(query, limit=20))
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.drama, cls.crime, cls.comedy = (
+            Genre.objects.create(name=name) for name in ("Drama", "Crime", "Comedy")
+        )
+        cls.movies = {}
+        for title, released, length, genres in (
+            ("The Godfather", datetime.date(1972, 3, 24), 175, [cls.drama, cls.crime]),
+            ("Chinatown", datetime.date(1974, 6, 20), 130, [cls.drama, cls.crime]),
+            ("Annie Hall", datetime.date(1977, 4, 20), 93, [cls.comedy]),
+            ("Manhattan", datetime.date(1979, 4, 25), 96, [cls.comedy, cls.drama]),
+            ("Heat", datetime.date(1995, 12, 15), 170, [cls.crime]),
+            ("Fargo", datetime.date(1996, 3, 8), 98, [cls.crime, cls.comedy]),
+        ):
+            movie = make_movie(title, genres=genres)
+            movie.media_release_date, movie.media_length = released, length
+            movie.save()
+            cls.movies[title] = movie
+        user = make_user("critic")[0]
+        for title, value in (("Chinatown", 9), ("Fargo", 8), ("Heat", 7)):
+            rating = Rating.objects.create(user=user, rating=value)
+            rating.movie.add(cls.movies[title])
+
+    def setUp(self):
+        overrides = override_settings(FACETS_SYNC_SECONDS=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        facets.reset()
+        self.addCleanup(facets.reset)
+
+    def browse(self, **params):
+        response = self.client.get("/api/v1/movies/browse", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def titles(self, **params):
+        return [movie["media_title"] for movie in self.browse(**params)["results"]]
+
+    def test_filters_combine(self):
+        self.assertEqual(
+            self.titles(genres="drama,Crime", ordering="media_release_date"),
+            ["The Godfather", "Chinatown"],
+        )
+        self.assertEqual(
+            self.titles(
+                genres="Crime", released_from="1974-06-20", released_to="1995-12-15"
+            ),
+            ["Heat", "Chinatown"],
+        )
+        self.assertEqual(
+            self.titles(length_min=96, length_max=130, ordering="media_title"),
+            ["Chinatown", "Fargo", "Manhattan"],
+        )
+        self.assertEqual(self.titles(genres="Western"), [])
+
+    def test_facet_counts(self):
+        found = self.browse(genres="Crime", released_to="1979-12-31")
+        self.assertEqual(found["count"], 2)
+        self.assertEqual(
+            found["facets"]["genres"],
+            [{"value": "Crime", "count": 2}, {"value": "Drama", "count": 2}],
+        )
+        # A range facet is counted without its own range
+        self.assertEqual(
+            found["facets"]["years"],
+            [
+                {"value": 1972, "count": 1},
+                {"value": 1974, "count": 1},
+                {"value": 1995, "count": 1},
+                {"value": 1996, "count": 1},
+            ],
+        )
+        self.assertEqual(
+            found["facets"]["runtimes"],
+            [{"min": 120, "max": 149, "count": 1}, {"min": 150, "max": 179, "count": 1}],
+        )
+
+    def test_orderings_and_pages(self):
+        self.assertEqual(
+            self.titles(ordering="-average_rating", page_size=3), ["Chinatown", "Fargo", "Heat"]
+        )
+        self.assertEqual(self.titles()[:2], ["Fargo", "Heat"])
+        second = self.browse(ordering="media_title", page_size=4, page=2)
+        self.assertEqual(
+            [movie["media_title"] for movie in second["results"]], ["Manhattan", "The Godfather"]
+        )
+        self.assertIsNone(second["next"])
+        for name, value in (("ordering", "views"), ("released_from", "1970"), ("length_min", "x")):
+            response = self.client.get("/api/v1/movies/browse", {name: value})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(name, response.json())
+
+    def test_large_results_walk_the_sorted_lists(self):
+        index = facets.build()
+        matched = index.alive
+        for ordering in ("media_title", "-media_release_date", "-average_rating"):
+            walked = index.page(matched, len(index), ordering, 1, 4)
+            with mock.patch.object(facets, "SORT_RATIO", 0):
+                sorted_directly = index.page(matched, 1, ordering, 1, 4)
+            self.assertEqual(walked, sorted_directly)
+
+    def test_follows_movie_and_genre_changes(self):
+        self.assertEqual(self.browse(genres="Comedy")["count"], 3)
+
+        fargo = self.movies["Fargo"]
+        fargo.genres.remove(self.comedy)
+        fargo.media_length = 200
+        fargo.save()
+        self.movies["Annie Hall"].delete()
+        rating = Rating.objects.create(user=make_user("fan")[0], rating=10)
+        rating.movie.add(self.movies["Manhattan"])
+
+        found = self.browse(genres="Comedy")
+        self.assertEqual([movie["media_title"] for movie in found["results"]], ["Manhattan"])
+        self.assertEqual(self.titles(ordering="-average_rating")[0], "Manhattan")
+        self.assertIn({"min": 180, "max": None, "count": 1}, self.browse()["facets"]["runtimes"])
+
+        self.comedy.name = "Comedies"
+        self.comedy.save()
+        self.assertEqual(self.titles(genres="Comedies"), ["Manhattan"])
+        self.drama.delete()
+        self.assertEqual(self.titles(genres="Drama"), [])
+        self.assertNotIn("Drama", [g["value"] for g in self.browse()["facets"]["genres"]])
+
+    def test_etag_follows_the_index(self):
+        params = {"ordering": "media_title"}
+        etag = self.client.get("/api/v1/movies/browse", params)["ETag"]
+        with override_settings(FACETS_SYNC_SECONDS=3600):
+            make_movie("Alien")
+            # Not in the index yet, and neither in the ETag
+            response = self.client.get("/api/v1/movies/browse", params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertNotIn("Alien", self.titles(**params))
+
+        response = self.client.get("/api/v1/movies/browse", params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["results"][0]["media_title"], "Alien")
+
+
+class AsyncReadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.comedy = Genre.objects.create(name="Comedy")
+        cls.star = make_person("Star")
+        cls.movies = [
+            make_movie(f"Async {i}", genres=[cls.comedy], actors=[cls.star]) for i in range(5)
+        ]
+        cls.user, _ = make_user("asyncfan")
+        cls.user.favorites.add(*cls.movies[:3])
+        for i in range(3):
+            Review.objects.create(
+                movie=cls.movies[0], user=make_user(f"asyncreviewer{i}")[0], content=f"Review {i}"
+            )
+        search.rebuild_index()
+
+    def paths(self):
+        movie, user = self.movies[0].id, self.user.id
+        return [
+            "movies",
+            "movies?page_size=2",
+            "movies?page_size=2&ordering=-media_title",
+            "movies?fields=id,media_title",
+            f"movies/{movie}",
+            f"movies/{movie}?fields=id,genres",
+            f"movies/{movie}/reviews",
+            f"movies/{movie}/reviews?page_size=2&ordering=created",
+            "movies/search?q=async",
+            "movies/search?q=async&page_size=2",
+            f"users/{user}/favorites",
+            f"users/{user}/watchlist?page_size=1",
+        ]
+
+    async def test_same_bodies_as_sync_views(self):
+        client = AsyncClient()
+        for path in self.paths():
+            with self.subTest(path=path):
+                sync = await client.get(f"/api/v1/{path}")
+                response = await client.get(f"/api/v1/async/{path}")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response["Content-Type"], "application/json")
+                body, expected = response.json(), sync.json()
+                if isinstance(expected, dict) and "next" in expected:
+                    # Links point at each view's own path
+                    for link in ("next", "previous"):
+                        if expected[link]:
+                            expected[link] = expected[link].replace("/api/v1/", "/api/v1/async/")
+                self.assertEqual(body, expected)
+
+    async def test_cursor_pages_cover_the_list(self):
+        client = AsyncClient()
+        seen = []
+        url = "/api/v1/async/movies?page_size=2"
+        while url:
+            page = (await client.get(url)).json()
+            seen.extend(movie["id"] for movie in page["results"])
+            url = page["next"]
+        self.assertEqual(sorted(seen), sorted(str(movie.id) for movie in self.movies))
+
+        previous = (await client.get(page["previous"])).json()
+        self.assertEqual([movie["id"] for movie in previous["results"]], seen[2:4])
+
+    async def test_errors_and_conditional_get(self):
+        client = AsyncClient()
+        missing = await client.get(f"/api/v1/async/movies/{uuid.uuid4()}")
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(missing.json(), {"detail": "No MovieInfo matches the given query."})
+        self.assertEqual((await client.get("/api/v1/async/users/0/favorites")).status_code, 404)
+        self.assertEqual((await client.get("/api/v1/async/movies/search")).status_code, 400)
+        response = await client.get("/api/v1/async/movies?fields=nope")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("fields", response.json())
+        self.assertEqual((await client.post("/api/v1/async/movies")).status_code, 405)
+        for path in ("movies?cursor=bogus", f"movies/{self.movies[0].id}/reviews?cursor=bogus"):
+            with self.subTest(path=path):
+                sync = await client.get(f"/api/v1/{path}")
+                response = await client.get(f"/api/v1/async/{path}")
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(), sync.json())
+
+        path = f"/api/v1/async/movies/{self.movies[1].id}"
+        first = await client.get(path)
+        again = await client.get(path, headers={"If-None-Match": first["ETag"]})
+        self.assertEqual(again.status_code, 304)
+
+    async def test_detail_views_are_counted(self):
+        counter = viewcounts.ViewCounter()
+        with mock.patch.object(viewcounts, "counter", counter):
+            await AsyncClient().get(f"/api/v1/async/movies/{self.movies[2].id}")
+        self.assertEqual(counter.pending(), 1)
@@ -7,21 +7,40 @@ from .views import (
     ReviewDetail,
     UserInfoDetail,
     UserFavoriteList,
+    UserFavoriteBulk,
     UserWatchList,
+    UserWatchListBulk,
+    UserRecommendations,
     MistralSuggestion,
+    MovieStatistics,
+    SimilarMovies,
+    MovieCredits,
+    PersonCredits,
+    TrendingMovies,
+    MovieBrowse,
+    SearchSuggestions,
     MovieSearchView,  # Import the new search view
 )
 
 urlpatterns = [
     path("movies", MovieInfoList.as_view()),
+    path("movies/trending", TrendingMovies.as_view()),
+    path("movies/browse", MovieBrowse.as_view()),
     path("movies/<uuid:pk>", MovieInfoDetail.as_view()),
     path("movies/<uuid:pk>/mistral", MistralSuggestion.as_view()),
-    # path("movies/<uuid:pk>/statistics", MovieInfoDetail.as_view()),
+    path("movies/<uuid:pk>/statistics", MovieStatistics.as_view()),
+    path("movies/<uuid:pk>/similar", SimilarMovies.as_view()),
+    path("movies/<uuid:pk>/credits", MovieCredits.as_view()),
+    path("people/<uuid:pk>/credits", PersonCredits.as_view()),
     path("movies/<uuid:pk>/reviews", ReviewList.as_view()),
     path("movies/<uuid:movie_id>/reviews/<uuid:pk>", ReviewDetail.as_view()),
     path("users/<int:pk>", UserInfoDetail.as_view()),
     path("users/<int:pk>/favorites", UserFavoriteList.as_view()),
     path("users/<int:pk>/watchlist", UserWatchList.as_view()),
+    path("users/<int:pk>/favorites/bulk", UserFavoriteBulk.as_view()),
+    path("users/<int:pk>/watchlist/bulk", UserWatchListBulk.as_view()),
+    path("users/<int:pk>/recommendations", UserRecommendations.as_view()),
     # path("users/<int:pk>/ratings", UserWatchList.as_view()),
     path("movies/search", MovieSearchView.as_view(), name="movie-search"),  # Add search endpoint
+    path("search/suggest", SearchSuggestions.as_view()),
 ]
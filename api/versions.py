@@ -0,0 +1,254 @@
+"""
+Version counters for conditional GETs.
+
+Each cacheable payload is described by a few keys:
+
+* ``movie:<id>`` -- the movie, its genres, cast and crew, its average
+  rating and its reviews
+* ``movies`` -- catalog-wide listings. Not a row of its own, which every
+  writer would lock: it stands for the newest ``movie:<id>`` bump
+* ``favorites:<user id>`` / ``watchlist:<user id>`` -- the list's members
+* ``person:<id>`` -- the person's name, read by api/suggest.py
+
+Writes bump the keys they touch, mostly from the receivers in
+api/signals.py. A GET hashes the current versions of its keys into a
+strong ETag and sends the newest bump as Last-Modified, so a repeat poll is
+answered with 304 after one small query and before any serializer runs.
+"""
+
+import functools
+import hashlib
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q, Subquery
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from api.bulk import chunked
+from api.models import ContentVersion
+
+
+CATALOG = "movies"
+MOVIE = "movie:"
+LISTS = ("favorites", "watchlist")
+
+# Bumps are stamped by the writing process's clock when the bump is made,
+# not when it commits, so readers of recent bumps look this far back too
+CLOCK_MARGIN = timedelta(seconds=5)
+
+
+def movie_key(movie_id):
+    return f"{MOVIE}{movie_id}"
+
+
+def person_key(person_id):
+    return f"person:{person_id}"
+
+
+def list_key(list_name, user_id):
+    return f"{list_name}:{user_id}"
+
+
+def bump(keys):
+    # Sorted so concurrent writers lock rows in the same order
+    keys = sorted({str(key) for key in keys})
+    if not keys:
+        return
+
+    now = timezone.now()
+    with transaction.atomic():
+        for chunk in chunked(keys):
+            ContentVersion.objects.bulk_create(
+                [ContentVersion(key=key) for key in chunk], ignore_conflicts=True
+            )
+            ContentVersion.objects.filter(key__in=chunk).update(
+                version=F("version") + 1, updated_at=now
+            )
+
+
+def bump_movies(movie_ids, catalog=True):
+    """
+    Bump each movie's key, and stamp it again once the transaction commits
+    unless the change doesn't show up in movie listings (e.g. a review).
+
+    Listings take the newest stamp as their version. A stamp from inside a
+    transaction can be older than one committed before it, so without the
+    second stamp the change could commit behind a version readers have
+    already seen.
+    """
+    keys = [movie_key(movie_id) for movie_id in movie_ids]
+    bump(keys)
+    if keys and catalog:
+        transaction.on_commit(functools.partial(_restamp, keys))
+
+
+def _restamp(keys):
+    now = timezone.now()
+    for chunk in chunked(sorted(keys)):
+        ContentVersion.objects.filter(key__in=chunk).update(updated_at=now)
+
+
+def bumped_since(since, prefixes):
+    """
+    ``{prefix: {rest of key}}`` for the keys starting with each of
+    ``prefixes`` bumped at or after ``since`` (less CLOCK_MARGIN), or ever
+    when ``since`` is None. ``bumped_since(t, ["movie:"])`` gives the ids
+    of movies changed since ``t``.
+    """
+    condition = Q()
+    for prefix in prefixes:
+        condition |= Q(key__startswith=prefix)
+    keys = ContentVersion.objects.filter(condition)
+    if since is not None:
+        keys = keys.filter(updated_at__gte=since - CLOCK_MARGIN)
+
+    found = defaultdict(set)
+    for key in keys.values_list("key", flat=True):
+        for prefix in prefixes:
+            if key.startswith(prefix):
+                found[prefix].add(key[len(prefix):])
+    return found
+
+
+def _versions(keys):
+    condition = Q(key__in=keys)
+    if CATALOG in keys:
+        newest = ContentVersion.objects.filter(key__startswith=MOVIE).order_by("-updated_at")
+        condition |= Q(key=Subquery(newest.values("key")[:1]))
+    return ContentVersion.objects.filter(condition).values_list(
+        "key", "version", "updated_at"
+    )
+
+
+def catalog_version():
+    """
+    ``(version, updated_at)`` of the catalog now, for copies of it kept
+    in process (see api/facets.py) to record what they cover.
+    """
+    newest = (
+        ContentVersion.objects.filter(key__startswith=MOVIE)
+        .order_by("-updated_at")
+        .values_list("key", "version", "updated_at")
+        .first()
+    )
+    return _catalog_version({newest[0]: newest[1:]} if newest else {})
+
+
+def _read(keys):
+    # Keys given with their version aren't looked up
+    return [key for key in keys if isinstance(key, str)]
+
+
+def validators(request, keys):
+    """
+    Return ``(etag, last_modified)`` for a response built from ``keys``.
+
+    ``last_modified`` is a Unix timestamp, or None when some key has never
+    been bumped and so has no known modification time.
+    """
+    read = _read(keys)
+    return _validators(request, keys, list(_versions(read)) if read else [])
+
+
+async def avalidators(request, keys):
+    """validators() through the async ORM."""
+    read = _read(keys)
+    return _validators(request, keys, [row async for row in _versions(read)] if read else [])
+
+
+def _validators(request, keys, rows):
+    found = {key: (version, updated_at) for key, version, updated_at in rows}
+    if CATALOG in keys:
+        found[CATALOG] = _catalog_version(found)
+    found.update((key[0], key[1:]) for key in keys if not isinstance(key, str))
+    names = [key if isinstance(key, str) else key[0] for key in keys]
+
+    digest = hashlib.sha256()
+    # The same versions render differently per query string and media type
+    digest.update(request.get_full_path().encode())
+    digest.update(b"\0" + request.META.get("HTTP_ACCEPT", "").encode())
+    for key in names:
+        version = found.get(key, (0, None))[0]
+        digest.update(f"\0{key}={version}".encode())
+    etag = f'"{digest.hexdigest()[:32]}"'
+
+    stamps = [found.get(key, (0, None))[1] for key in names]
+    if None in stamps:
+        return etag, None
+    return etag, int(max(stamps).timestamp())
+
+
+def _catalog_version(found):
+    # The newest of the movie rows read, which _versions() made sure
+    # includes the newest of all
+    movies = [
+        (updated_at, key, version)
+        for key, (version, updated_at) in found.items()
+        if key.startswith(MOVIE) and updated_at is not None
+    ]
+    if not movies:
+        return 0, None
+    updated_at, key, version = max(movies)
+    return f"{key}@{version}@{updated_at.isoformat()}", updated_at
+
+
+def _add_validators(response, etag, last_modified):
+    if response.status_code in (200, 304):
+        response.headers.setdefault("ETag", etag)
+        if last_modified is not None:
+            response.headers.setdefault("Last-Modified", http_date(last_modified))
+    return response
+
+
+def conditional(get_keys):
+    """
+    Decorate a view's ``get`` to answer ``If-None-Match`` and
+    ``If-Modified-Since`` from version counters.
+
+    ``get_keys(view, request, **kwargs)`` returns the keys the response is
+    built from. A response built from a copy kept in process gives the
+    version that copy is at instead, as ``(key, version, updated_at)``.
+    """
+
+    def decorator(get):
+        @functools.wraps(get)
+        def wrapper(view, request, *args, **kwargs):
+            # Read before building the payload: a write in between leaves the
+            # client with an outdated ETag, never with an outdated payload
+            etag, last_modified = validators(request, get_keys(view, request, **kwargs))
+
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            if response is None:
+                response = get(view, request, *args, **kwargs)
+            return _add_validators(response, etag, last_modified)
+
+        return wrapper
+
+    return decorator
+
+
+def aconditional(get_keys):
+    """conditional() for an async ``get``."""
+
+    def decorator(get):
+        @functools.wraps(get)
+        async def wrapper(view, request, *args, **kwargs):
+            etag, last_modified = await avalidators(
+                request, get_keys(view, request, **kwargs)
+            )
+
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            if response is None:
+                response = await get(view, request, *args, **kwargs)
+            return _add_validators(response, etag, last_modified)
+
+        return wrapper
+
+    return decorator
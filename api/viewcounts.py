@@ -0,0 +1,218 @@
+"""
+Write-behind movie view counts and trending movies.
+
+Counting every movie page view with its own UPDATE would queue all readers
+of a popular movie on that movie's row. ``ViewCounter.record()`` only adds
+to a Counter in process memory. Once started, a background thread flushes
+it every VIEW_COUNT_FLUSH_SECONDS: one ``UPDATE ... SET entry_views =
+entry_views + n`` for all movies viewed n times, and the same for their
+hourly MovieViews rows. Each process flushes its own counts, and the
+updates only ever add, so any number of workers can run side by side.
+
+A flush that fails puts its counts back for the next one. Stopping the
+counter flushes what is left, and ``start()`` arranges for that to happen
+at interpreter exit, so a graceful worker shutdown loses nothing. The
+counter is started by movie/wsgi.py and movie/asgi.py; elsewhere (tests,
+management commands) views are only buffered until ``flush()`` is called.
+
+Movies without a MoviePage only count towards trending. ``trending()``
+ranks movies by their views over the last TRENDING_WINDOW_HOURS, each
+hour's count weighted by 0.5 ** (hours ago / TRENDING_HALF_LIFE_HOURS).
+``cached_trending()`` keeps that ranking in the default cache for
+TRENDING_CACHE_TIMEOUT seconds.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, FloatField, Sum, Value
+from django.db.models.functions import Power
+
+from api.bulk import CHUNK_SIZE, chunked
+from api.models import MovieInfo, MoviePage, MovieViews
+
+
+logger = logging.getLogger(__name__)
+
+TRENDING_HALF_LIFE_HOURS = 24
+# Views older than a week weigh less than 1% and aren't read
+TRENDING_WINDOW_HOURS = 7 * 24
+# Hourly rows are kept a little longer than they are read
+RETENTION_HOURS = 2 * TRENDING_WINDOW_HOURS
+MAX_TRENDING = 100
+DEFAULT_TRENDING = 20
+
+CACHE_KEY = "trending"
+
+
+def current_hour(now=None):
+    """Hours since the Unix epoch."""
+    return int((time.time() if now is None else now) // 3600)
+
+
+def _by_count(counts):
+    # {n: [keys counted n times]}, so each n takes one UPDATE
+    grouped = defaultdict(list)
+    for key, count in counts.items():
+        grouped[count].append(key)
+    return grouped
+
+
+def write(pending):
+    """
+    Add ``pending``, a {(movie_id, hour): views} mapping, to MovieViews and
+    MoviePage.entry_views in one transaction.
+    """
+    movie_ids = {movie_id for movie_id, _ in pending}
+    with transaction.atomic():
+        existing = set()
+        for chunk in chunked(movie_ids):
+            existing.update(MovieInfo.objects.filter(id__in=chunk).values_list("id", flat=True))
+        # Views of movies deleted since are dropped
+        pending = {key: views for key, views in pending.items() if key[0] in existing}
+
+        MovieViews.objects.bulk_create(
+            [MovieViews(movie_id=movie_id, hour=hour) for movie_id, hour in pending],
+            batch_size=CHUNK_SIZE,
+            ignore_conflicts=True,
+        )
+        hours = defaultdict(dict)
+        for (movie_id, hour), views in pending.items():
+            hours[hour][movie_id] = views
+        for hour, views in hours.items():
+            for count, ids in _by_count(views).items():
+                for chunk in chunked(ids):
+                    MovieViews.objects.filter(hour=hour, movie_id__in=chunk).update(
+                        views=F("views") + count
+                    )
+
+        totals = Counter()
+        for (movie_id, _), views in pending.items():
+            totals[movie_id] += views
+        for count, ids in _by_count(totals).items():
+            for chunk in chunked(ids):
+                MoviePage.objects.filter(movie_information_id__in=chunk).update(
+                    entry_views=F("entry_views") + count
+                )
+
+
+class ViewCounter:
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pruned_hour = None
+
+    def record(self, movie_id, views=1, now=None):
+        key = (movie_id, current_hour(now))
+        with self._lock:
+            self._pending[key] += views
+
+    def pending(self):
+        with self._lock:
+            return sum(self._pending.values())
+
+    def flush(self):
+        """
+        Write every buffered view. Returns how many there were.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return 0
+        try:
+            write(pending)
+        except BaseException:
+            with self._lock:
+                self._pending.update(pending)
+            raise
+
+        hour = current_hour()
+        if hour != self._pruned_hour:
+            MovieViews.objects.filter(hour__lt=hour - RETENTION_HOURS).delete()
+            self._pruned_hour = hour
+        return sum(pending.values())
+
+    def start(self):
+        """
+        Flush every ``interval`` seconds from a background thread, and once
+        more at exit.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="view-counts", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        atexit.unregister(self.stop)
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing %d view counts failed", self.pending())
+        # The thread's own database connection
+        connection.close()
+
+    def _after_fork(self):
+        # Threads don't survive fork(), e.g. gunicorn --preload; a child
+        # starts its own with an empty buffer
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        if self._thread is not None:
+            self._thread = None
+            self.start()
+
+
+counter = ViewCounter(interval=getattr(settings, "VIEW_COUNT_FLUSH_SECONDS", 5.0))
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=counter._after_fork)
+
+
+def trending(limit=MAX_TRENDING, now=None):
+    """
+    Movies ranked by their time-decayed views, as a list of (movie_id,
+    score) pairs, highest first.
+    """
+    hour = current_hour(now)
+    weight = Power(
+        Value(0.5),
+        (Value(hour) - F("hour")) / Value(float(TRENDING_HALF_LIFE_HOURS)),
+        output_field=FloatField(),
+    )
+    hits = (
+        MovieViews.objects.filter(hour__gt=hour - TRENDING_WINDOW_HOURS, hour__lte=hour)
+        .values("movie_id")
+        .annotate(score=Sum(F("views") * weight, output_field=FloatField()))
+        .order_by("-score", "movie_id")[:limit]
+    )
+    return [(hit["movie_id"], hit["score"]) for hit in hits]
+
+
+def cached_trending(limit=MAX_TRENDING):
+    """
+    The ids of the ``limit`` most trending movies, from the default cache.
+    """
+    movie_ids = cache.get(CACHE_KEY)
+    if movie_ids is None:
+        movie_ids = [movie_id for movie_id, _ in trending(MAX_TRENDING)]
+        cache.set(CACHE_KEY, movie_ids, getattr(settings, "TRENDING_CACHE_TIMEOUT", 60))
+    return movie_ids[:limit]
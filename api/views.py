@@ -1,32 +1,154 @@
+import asyncio
+import datetime
+import uuid
+
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
+from django.views import View
 from rest_framework.permissions import (
     IsAuthenticatedOrReadOnly,
     AllowAny,
     BasePermission,
     SAFE_METHODS,
 )
-from rest_framework.authentication import get_authorization_header, TokenAuthentication
-from rest_framework.authtoken.models import Token
 from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from djoser.serializers import UserSerializer  # Ensure this import is included
-from mistralai import Mistral
-from django.utils.html import strip_tags
-import os
-import json
+import httpx
 import nh3
-
-from api.models import CustomUser, MovieInfo, Review
-from api.serializers import MovieInfoSerializer, ReviewSerializer
+from mistralai.models import SDKError
+
+from api import (
+    credits,
+    facets,
+    fieldsets,
+    recommendations,
+    search,
+    similarity,
+    streaming,
+    suggest,
+    summaries,
+    versions,
+    viewcounts,
+)
+from api.models import CustomUser, MovieInfo, MovieRatingStats, Person, Review
+from api.pagination import (
+    BrowsePagination,
+    MovieCursorPagination,
+    ReviewCursorPagination,
+    SearchPagination,
+)
+from api.serializers import (
+    FilmographySerializer,
+    MovieCreditSerializer,
+    MovieInfoSerializer,
+    MovieRatingStatsSerializer,
+    ReviewSerializer,
+)
 
 
 User = get_user_model()
 
 
+def movie_list_response(request, queryset, view=None):
+    """
+    Serialize a movie queryset, as a cursor page when the client asks for
+    one, or streamed in full (see api/streaming.py).
+    """
+    fields = fieldsets.requested(request, MovieInfoSerializer)
+    queryset = queryset.with_related(fields)
+    if streaming.is_requested(request):
+        return streaming.stream(request, queryset, MovieInfoSerializer, fields=fields)
+
+    paginator = MovieCursorPagination()
+    page = paginator.paginate_queryset(queryset, request, view=view)
+
+    if page is None:
+        serializer = MovieInfoSerializer(queryset, many=True, fields=fields)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    serializer = MovieInfoSerializer(page, many=True, fields=fields)
+    return paginator.get_paginated_response(serializer.data)
+
+
+def requested_limit(request, default, maximum):
+    limit = request.query_params.get("limit", str(default))
+    if not limit.isdigit() or not 1 <= int(limit) <= maximum:
+        raise ValidationError({"limit": [f"Must be between 1 and {maximum}"]})
+    return int(limit)
+
+
+def ranked_movies_response(request, movie_ids):
+    """
+    Serialize the movies with the given ids, in that order, leaving out any
+    that no longer exist.
+    """
+    fields = fieldsets.requested(request, MovieInfoSerializer)
+    movies = MovieInfo.objects.with_related(fields).in_bulk(movie_ids)
+    serializer = MovieInfoSerializer(
+        [movies[movie_id] for movie_id in movie_ids if movie_id in movies],
+        many=True,
+        fields=fields,
+    )
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+def browse_filters(request):
+    """
+    The facets.browse() arguments for a movies/browse request's query
+    string.
+    """
+    params = request.query_params
+    errors = {}
+
+    def parsed(name, parse, message):
+        value = params.get(name, "")
+        if not value:
+            return None
+        try:
+            return parse(value)
+        except ValueError:
+            errors[name] = [message]
+
+    filters = {
+        "genres": [name for name in params.get("genres", "").split(",") if name.strip()],
+        "released": tuple(
+            date.toordinal() if date else None
+            for date in (
+                parsed(name, datetime.date.fromisoformat, "Must be a date as YYYY-MM-DD")
+                for name in ("released_from", "released_to")
+            )
+        ),
+        "length": tuple(
+            parsed(name, int, "Must be a whole number of minutes")
+            for name in ("length_min", "length_max")
+        ),
+        "ordering": params.get("ordering", facets.DEFAULT_ORDERING),
+    }
+    if filters["ordering"].lstrip("-") not in facets.ORDERINGS:
+        errors["ordering"] = [f"Must be one of {', '.join(facets.ORDERINGS)}, optionally with -"]
+    if errors:
+        raise ValidationError(errors)
+    return filters
+
+
+def limit_parameter(default, maximum):
+    return openapi.Parameter(
+        "limit",
+        openapi.IN_QUERY,
+        type=openapi.TYPE_INTEGER,
+        description=f"At most {maximum}, {default} by default",
+    )
+
+
 class IsOwnerOrReadOnly(BasePermission):
     """
     Custom permission to only allow owners of an object to edit it.
@@ -42,19 +164,205 @@ class IsOwnerOrReadOnly(BasePermission):
         return obj.user == request.user
 
 
-class MovieInfoList(generics.ListCreateAPIView):
+class MovieFieldsMixin:
+    """
+    Apply ``?fields=`` and ``?expand=`` (see api/fieldsets.py) to the
+    movies a generic view reads.
+    """
+
+    def requested_fields(self):
+        request = getattr(self, "request", None)
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        return fieldsets.requested(request, MovieInfoSerializer)
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault("fields", self.requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+
+class MovieInfoList(MovieFieldsMixin, generics.ListCreateAPIView):
     permission_classes = [IsAuthenticatedOrReadOnly]
-    queryset = MovieInfo.objects.all()
+    queryset = MovieInfo.objects.with_related()
     serializer_class = MovieInfoSerializer
+    pagination_class = MovieCursorPagination
+    filter_backends = [OrderingFilter]
+    ordering_fields = ["average_rating", "media_title", "media_release_date"]
+    ordering = ["id"]
+    renderer_classes = streaming.RENDERER_CLASSES
 
+    @versions.conditional(lambda view, request, **kwargs: [versions.CATALOG])
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
-class MovieInfoDetail(generics.RetrieveAPIView):
+    def get_queryset(self):
+        return MovieInfo.objects.with_related(self.requested_fields())
+
+    def list(self, request, *args, **kwargs):
+        if streaming.is_requested(request):
+            return streaming.stream(
+                request,
+                self.filter_queryset(self.get_queryset()),
+                self.get_serializer_class(),
+                context=self.get_serializer_context(),
+                fields=self.requested_fields(),
+            )
+        return super().list(request, *args, **kwargs)
+
+
+class MovieInfoDetail(MovieFieldsMixin, generics.RetrieveAPIView):
     permission_classes = [IsAuthenticatedOrReadOnly]
     queryset = MovieInfo.objects.all()
     serializer_class = MovieInfoSerializer
 
+    @versions.conditional(lambda view, request, pk: [versions.movie_key(pk)])
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def get_object(self, queryset=None):
-        return MovieInfo.objects.get(pk=self.kwargs["pk"])
+        return MovieInfo.objects.with_related(self.requested_fields()).get(pk=self.kwargs["pk"])
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Buffered, see api/viewcounts.py
+        if request.method == "GET" and response.status_code in (200, 304):
+            viewcounts.counter.record(self.kwargs["pk"])
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class MovieStatistics(generics.RetrieveAPIView):
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    serializer_class = MovieRatingStatsSerializer
+
+    def get_object(self, queryset=None):
+        movie = get_object_or_404(MovieInfo, id=self.kwargs["pk"])
+        try:
+            return movie.rating_stats
+        except MovieRatingStats.DoesNotExist:
+            return MovieRatingStats(movie=movie)
+
+
+class SimilarMovies(APIView):
+    """
+    Movies sharing the most genres, cast and crew with this one (see
+    api/similarity.py). Takes ``?limit=`` and the sparse fieldset
+    parameters.
+    """
+
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        manual_parameters=[limit_parameter(similarity.MAX_RESULTS, similarity.MAX_RESULTS)],
+        responses={200: MovieInfoSerializer(many=True)},
+    )
+    def get(self, request, pk):
+        limit = requested_limit(request, similarity.MAX_RESULTS, similarity.MAX_RESULTS)
+        movie = get_object_or_404(MovieInfo.objects.only("id"), id=pk)
+
+        hits = similarity.similar_movies(movie.id, limit)
+        return ranked_movies_response(request, [movie_id for movie_id, _ in hits])
+
+
+class MovieCredits(APIView):
+    """
+    Everyone credited on a movie, by role then billing order (see
+    api/credits.py).
+    """
+
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(responses={200: MovieCreditSerializer(many=True)})
+    @versions.conditional(lambda view, request, pk: [versions.movie_key(pk)])
+    def get(self, request, pk):
+        rows = list(credits.movie_credits(pk))
+        if not rows:
+            get_object_or_404(MovieInfo.objects.only("id"), id=pk)
+        return Response(MovieCreditSerializer(rows, many=True).data, status=status.HTTP_200_OK)
+
+
+class PersonCredits(APIView):
+    """
+    A person's filmography, newest movie first (see api/credits.py).
+    """
+
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(responses={200: FilmographySerializer(many=True)})
+    def get(self, request, pk):
+        rows = list(credits.filmography(pk))
+        if not rows:
+            get_object_or_404(Person.objects.only("id"), id=pk)
+        return Response(FilmographySerializer(rows, many=True).data, status=status.HTTP_200_OK)
+
+
+class TrendingMovies(APIView):
+    """
+    Movies with the most views lately, recent views weighing more (see
+    api/viewcounts.py). Takes ``?limit=`` and the sparse fieldset
+    parameters.
+    """
+
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            limit_parameter(viewcounts.DEFAULT_TRENDING, viewcounts.MAX_TRENDING),
+        ],
+        responses={200: MovieInfoSerializer(many=True)},
+    )
+    def get(self, request):
+        limit = requested_limit(request, viewcounts.DEFAULT_TRENDING, viewcounts.MAX_TRENDING)
+        return ranked_movies_response(request, viewcounts.cached_trending(limit))
+
+
+class MovieBrowse(APIView):
+    """
+    Movies filtered by ``?genres=`` (comma separated, all required),
+    ``?released_from=``/``?released_to=`` and ``?length_min=``/
+    ``?length_max=`` (inclusive), with counts per genre, release year and
+    runtime bucket under ``facets`` (see api/facets.py). Ordered by
+    ``?ordering=`` release date, title or average rating, newest first by
+    default. Takes ``?page=``, ``?page_size=`` and the sparse fieldset
+    parameters.
+    """
+
+    permission_classes = [AllowAny]
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(name, openapi.IN_QUERY, type=kind, description=description)
+            for name, kind, description in (
+                ("genres", openapi.TYPE_STRING, "Genre names, comma separated"),
+                ("released_from", openapi.TYPE_STRING, "YYYY-MM-DD"),
+                ("released_to", openapi.TYPE_STRING, "YYYY-MM-DD"),
+                ("length_min", openapi.TYPE_INTEGER, "Minutes"),
+                ("length_max", openapi.TYPE_INTEGER, "Minutes"),
+                ("ordering", openapi.TYPE_STRING, ", ".join(facets.ORDERINGS)),
+            )
+        ],
+    )
+    # The index catches up every FACETS_SYNC_SECONDS, so the ETag follows
+    # the catalog version it is at rather than the database's
+    @versions.conditional(
+        lambda view, request: [(versions.CATALOG, *facets.current().catalog)]
+    )
+    def get(self, request):
+        results, counts = facets.browse(**browse_filters(request))
+        paginator = BrowsePagination()
+        movie_ids = [
+            uuid.UUID(movie_id)
+            for movie_id in paginator.paginate_queryset(results, request, view=self)
+        ]
+
+        fields = fieldsets.requested(request, MovieInfoSerializer)
+        movies = MovieInfo.objects.with_related(fields).in_bulk(movie_ids)
+        serializer = MovieInfoSerializer(
+            [movies[movie_id] for movie_id in movie_ids if movie_id in movies],
+            many=True,
+            fields=fields,
+        )
+        response = paginator.get_paginated_response(serializer.data)
+        response.data["facets"] = counts
+        return response
 
 
 class UserInfoDetail(generics.RetrieveAPIView):
@@ -69,31 +377,62 @@ class UserInfoDetail(generics.RetrieveAPIView):
 class ReviewList(generics.ListCreateAPIView):
     permission_classes = [IsAuthenticatedOrReadOnly]
     serializer_class = ReviewSerializer
+    pagination_class = ReviewCursorPagination
+    filter_backends = [OrderingFilter]
+    ordering_fields = ["created"]
+    ordering = ["-created"]
+    renderer_classes = streaming.RENDERER_CLASSES
+
+    @versions.conditional(lambda view, request, pk: [versions.movie_key(pk)])
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if streaming.is_requested(request):
+            return streaming.stream(
+                request,
+                queryset,
+                self.get_serializer_class(),
+                context=self.get_serializer_context(),
+            )
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        serializer = self.get_serializer(self.paginator.limit_unpaginated(queryset), many=True)
+        return Response(serializer.data)
 
     def get_queryset(self):
         movie_id = self.kwargs["pk"]
-        return Review.objects.filter(movie=movie_id)
+        return Review.objects.filter(movie=movie_id).select_related("user")
 
     def create(self, request, *args, **kwargs):
-        movie_id = self.kwargs["pk"]
+        content = request.data.get("content")
+        if not content:
+            return Response(
+                {"error": "content is required"}, status=status.HTTP_400_BAD_REQUEST
+            )
 
+        # A single INSERT: the (movie, user) constraint catches duplicates,
+        # even from concurrent requests, and the foreign key unknown movies
+        review = Review(
+            user=request.user, movie_id=self.kwargs["pk"], content=nh3.clean(content)
+        )
         try:
-            review = Review.objects.get(movie=movie_id, user=request.user)
-            if review:
+            with transaction.atomic():
+                review.save(force_insert=True)
+        except IntegrityError:
+            if not MovieInfo.objects.filter(pk=self.kwargs["pk"]).exists():
                 return Response(
-                    {"error": "Review already exists"},
-                    status=status.HTTP_409_CONFLICT,
+                    {"error": "Movie not found"}, status=status.HTTP_404_NOT_FOUND
                 )
-        except:
-            pass
-
-        new_review = Review.objects.create(
-            user=request.user,
-            movie=MovieInfo.objects.get(id=movie_id),
-            content=nh3.clean(request.data.get("content")),
-        )
-        serializer = ReviewSerializer(new_review)
+            return Response(
+                {"error": "Review already exists"},
+                status=status.HTTP_409_CONFLICT,
+            )
 
+        serializer = ReviewSerializer(review)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
@@ -125,6 +464,9 @@ class ReviewDetail(APIView):
         res = Review.objects.filter(id=pk).update(
             content=content
         )
+        # update() skips the post_save receivers, so flag the summary here
+        summaries.mark_stale(review.movie_id)
+        versions.bump_movies([review.movie_id], catalog=False)
 
         return Response(res)
     
@@ -144,76 +486,124 @@ class MovieSearchView(APIView):
     permission_classes = [AllowAny]
     """
     View to handle movie search queries.
+
+    Hits are ranked by relevance across titles, descriptions, genres and
+    cast/crew names. Without ``?page=`` or ``?page_size=`` the first page is
+    returned as a plain list.
     """
 
     def get(self, request):
         query = request.query_params.get("q", "")  # Get the query string parameter
         if query:
-            results = MovieInfo.objects.filter(
-                media_title__icontains=query
-            )  # Case-insensitive search
-            print(f"Search query: {query}")  # Debugging log
-            print(f"Results: {results}")  # Debugging log
-            serializer = MovieInfoSerializer(results, many=True)
-            print(f"Serialized data: {serializer.data}")  # Debugging log
+            hits = search.search_movies(query)
+            paginator = SearchPagination()
+            page = paginator.paginate_queryset(hits, request, view=self)
+
+            fields = fieldsets.requested(request, MovieInfoSerializer)
+            movie_ids = [movie_id for movie_id, _ in page]
+            movies = MovieInfo.objects.with_related(fields).in_bulk(movie_ids)
+            serializer = MovieInfoSerializer(
+                [movies[movie_id] for movie_id in movie_ids if movie_id in movies],
+                many=True,
+                fields=fields,
+            )
+
+            if paginator.is_requested(request):
+                return paginator.get_paginated_response(serializer.data)
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(
             {"error": "No search query provided."}, status=status.HTTP_400_BAD_REQUEST
         )
 
 
-class MistralSuggestion(APIView):
+class SearchSuggestions(APIView):
+    """
+    Typeahead for the search box: the most popular movies and people with
+    a word of their title or name starting with ``?q=`` (see
+    api/suggest.py). Takes ``?limit=``.
+    """
+
     permission_classes = [AllowAny]
 
-    def get(self, request, pk):
-        movie = MovieInfo.objects.get(id=pk)
-        reviews = list(Review.objects.filter(movie=pk))
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter("q", openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True),
+            limit_parameter(suggest.DEFAULT_LIMIT, suggest.MAX_LIMIT),
+        ],
+    )
+    def get(self, request):
+        query = request.query_params.get("q", "")
+        if not query:
+            return Response(
+                {"error": "No search query provided."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = requested_limit(request, suggest.DEFAULT_LIMIT, suggest.MAX_LIMIT)
+        return Response(
+            [
+                {"id": id_, "label": label, "type": kind}
+                for kind, id_, label in suggest.suggest(query, limit)
+            ],
+            status=status.HTTP_200_OK,
+        )
 
-        prompts = []
 
-        for content in reviews:
-            prompts.append({
-                "role": "user",
-                "content": f"{strip_tags(content)}"
-            })
-        
-        with Mistral(
-            api_key=os.getenv("MISTRAL_API_KEY", ""),
-        ) as s:
-            
-            res = s.chat.complete(model="mistral-small-latest", messages=[
-                {
-                    f"content": f"The following messages are reviews made by users for " 
-                    f"the movie {movie.media_title}. Summarize the general sentiment and highlight "
-                    f"any key points made by reviewers without bullet points or any formatting. "
-                    f"Keep it short and succinct. If there are no reviews say \'No reviews made\'.",
-                    "role": "system",
-                },
-                *prompts
-            ])
-            chat_response = json.loads(res.model_dump_json())
-            print(prompts)
-
-            if res is not None:
-                return Response({
-                    "message": chat_response["choices"][0]['message']['content']}, 
-                    status=status.HTTP_200_OK
-                )
-            else:
-                return Response(
-                    {"error": "Mistral error"}, 
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+class MistralSuggestion(View):
+    """
+    Review summary for a movie.
+
+    Async so that, served through movie/asgi.py, waiting on Mistral doesn't
+    hold a worker thread and concurrent requests for the same movie share
+    one upstream call.
+    """
+
+    async def get(self, request, pk):
+        movie = await MovieInfo.objects.filter(id=pk).afirst()
+        if movie is None:
+            return JsonResponse(
+                {"error": "Movie not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        try:
+            message = await summaries.aget_summary(movie)
+        except asyncio.TimeoutError:
+            return JsonResponse(
+                {"error": "Mistral timed out"}, status=status.HTTP_504_GATEWAY_TIMEOUT
+            )
+        except httpx.TransportError:
+            return JsonResponse(
+                {"error": "Mistral unreachable"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        except SDKError as error:
+            if error.status_code == 429:
+                return JsonResponse(
+                    {"error": "Mistral rate limited"},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
                 )
+            return JsonResponse(
+                {"error": "Mistral error"}, status=status.HTTP_502_BAD_GATEWAY
+            )
+
+        if message is not None:
+            return JsonResponse({"message": message}, status=status.HTTP_200_OK)
+        else:
+            return JsonResponse(
+                {"error": "Mistral error"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
 
 class UserFavoriteList(APIView):
     permission_classes = [IsAuthenticatedOrReadOnly]
+    renderer_classes = streaming.RENDERER_CLASSES
 
     @swagger_auto_schema(responses={200: MovieInfoSerializer(many=True)})
+    @versions.conditional(
+        lambda view, request, pk: [versions.list_key("favorites", pk), versions.CATALOG]
+    )
     def get(self, request, pk):
         user = get_object_or_404(User, id=pk)
-        favorites = user.favorites.all()
-        serializer = MovieInfoSerializer(favorites, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return movie_list_response(request, user.favorites.all(), view=self)
 
     @swagger_auto_schema(
         request_body=openapi.Schema(
@@ -251,19 +641,15 @@ class UserFavoriteList(APIView):
         },
     )
     def post(self, request, pk):
-        # Get token from Authorization header
-        auth = get_authorization_header(request).split()[1].decode()
-        # Get user based on token provided
-        auth_user = Token.objects.get(key=auth).user
-
-        user = get_object_or_404(User, id=pk)
-
-        # Check if user pk matches the token user
-        if auth_user != user:
+        # Only the token's owner may change their list
+        if request.user.pk != pk:
+            get_object_or_404(User, id=pk)
             return Response(
                 {"error": "Invalid token"}, status=status.HTTP_401_UNAUTHORIZED
             )
 
+        user = request.user
+
         movie_id = request.data.get("movie_id")
 
         if not movie_id:
@@ -273,7 +659,7 @@ class UserFavoriteList(APIView):
 
         movie = get_object_or_404(MovieInfo, id=movie_id)
 
-        if movie in user.favorites.all():
+        if user.favorites.filter(pk=movie.pk).exists():
             return Response(
                 {"error": "Movie already in favorites"},
                 status=status.HTTP_409_CONFLICT,
@@ -314,19 +700,15 @@ class UserFavoriteList(APIView):
         },
     )
     def delete(self, request, pk):
-        # Get token from Authorization header
-        auth = get_authorization_header(request).split()[1].decode()
-        # Get user based on token provided
-        auth_user = Token.objects.get(key=auth).user
-
-        user = get_object_or_404(User, id=pk)
-
-        # Check if user pk matches the token user
-        if auth_user != user:
+        # Only the token's owner may change their list
+        if request.user.pk != pk:
+            get_object_or_404(User, id=pk)
             return Response(
                 {"error": "Invalid token"}, status=status.HTTP_401_UNAUTHORIZED
             )
 
+        user = request.user
+
         movie_id = request.data.get("movie_id")
 
         if not movie_id:
@@ -336,7 +718,7 @@ class UserFavoriteList(APIView):
 
         movie = get_object_or_404(MovieInfo, id=movie_id)
 
-        if movie in user.favorites.all():
+        if user.favorites.filter(pk=movie.pk).exists():
             user.favorites.remove(movie)
             return Response(
                 {"message": "Movie removed from favorites"},
@@ -350,13 +732,15 @@ class UserFavoriteList(APIView):
 
 class UserWatchList(APIView):
     permission_classes = [IsAuthenticatedOrReadOnly]
+    renderer_classes = streaming.RENDERER_CLASSES
 
     @swagger_auto_schema(responses={200: MovieInfoSerializer(many=True)})
+    @versions.conditional(
+        lambda view, request, pk: [versions.list_key("watchlist", pk), versions.CATALOG]
+    )
     def get(self, request, pk):
         user = get_object_or_404(User, id=pk)
-        watchlist = user.watchlist.all()
-        serializer = MovieInfoSerializer(watchlist, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return movie_list_response(request, user.watchlist.all(), view=self)
 
     @swagger_auto_schema(
         request_body=openapi.Schema(
@@ -394,19 +778,15 @@ class UserWatchList(APIView):
         },
     )
     def post(self, request, pk):
-        # Get token from Authorization header
-        auth = get_authorization_header(request).split()[1].decode()
-        # Get user based on token provided
-        auth_user = Token.objects.get(key=auth).user
-
-        user = get_object_or_404(User, id=pk)
-
-        # Check if user pk matches the token user
-        if auth_user != user:
+        # Only the token's owner may change their list
+        if request.user.pk != pk:
+            get_object_or_404(User, id=pk)
             return Response(
                 {"error": "Invalid token"}, status=status.HTTP_401_UNAUTHORIZED
             )
 
+        user = request.user
+
         movie_id = request.data.get("movie_id")
 
         if not movie_id:
@@ -416,7 +796,7 @@ class UserWatchList(APIView):
 
         movie = get_object_or_404(MovieInfo, id=movie_id)
 
-        if movie in user.watchlist.all():
+        if user.watchlist.filter(pk=movie.pk).exists():
             return Response(
                 {"error": "Movie already in watchlist"},
                 status=status.HTTP_409_CONFLICT,
@@ -457,19 +837,15 @@ class UserWatchList(APIView):
         },
     )
     def delete(self, request, pk):
-        # Get token from Authorization header
-        auth = get_authorization_header(request).split()[1].decode()
-        # Get user based on token provided
-        auth_user = Token.objects.get(key=auth).user
-
-        user = get_object_or_404(User, id=pk)
-
-        # Check if user pk matches the token user
-        if auth_user != user:
+        # Only the token's owner may change their list
+        if request.user.pk != pk:
+            get_object_or_404(User, id=pk)
             return Response(
                 {"error": "Invalid token"}, status=status.HTTP_401_UNAUTHORIZED
             )
 
+        user = request.user
+
         movie_id = request.data.get("movie_id")
 
         if not movie_id:
@@ -479,7 +855,7 @@ class UserWatchList(APIView):
 
         movie = get_object_or_404(MovieInfo, id=movie_id)
 
-        if movie in user.watchlist.all():
+        if user.watchlist.filter(pk=movie.pk).exists():
             user.watchlist.remove(movie)
             return Response(
                 {"message": "Movie removed from watchlist"},
@@ -489,3 +865,212 @@ class UserWatchList(APIView):
             return Response(
                 {"error": "Movie not in watchlist"}, status=status.HTTP_404_NOT_FOUND
             )
+
+
+class UserListBulk(APIView):
+    """
+    Add or remove many movies from a user's list in a fixed number of queries.
+
+    Subclasses set ``list_name`` to the CustomUser many-to-many field to edit.
+    The through table's unique (user, movie) pair keeps concurrent calls from
+    adding a movie twice.
+    """
+
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    list_name = None
+    max_movies = 5000
+
+    def get_movie_ids(self, request):
+        movie_ids = request.data.get("movie_ids")
+
+        if not isinstance(movie_ids, list) or not movie_ids:
+            raise ValidationError({"error": "movie_ids must be a non-empty list"})
+        if len(movie_ids) > self.max_movies:
+            raise ValidationError(
+                {"error": f"At most {self.max_movies} movie_ids per request"}
+            )
+
+        try:
+            return list(dict.fromkeys(uuid.UUID(str(movie_id)) for movie_id in movie_ids))
+        except ValueError:
+            raise ValidationError({"error": "movie_ids must be UUIDs"})
+
+    def lookup(self, user, movie_ids):
+        """
+        Return {movie_id: already in list} for the movie_ids that exist.
+        """
+        through = getattr(User, self.list_name).through
+        in_list = through.objects.filter(customuser_id=user.pk, movieinfo_id=OuterRef("pk"))
+        return dict(
+            MovieInfo.objects.filter(id__in=movie_ids)
+            .annotate(in_list=Exists(in_list))
+            .values_list("id", "in_list")
+        )
+
+    def check_owner(self, request, pk):
+        if request.user.pk != pk:
+            get_object_or_404(User, id=pk)
+            return Response(
+                {"error": "Invalid token"}, status=status.HTTP_401_UNAUTHORIZED
+            )
+        return None
+
+    def post(self, request, pk):
+        error = self.check_owner(request, pk)
+        if error:
+            return error
+
+        movie_ids = self.get_movie_ids(request)
+        found = self.lookup(request.user, movie_ids)
+
+        through = getattr(User, self.list_name).through
+        added = through.objects.bulk_create(
+            [
+                through(customuser_id=request.user.pk, movieinfo_id=movie_id)
+                for movie_id, in_list in found.items()
+                if not in_list
+            ],
+            ignore_conflicts=True,
+        )
+        # bulk_create() and queryset delete() send no m2m_changed
+        if added:
+            versions.bump([versions.list_key(self.list_name, request.user.pk)])
+
+        results = {}
+        for movie_id in movie_ids:
+            if movie_id not in found:
+                results[str(movie_id)] = "not_found"
+            elif found[movie_id]:
+                results[str(movie_id)] = "already_present"
+            else:
+                results[str(movie_id)] = "added"
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+    def delete(self, request, pk):
+        error = self.check_owner(request, pk)
+        if error:
+            return error
+
+        movie_ids = self.get_movie_ids(request)
+        found = self.lookup(request.user, movie_ids)
+
+        through = getattr(User, self.list_name).through
+        deleted, _ = through.objects.filter(
+            customuser_id=request.user.pk,
+            movieinfo_id__in=[movie_id for movie_id, in_list in found.items() if in_list],
+        ).delete()
+        if deleted:
+            versions.bump([versions.list_key(self.list_name, request.user.pk)])
+
+        results = {}
+        for movie_id in movie_ids:
+            if movie_id not in found:
+                results[str(movie_id)] = "not_found"
+            elif found[movie_id]:
+                results[str(movie_id)] = "removed"
+            else:
+                results[str(movie_id)] = "not_present"
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+BULK_REQUEST_BODY = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    required=["movie_ids"],
+    properties={
+        "movie_ids": openapi.Schema(
+            type=openapi.TYPE_ARRAY,
+            items=openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_UUID),
+        ),
+    },
+)
+
+
+def bulk_responses(done, not_done):
+    return {
+        200: openapi.Response(
+            description="OK",
+            examples={
+                "application/json": {
+                    "results": {
+                        "6a0c3b8e-8f2a-4a47-9c55-5b8f3c1f9d10": done,
+                        "0f1e2d3c-4b5a-6978-8a9b-0c1d2e3f4a5b": not_done,
+                        "00000000-0000-0000-0000-000000000000": "not_found",
+                    }
+                }
+            },
+        ),
+        400: openapi.Response(
+            description="BAD REQUEST",
+            examples={"application/json": {"error": "movie_ids must be a non-empty list"}},
+        ),
+        401: openapi.Response(
+            description="UNAUTHORIZED",
+            examples={"application/json": {"error": "Invalid token"}},
+        ),
+    }
+
+
+class UserFavoriteBulk(UserListBulk):
+    list_name = "favorites"
+
+    @swagger_auto_schema(
+        request_body=BULK_REQUEST_BODY,
+        responses=bulk_responses("added", "already_present"),
+    )
+    def post(self, request, pk):
+        return super().post(request, pk)
+
+    @swagger_auto_schema(
+        request_body=BULK_REQUEST_BODY,
+        responses=bulk_responses("removed", "not_present"),
+    )
+    def delete(self, request, pk):
+        return super().delete(request, pk)
+
+
+class UserWatchListBulk(UserListBulk):
+    list_name = "watchlist"
+
+    @swagger_auto_schema(
+        request_body=BULK_REQUEST_BODY,
+        responses=bulk_responses("added", "already_present"),
+    )
+    def post(self, request, pk):
+        return super().post(request, pk)
+
+    @swagger_auto_schema(
+        request_body=BULK_REQUEST_BODY,
+        responses=bulk_responses("removed", "not_present"),
+    )
+    def delete(self, request, pk):
+        return super().delete(request, pk)
+
+
+class UserRecommendations(APIView):
+    """
+    Movies for a user, from what they favorited, watchlisted and rated (see
+    api/recommendations.py). Takes ``?limit=`` and the sparse fieldset
+    parameters.
+    """
+
+    permission_classes = [IsAuthenticatedOrReadOnly]
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            limit_parameter(recommendations.DEFAULT_LIMIT, recommendations.MAX_LIMIT),
+        ],
+        responses={200: MovieInfoSerializer(many=True)},
+    )
+    def get(self, request, pk):
+        limit = requested_limit(
+            request, recommendations.DEFAULT_LIMIT, recommendations.MAX_LIMIT
+        )
+        user = get_object_or_404(User, id=pk)
+
+        movie_ids = recommendations.recommend(user.id, limit)
+        if movie_ids is None:
+            return Response(
+                {"error": "Recommendations are not available"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        return ranked_movies_response(request, movie_ids)
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'movie.settings')
 
 application = get_asgi_application()
+
+# Write buffered movie view counts in the background (see api/viewcounts.py)
+from api.viewcounts import counter  # noqa: E402
+
+counter.start()
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import importlib.util
+import os
 from pathlib import Path
 from corsheaders.defaults import default_headers
 
@@ -48,7 +50,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'api.replicas.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.common.CommonMiddleware',
@@ -82,12 +86,72 @@ WSGI_APPLICATION = 'movie.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Postgres when POSTGRES_HOST is set, SQLite otherwise. Each host in
+# POSTGRES_REPLICA_HOSTS (comma separated) becomes a read replica alias, see
+# api/replicas.py.
+
+def postgres_database(host):
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'HOST': host,
+        'PORT': os.getenv('POSTGRES_PORT', '5432'),
+        'NAME': os.getenv('POSTGRES_DB', 'movie'),
+        'USER': os.getenv('POSTGRES_USER', 'movie'),
+        'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+        'CONN_HEALTH_CHECKS': True,
     }
-}
+    pool_size = int(os.getenv('POSTGRES_POOL_MAX_SIZE', '10'))
+    if pool_size and importlib.util.find_spec('psycopg_pool'):
+        # Per-process pool (needs psycopg[pool]), which can't be combined
+        # with CONN_MAX_AGE
+        database['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.getenv('POSTGRES_POOL_MIN_SIZE', '2')),
+                'max_size': pool_size,
+                'timeout': int(os.getenv('POSTGRES_POOL_TIMEOUT', '10')),
+            },
+        }
+    else:
+        # Otherwise keep each thread's connection open between requests
+        database['CONN_MAX_AGE'] = int(os.getenv('POSTGRES_CONN_MAX_AGE', '60'))
+    return database
+
+
+if os.getenv('POSTGRES_HOST'):
+    DATABASES = {'default': postgres_database(os.getenv('POSTGRES_HOST'))}
+    replica_databases = [
+        postgres_database(host)
+        for host in os.getenv('POSTGRES_REPLICA_HOSTS', '').split(',')
+        if host
+    ]
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        }
+    }
+    # Extra aliases on the same file stand in for replicas, so the routing
+    # can be exercised locally
+    replica_databases = [
+        dict(DATABASES['default'])
+        for _ in range(int(os.getenv('SQLITE_REPLICAS', '2')))
+    ]
+
+for i, database in enumerate(replica_databases, 1):
+    DATABASES[f'replica_{i}'] = {**database, 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_REPLICAS = [f'replica_{i}' for i in range(1, len(replica_databases) + 1)]
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+# Seconds a client reads from the primary after writing
+REPLICA_PIN_SECONDS = 10
+
+# Request timing, see api/metrics.py
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'True') == 'True'
+# Requests at least this slow are logged with their slowest queries
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', '500'))
+# Clients allowed to scrape /internal/metrics
+METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1').split(',')
 
 
 
@@ -110,14 +174,48 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ]
 }
 
+# Build read responses with api/rows.py instead of DRF's field machinery
+FAST_SERIALIZATION = True
+
+# Seconds movie views are buffered in each process before being written
+# (see api/viewcounts.py)
+VIEW_COUNT_FLUSH_SECONDS = float(os.getenv('VIEW_COUNT_FLUSH_SECONDS', '5'))
+
+# Similar movies file written by manage.py refresh_recommendations (see
+# api/recommendations.py)
+RECOMMENDATIONS_PATH = os.getenv(
+    'RECOMMENDATIONS_PATH', str(BASE_DIR / 'var' / 'recommendations.npz')
+)
+
+# Typeahead index snapshot written by manage.py build_suggest_index, and
+# seconds between each process's checks for changes since (see
+# api/suggest.py)
+SUGGEST_SNAPSHOT_PATH = os.getenv(
+    'SUGGEST_SNAPSHOT_PATH', str(BASE_DIR / 'var' / 'suggest.pickle')
+)
+SUGGEST_SYNC_SECONDS = float(os.getenv('SUGGEST_SYNC_SECONDS', '5'))
+
+# Seconds between each process's checks for catalog changes to apply to
+# its browse facets (see api/facets.py)
+FACETS_SYNC_SECONDS = float(os.getenv('FACETS_SYNC_SECONDS', '5'))
+
+# In-process token cache (see api/authentication.py)
+TOKEN_CACHE_SIZE = 10000
+# Seconds other worker processes may keep using a deleted token
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', '5'))
+
 DJOSER = {
     'LOGIN_FIELD': 'username',
     'SERIALIZERS': {
@@ -132,6 +230,41 @@ CORS_ORIGIN_WHITELIST = [
     'http://localhost:3000'
 ]
 
+# Mistral API (see api/mistral.py)
+# None uses the SDK's default endpoint
+MISTRAL_SERVER_URL = os.getenv("MISTRAL_SERVER_URL")
+# Upstream calls allowed in flight at once, per worker process
+MISTRAL_MAX_CONCURRENCY = 4
+# Seconds before a single Mistral call is abandoned
+MISTRAL_TIMEOUT = 30
+# Batch calls (manage.py summarize_reviews): calls started per second,
+# retries of a rate limited or failed call, and seconds of backoff before
+# the first retry, doubled for each one after
+MISTRAL_REQUESTS_PER_SECOND = float(os.getenv("MISTRAL_REQUESTS_PER_SECOND", "1"))
+MISTRAL_RETRIES = 5
+MISTRAL_BACKOFF = 2
+
+# Mistral review summaries (see api/summaries.py)
+# Return an outdated summary while a new one is generated in the background
+REVIEW_SUMMARY_SERVE_STALE = False
+# Seconds a summary is served from the cache without checking the database
+REVIEW_SUMMARY_CACHE_TIMEOUT = 60
+# Estimated tokens of reviews per Mistral call, and that a single review is
+# cut to; movies with more are summarized in parts, then the parts combined
+REVIEW_SUMMARY_TOKEN_BUDGET = 8000
+REVIEW_SUMMARY_REVIEW_TOKENS = 500
+# Reviews a summary covers at most, 0 for all: the most "recent" or the
+# "longest" ones
+REVIEW_SUMMARY_SAMPLE_SIZE = 0
+REVIEW_SUMMARY_SAMPLE_BY = "recent"
+# Progress of an unfinished manage.py summarize_reviews run
+REVIEW_SUMMARY_CHECKPOINT_PATH = os.getenv(
+    "REVIEW_SUMMARY_CHECKPOINT_PATH", str(BASE_DIR / "var" / "summarize_reviews.json")
+)
+
+# Seconds movies/trending is served from the cache (see api/viewcounts.py)
+TRENDING_CACHE_TIMEOUT = 60
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
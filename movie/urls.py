@@ -20,6 +20,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from api.metrics import metrics_view
+
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -47,6 +49,8 @@ urlpatterns = [
          name="schema-redoc"
     ),
     path("api/v1/", include("api.urls")),
+    path("api/v1/async/", include("api.async_urls")),
     path("api/v1/auth/", include("djoser.urls")),
     path("api/v1/auth/", include("djoser.urls.authtoken")),
+    path("internal/metrics", metrics_view),
 ]
\ No newline at end of file
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'movie.settings')
 
 application = get_wsgi_application()
+
+# Write buffered movie view counts in the background (see api/viewcounts.py)
+from api.viewcounts import counter  # noqa: E402
+
+counter.start()